@@ -21,6 +21,13 @@ def init_agent_service():
         'model': 'qwen-max',
         'model_server': 'dashscope',
         'api_key': os.getenv('DASHSCOPE_API_KEY'),
+        # 语义缓存：检索到的知识相同、问题相似（向量余弦相似度 >= threshold）时直接复用之前的回答
+        # 单次调用可通过 extra_generate_cfg={'semantic_cache': False} 跳过
+        'semantic_cache': {
+            'threshold': 0.95,
+            'max_size': 1000,
+            'ttl': 3600
+        },
         'generate_cfg': {
             'top_p': 0.8
         }
@@ -0,0 +1,192 @@
+"""
+benchmark_async_chat - TextChatAtOAI 的同步 chat 与异步 achat / astream 的并发能力
+
+在本地启动一个假的 OpenAI 兼容服务（/v1/chat/completions，支持 stream=True 的 SSE），
+每个回复分成若干块返回，块之间有固定延迟，回复中带有停止词之后的多余内容。对比同样一批对话：
+  1. threads: 线程池里调用同步的 chat（ParallelDocQA 等目前的做法），并发数受线程数限制
+  2. achat:   一个事件循环里用 asyncio.gather 同时发出所有 achat
+  3. astream: 同 2，但用 astream 流式接收
+输出耗时、服务端观察到的最大并发请求数，并检查三种方式的结果一致、停止词已被截断。
+
+用法: python benchmark_async_chat.py --conversations 300 --threads 16 --chunks 5 --chunk-ms 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from qwen_agent.llm.oai import TextChatAtOAI
+from qwen_agent.log import logger
+
+STOP_WORD = 'Observation:'
+
+
+def fake_reply(query: str) -> str:
+    return f'关于「{query}」的回答。{STOP_WORD} 停止词之后的内容不应出现在结果中'
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # 默认的 5 在数百个连接同时到达时会丢弃连接
+
+    def __init__(self, num_chunks: int, chunk_latency: float):
+        super().__init__(('127.0.0.1', 0), FakeOpenAIHandler)
+        self.num_chunks = num_chunks
+        self.chunk_latency = chunk_latency
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server: FakeOpenAIServer
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        req = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            reply = fake_reply(req['messages'][-1]['content'])
+            step = -(-len(reply) // server.num_chunks)
+            pieces = [reply[i:i + step] for i in range(0, len(reply), step)]
+            if req.get('stream'):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for piece in pieces:
+                    time.sleep(server.chunk_latency)
+                    self._write_chunk(self._completion(req, {'delta': {'role': 'assistant', 'content': piece}}))
+                self._write_chunk('[DONE]')
+                self.wfile.write(b'0\r\n\r\n')
+            else:
+                time.sleep(server.chunk_latency * len(pieces))
+                data = json.dumps(self._completion(req, {'message': {'role': 'assistant', 'content': reply}}))
+                data = data.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    @staticmethod
+    def _completion(req: dict, choice: dict) -> dict:
+        return {
+            'id': 'chatcmpl-bench',
+            'object': 'chat.completion.chunk' if req.get('stream') else 'chat.completion',
+            'created': int(time.time()),
+            'model': req['model'],
+            'choices': [{
+                'index': 0,
+                'finish_reason': None,
+                **choice
+            }],
+        }
+
+    def _write_chunk(self, data):
+        if not isinstance(data, str):
+            data = json.dumps(data, ensure_ascii=False)
+        data = f'data: {data}\n\n'.encode('utf-8')
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+
+def make_messages(i: int) -> list:
+    return [{'role': 'user', 'content': f'第 {i} 个问题：等待期内身故如何理赔'}]
+
+
+def last_content(rsp: list) -> str:
+    return rsp[-1]['content']
+
+
+def run_threads(llm: TextChatAtOAI, conversations: list, num_threads: int) -> list:
+
+    def _chat(messages):
+        *_, rsp = llm.chat(messages, stream=True)
+        return last_content(rsp)
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        return list(executor.map(_chat, conversations))
+
+
+async def run_achat(llm: TextChatAtOAI, conversations: list) -> list:
+    rsps = await asyncio.gather(*[llm.achat(messages) for messages in conversations])
+    return [last_content(rsp) for rsp in rsps]
+
+
+async def run_astream(llm: TextChatAtOAI, conversations: list) -> list:
+
+    async def _stream(messages):
+        rsp = []
+        async for rsp in llm.astream(messages):
+            pass
+        return last_content(rsp)
+
+    return await asyncio.gather(*[_stream(messages) for messages in conversations])
+
+
+def timed(server: FakeOpenAIServer, fn, *args):
+    server.max_in_flight = 0
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - t0, server.max_in_flight
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--conversations', type=int, default=300)
+    parser.add_argument('--threads', type=int, default=16, help='同步 chat 使用的线程数')
+    parser.add_argument('--chunks', type=int, default=5, help='每个回复的流式块数')
+    parser.add_argument('--chunk-ms', type=float, default=20, help='每块的生成延迟')
+    args = parser.parse_args()
+    logger.setLevel(logging.WARNING)
+
+    server = FakeOpenAIServer(num_chunks=args.chunks, chunk_latency=args.chunk_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    llm = TextChatAtOAI({
+        'model': 'fake-model',
+        'model_server': f'http://127.0.0.1:{server.server_address[1]}/v1',
+        'api_key': 'fake',
+        'generate_cfg': {
+            'stop': [STOP_WORD],
+            'max_retries': 3,
+        },
+    })
+    conversations = [make_messages(i) for i in range(args.conversations)]
+    try:
+        expected, t_threads, peak_threads = timed(server, run_threads, llm, conversations, args.threads)
+        achat, t_achat, peak_achat = timed(server, lambda: asyncio.run(run_achat(llm, conversations)))
+        astream, t_astream, peak_astream = timed(server, lambda: asyncio.run(run_astream(llm, conversations)))
+    finally:
+        server.shutdown()
+
+    for i, content in enumerate(expected):
+        assert STOP_WORD not in content and content == fake_reply(conversations[i][0]['content']).split(STOP_WORD)[0]
+    assert achat == expected, '结果不一致: achat'
+    assert astream == expected, '结果不一致: astream'
+
+    n = args.conversations
+    print(f'对话数: {n}，每个回复 {args.chunks} 块 x {args.chunk_ms:.0f} ms')
+    print(f'threads ({args.threads} 线程): {t_threads:.2f} s ({n / t_threads:.0f} 对话/s), 最大并发 {peak_threads}')
+    print(f'achat:   {t_achat:.2f} s ({n / t_achat:.0f} 对话/s, {t_threads / t_achat:.1f}x), 最大并发 {peak_achat}')
+    print(f'astream: {t_astream:.2f} s ({n / t_astream:.0f} 对话/s, {t_threads / t_astream:.1f}x), '
+          f'最大并发 {peak_astream}')
+
+
+if __name__ == '__main__':
+    main()
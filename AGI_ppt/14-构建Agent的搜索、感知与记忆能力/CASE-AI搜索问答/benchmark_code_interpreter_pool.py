@@ -0,0 +1,111 @@
+"""
+benchmark_code_interpreter_pool - CodeInterpreter 每个会话第一次调用的延迟（内核预热池）
+
+每个会话新建一个 CodeInterpreter，执行一段代码后释放，会话之间间隔 --think 秒。对比：
+  1. cold:    kernel_pool_size=0，每个会话第一次调用时才启动内核并执行初始化代码（旧实现）
+  2. restart: 池中保持 --pool-size 个已初始化的内核，用过的内核在后台重启
+  3. reset:   同 2，用过的内核在后台 %reset 后重新初始化，不重启进程
+  4. burst:   --burst 个会话同时开始，超过池大小的会话需要等待或冷启动
+输出第一次调用的 p50 / max、池的指标（等待时间、冷启动次数等），
+最后检查单个内核的内存 / CPU 限制：超出内存时代码得到 MemoryError，超出 CPU 时间时内核被杀掉、下一次调用换新内核。
+
+用法: python benchmark_code_interpreter_pool.py --sessions 6 --think 8 --pool-size 1 --burst 3
+"""
+import argparse
+import gc
+import json
+import logging
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+from qwen_agent.log import logger
+from qwen_agent.tools.code_interpreter import CodeInterpreter, get_kernel_pool, get_kernel_pool_metrics
+
+CODE = json.dumps({'code': 'import numpy as np\nprint(np.arange(10).sum())'})
+
+
+def first_call(cfg: dict) -> float:
+    tool = CodeInterpreter(cfg)
+    t0 = time.perf_counter()
+    result = tool.call(CODE)
+    latency = time.perf_counter() - t0
+    assert '45' in result, result
+    del tool
+    gc.collect()  # 释放会话，内核回到池中回收
+    return latency
+
+
+def run_sessions(name: str, cfg: dict, args) -> dict:
+    get_kernel_pool(cfg['work_dir'], size=cfg['kernel_pool_size'], recycle=cfg.get('kernel_recycle', 'restart'))
+    time.sleep(args.think)  # 预热
+    latencies = []
+    for _ in range(args.sessions):
+        latencies.append(first_call(cfg))
+        time.sleep(args.think)
+    metrics = get_kernel_pool_metrics()[cfg['work_dir']]
+    print(f'{name:8s} 第一次调用 p50 {statistics.median(latencies):6.2f} s，max {max(latencies):6.2f} s，'
+          f'冷启动 {metrics["cold_starts"]}/{metrics["checkouts"]}，平均等待 {metrics["checkout_wait_avg"]:.2f} s')
+    return metrics
+
+
+def run_burst(cfg: dict, args):
+    get_kernel_pool(cfg['work_dir'], size=cfg['kernel_pool_size'])
+    time.sleep(args.think * args.pool_size)  # 预热
+    latencies = []
+    threads = [threading.Thread(target=lambda: latencies.append(first_call(cfg))) for _ in range(args.burst)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    metrics = get_kernel_pool_metrics()[cfg['work_dir']]
+    print(f'burst    {args.burst} 个会话同时开始：第一次调用 {", ".join(f"{x:.2f}" for x in sorted(latencies))} s，'
+          f'冷启动 {metrics["cold_starts"]}，最长等待 {metrics["checkout_wait_max"]:.2f} s')
+
+
+def check_limits(workspace: str):
+    tool = CodeInterpreter({
+        'work_dir': f'{workspace}/limits',
+        'kernel_pool_size': 0,
+        'kernel_max_memory_mb': 2048,
+        'kernel_max_cpu_seconds': 20,
+    })
+    result = tool.call(json.dumps({'code': 'x = bytearray(4 * 1024 ** 3)'}))
+    print(f'内存限制 2 GB，申请 4 GB: {"MemoryError" if "MemoryError" in result else result}')
+    result = tool.call(json.dumps({'code': 'while True:\n    pass'}), timeout=60)
+    print(f'CPU 限制 20 s，死循环: {"内核被杀掉" if "exited unexpectedly" in result else result}')
+    result = tool.call(CODE)
+    print(f'下一次调用: {"正常" if "45" in result else result}，'
+          f'指标 {get_kernel_pool_metrics()[f"{workspace}/limits"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=6)
+    parser.add_argument('--think', type=float, default=8, help='会话之间的间隔（秒），池在这段时间里补充内核')
+    parser.add_argument('--pool-size', type=int, default=1)
+    parser.add_argument('--burst', type=int, default=3)
+    parser.add_argument('--skip-limits', action='store_true')
+    args = parser.parse_args()
+    logger.setLevel(logging.CRITICAL)  # 环境中缺少字体文件时的报错与这里无关
+
+    workspace = tempfile.mkdtemp()
+    try:
+        run_sessions('cold', {'work_dir': f'{workspace}/cold', 'kernel_pool_size': 0}, args)
+        run_sessions('restart', {'work_dir': f'{workspace}/restart', 'kernel_pool_size': args.pool_size}, args)
+        run_sessions('reset', {
+            'work_dir': f'{workspace}/reset',
+            'kernel_pool_size': args.pool_size,
+            'kernel_recycle': 'reset'
+        }, args)
+        run_burst({'work_dir': f'{workspace}/burst', 'kernel_pool_size': args.pool_size}, args)
+        if not args.skip_limits:
+            check_limits(workspace)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
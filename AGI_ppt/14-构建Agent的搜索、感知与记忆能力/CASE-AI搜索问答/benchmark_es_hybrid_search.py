@@ -0,0 +1,109 @@
+"""
+benchmark_es_hybrid_search - ElasticsearchSearcher 混合搜索的延迟
+
+复用 benchmark_es_indexing.py 中的本地假服务（embedding 与 ES 请求均有固定延迟），对比：
+  1. baseline: 先生成查询向量，再依次发出关键词查询与 kNN 查询（旧实现）
+  2. hybrid:   关键词查询与查询向量的生成重叠，之后发出 kNN 查询，本地用 numpy 做加权 RRF
+  3. cached:   同 2，但查询向量命中缓存（重复的问题）
+并检查融合出的结果一致。
+
+用法: python benchmark_es_hybrid_search.py --queries 30 --embedding-ms 40 --search-ms 30
+"""
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from benchmark_es_indexing import FakeServer
+from qwen_agent.searcher.elasticsearch_searcher import HYBRID_MODES, ElasticsearchSearcher
+from qwen_agent.utils.embedding_cache import EmbeddingCache
+
+
+def baseline_hybrid_search(searcher: ElasticsearchSearcher, query: str) -> list:
+    """旧实现：embedding、关键词查询、kNN 查询串行执行，再用 Python 循环做加权 RRF"""
+    mode = HYBRID_MODES[searcher.hybrid_mode]
+    query_vector = searcher._get_embedding(query)
+    bm25_body = {"query": {"match": {"content": query}}, "size": 6}
+    bm25_hits = searcher.client.search(index=searcher.index_name, body=bm25_body)['hits']['hits']
+    knn_body = {
+        "knn": {
+            "field": "vector_content",
+            "query_vector": query_vector,
+            "k": 6,
+            "num_candidates": 1000
+        },
+        "size": 6
+    }
+    knn_hits = searcher.client.search(index=searcher.index_name, body=knn_body)['hits']['hits']
+    rrf_scores = {}
+    for rank, hit in enumerate(bm25_hits):
+        rrf_scores[hit['_id']] = {"score": mode['bm25_weight'] / (mode['rrf_k'] + rank + 1), "hit": hit}
+    for rank, hit in enumerate(knn_hits):
+        score = mode['knn_weight'] / (mode['rrf_k'] + rank + 1)
+        if hit['_id'] in rrf_scores:
+            rrf_scores[hit['_id']]["score"] += score
+        else:
+            rrf_scores[hit['_id']] = {"score": score, "hit": hit}
+    sorted_hits = sorted(rrf_scores.values(), key=lambda x: x["score"], reverse=True)
+    return [x["hit"]['_id'] for x in sorted_hits[:6]]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=30)
+    parser.add_argument('--embedding-ms', type=float, default=40, help='查询向量的生成延迟')
+    parser.add_argument('--search-ms', type=float, default=30, help='每个 ES 查询的延迟')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    os.environ.setdefault('DASHSCOPE_API_KEY', 'fake')  # 请求只发往本地的假服务
+
+    server = FakeServer(latency=args.embedding_ms / 1000, max_concurrency=100, search_latency=args.search_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    try:
+        with tempfile.TemporaryDirectory() as workspace:
+            searcher = ElasticsearchSearcher({
+                'path': workspace,
+                'es': {
+                    'host': 'http://127.0.0.1',
+                    'port': port,
+                    'index_name': 'bench_idx',
+                    'search_type': 'hybrid',
+                    'embedding_base_url': f'http://127.0.0.1:{port}/v1',
+                    'embedding_dims': 16,
+                }
+            })
+            queries = [f'等待期内身故如何理赔 {i}' for i in range(args.queries)]
+            searcher.query_cache = EmbeddingCache(max_size=0)  # 先测不命中缓存的情况
+            baseline, hybrid, cached = [], [], []
+            for query in queries:
+                t0 = time.perf_counter()
+                expected = baseline_hybrid_search(searcher, query)
+                baseline.append((time.perf_counter() - t0) * 1000)
+                t0 = time.perf_counter()
+                hits = searcher._hybrid_search(query)
+                hybrid.append((time.perf_counter() - t0) * 1000)
+                assert [hit['_id'] for hit in hits] == expected, ([hit['_id'] for hit in hits], expected)
+
+            searcher.query_cache = EmbeddingCache()
+            for query in queries:
+                searcher._get_embedding(query)
+            for query in queries:
+                t0 = time.perf_counter()
+                searcher._hybrid_search(query)
+                cached.append((time.perf_counter() - t0) * 1000)
+    finally:
+        server.shutdown()
+
+    p50_baseline, p50_hybrid = statistics.median(baseline), statistics.median(hybrid)
+    print(f'baseline (串行): p50 {p50_baseline:.1f} ms')
+    print(f'hybrid (重叠):   p50 {p50_hybrid:.1f} ms ({p50_hybrid / p50_baseline:.0%} of baseline)')
+    p50_cached = statistics.median(cached)
+    print(f'cached (命中):   p50 {p50_cached:.1f} ms ({p50_cached / p50_baseline:.0%} of baseline)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""
+benchmark_es_indexing - ElasticsearchSearcher.index_files 的建索引耗时
+
+在本地启动一个假的 HTTP 服务，同时充当：
+  1. embedding 服务: OpenAI 兼容的 /v1/embeddings，每次请求有固定延迟，并发超过上限时返回 429
+  2. Elasticsearch: 只实现 index_files 用到的 ping / exists / 建索引 / _mget / _bulk / _refresh，
+     以及供 benchmark_es_hybrid_search.py 使用的 _search（返回固定的结果，有固定延迟）
+对比两种配置下索引同样一批块的耗时：
+  - baseline: embedding_batch_size=1, embedding_max_workers=1（与逐块串行请求相同）
+  - batched:  按批、多线程并发请求 embedding，streaming_bulk 边生成边写入
+并检查 mapping 的向量维度与 embedding_dims 一致、每个写入 ES 的向量长度与 mapping 相同且对应自己的文本、没有文档丢失。
+
+用法: python benchmark_es_indexing.py --chunks 1000 --latency-ms 20 --max-concurrency 4
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from qwen_agent.searcher.elasticsearch_searcher import ElasticsearchSearcher
+
+
+def fake_embedding(text: str, dims: int) -> list:
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return [digest[i % len(digest)] / 255 for i in range(dims)]
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float, max_concurrency: int, max_batch_size: int = 10, search_latency: float = 0):
+        super().__init__(('127.0.0.1', 0), FakeHandler)
+        self.latency = latency
+        self.search_latency = search_latency
+        self.max_concurrency = max_concurrency
+        self.max_batch_size = max_batch_size
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.embedding_requests = 0
+        self.rate_limited = 0
+        self.bulk_requests = 0
+        self.refreshes = 0
+        self.docs = {}
+        self.index_dims = {}  # 索引名 -> mapping 中向量字段的维度
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    server: FakeServer
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body=None, headers: dict = None):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_HEAD(self):
+        index = self.path.split('?')[0].strip('/')
+        if index and index not in self.server.index_dims:
+            return self._reply(404)  # 索引不存在，由 searcher 创建
+        self._reply(200)  # ping 与索引存在检查
+
+    def do_GET(self):
+        self._reply(200, {'version': {'number': '8.15.0'}})
+
+    def do_PUT(self):
+        index = self.path.split('?')[0].strip('/')
+        if '/' not in index and not index.startswith('_'):  # 建索引，其余的 PUT 与 POST 相同
+            mapping = json.loads(self._read_body())['mappings']['properties']['vector_content']
+            with self.server.lock:
+                self.server.index_dims[index] = mapping['dims']
+            return self._reply(200, {'acknowledged': True, 'index': index})
+        self.do_POST()
+
+    def do_POST(self):
+        body = self._read_body()
+        server = self.server
+        if self.path.endswith('/embeddings'):
+            req = json.loads(body)
+            with server.lock:
+                server.embedding_requests += 1
+                if server.in_flight >= server.max_concurrency:
+                    server.rate_limited += 1
+                    return self._reply(429, {'error': {'message': 'rate limited', 'code': 'Throttling'}})
+                server.in_flight += 1
+            try:
+                inputs = req['input'] if isinstance(req['input'], list) else [req['input']]
+                if len(inputs) > server.max_batch_size:
+                    return self._reply(400, {'error': {'message': 'batch size is invalid'}})
+                time.sleep(server.latency)
+                data = [{
+                    'object': 'embedding',
+                    'index': i,
+                    'embedding': fake_embedding(x, req['dimensions'])
+                } for i, x in enumerate(inputs)]
+                return self._reply(200, {
+                    'object': 'list',
+                    'data': data,
+                    'model': req['model'],
+                    'usage': {
+                        'prompt_tokens': 0,
+                        'total_tokens': 0
+                    }
+                })
+            finally:
+                with server.lock:
+                    server.in_flight -= 1
+        elif self.path.split('?')[0].endswith('/_mget'):
+            ids = json.loads(body)['ids']
+            return self._reply(200, {'docs': [{'_id': x, 'found': False} for x in ids]})
+        elif self.path.split('?')[0].endswith('/_bulk'):
+            lines = [json.loads(x) for x in body.splitlines() if x.strip()]
+            items = []
+            for action, source in zip(lines[::2], lines[1::2]):
+                meta = action['index']
+                dims = server.index_dims.get(meta['_index'])
+                if dims != len(source['vector_content']):
+                    return self._reply(400, {
+                        'error': f'vector_content has {len(source["vector_content"])} dims, mapping has {dims}'
+                    })
+                with server.lock:
+                    server.docs[meta['_id']] = source
+                items.append({'index': {'_index': meta['_index'], '_id': meta['_id'], 'status': 201}})
+            with server.lock:
+                server.bulk_requests += 1
+            return self._reply(200, {'took': 1, 'errors': False, 'items': items})
+        elif self.path.split('?')[0].endswith('/_search'):
+            req = json.loads(body)
+            time.sleep(server.search_latency)
+            # 关键词与向量检索返回部分重叠的结果
+            offset = 3 if 'knn' in req else 0
+            hits = [{
+                '_id': f'doc_{i}',
+                '_score': 1 / (i + 1),
+                '_source': {
+                    'content': f'内容 {i}',
+                    'source': 'bench.txt',
+                    'token': 10
+                }
+            } for i in range(offset, offset + req.get('size', 10))]
+            return self._reply(200, {'took': 1, 'hits': {'total': {'value': len(hits)}, 'hits': hits}})
+        elif self.path.split('?')[0].endswith('/_refresh'):
+            with server.lock:
+                server.refreshes += 1
+            return self._reply(200, {'_shards': {'total': 1, 'successful': 1, 'failed': 0}})
+        return self._reply(404, {'error': self.path})
+
+
+class BenchSearcher(ElasticsearchSearcher):
+
+    def __init__(self, cfg: dict, chunks: list):
+        self._chunks = chunks
+        super().__init__(cfg)
+
+    def _get_chunks(self, files: list) -> list:
+        return [dict(chunk, metadata=dict(chunk['metadata'])) for chunk in self._chunks]
+
+
+def make_chunks(num_chunks: int) -> list:
+    return [{
+        'content': f'第 {i} 条保险条款：被保险人在等待期内因疾病身故的，本公司退还已交保费。clause {i}',
+        'metadata': {
+            'source': f'bench_{i // 100}.txt',
+            'chunk_id': i % 100
+        },
+        'token': 30
+    } for i in range(num_chunks)]
+
+
+def run(server: FakeServer, chunks: list, dims: int, workspace: str, **es_cfg) -> float:
+    port = server.server_address[1]
+    cfg = {
+        'path': workspace,
+        'es': {
+            'host': 'http://127.0.0.1',
+            'port': port,
+            'index_name': 'bench_idx',
+            'embedding_base_url': f'http://127.0.0.1:{port}/v1',
+            'embedding_dims': dims,
+            'embedding_initial_backoff': 0.05,
+            **es_cfg,
+        }
+    }
+    server.index_dims.clear()
+    searcher = BenchSearcher(cfg, chunks)
+    assert server.index_dims == {'bench_idx': dims}, server.index_dims
+    server.docs.clear()
+    t0 = time.perf_counter()
+    searcher.index_files(['bench.txt'])
+    elapsed = time.perf_counter() - t0
+
+    assert len(server.docs) == len(chunks), (len(server.docs), len(chunks))
+    for source in server.docs.values():
+        assert source['vector_content'] == fake_embedding(source['content'], dims)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, default=20, help='每个 embedding 请求的延迟')
+    parser.add_argument('--max-concurrency', type=int, default=4, help='embedding 服务允许的并发数，超过时返回 429')
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=8, help='大于 --max-concurrency 时会触发 429 重试')
+    parser.add_argument('--dims', type=int, default=16)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    os.environ.setdefault('DASHSCOPE_API_KEY', 'fake')  # 请求只发往本地的假服务
+
+    server = FakeServer(latency=args.latency_ms / 1000, max_concurrency=args.max_concurrency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    chunks = make_chunks(args.chunks)
+    try:
+        with tempfile.TemporaryDirectory() as workspace:
+            baseline = run(server, chunks, args.dims, workspace, embedding_batch_size=1, embedding_max_workers=1)
+            server.embedding_requests = server.rate_limited = server.bulk_requests = 0
+            batched = run(server,
+                          chunks,
+                          args.dims,
+                          workspace,
+                          embedding_batch_size=args.batch_size,
+                          embedding_max_workers=args.workers)
+    finally:
+        server.shutdown()
+
+    print(f'块数: {len(chunks)}')
+    print(f'baseline (逐块串行): {baseline:.2f} s ({len(chunks) / baseline:.0f} 块/s)')
+    print(f'batched:             {batched:.2f} s ({len(chunks) / batched:.0f} 块/s, {baseline / batched:.1f}x)')
+    print(f'  embedding 请求 {server.embedding_requests} 次，其中 429 {server.rate_limited} 次；'
+          f'bulk 请求 {server.bulk_requests} 次')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+benchmark_hybrid_search - HybridSearch（keyword_search + vector_search + front_page_search）的检索耗时
+
+vector_search 使用本地的假 embedding：查询向量由词的哈希向量相加得到，每次 embed_query 等待 --embedding-ms，
+模拟请求 DashScope 的网络延迟。对同一批查询对比：
+  1. baseline: 各子检索器依次执行，再对所有文档的所有分块计算 RRF 分数并整体排序（旧实现）
+  2. parallel: 子检索器在线程池中并发执行，RRF 只取每个子检索器排名靠前、足以填满 max_ref_token 的部分
+输出 search()（打分 + 取 top-k）的 p50 / p95、融合步骤本身的耗时，并比较两种方式取回的分块。
+
+用法: python benchmark_hybrid_search.py --pages 20000 --queries 20 --embedding-ms 60
+"""
+import argparse
+import hashlib
+import logging
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark_keyword_search import VOCAB, make_docs
+from qwen_agent.log import logger
+from qwen_agent.tools.search_tools.front_page_search import POSITIVE_INFINITY
+from qwen_agent.tools.search_tools.hybrid_search import HybridSearch
+
+DIMS = 64
+
+
+class SlowHashEmbeddings:
+    """词的哈希向量之和；embed_query 有固定延迟"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    @staticmethod
+    def _embed(text: str) -> list:
+        vec = np.zeros(DIMS)
+        for word in text.split():
+            seed = int.from_bytes(hashlib.sha256(word.encode('utf-8')).digest()[:4], 'little')
+            vec += np.random.default_rng(seed).standard_normal(DIMS)
+        return (vec / (np.linalg.norm(vec) or 1)).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> list:
+        time.sleep(self.latency)
+        return self._embed(text)
+
+
+def baseline_sort_by_scores(search: HybridSearch, query: str, docs: list, **kwargs) -> list:
+    """旧实现：子检索器串行执行，对每个分块计算 RRF 分数后整体排序"""
+    chunk_and_score_list = []
+    for s_obj in search.search_objs:
+        chunk_and_score_list.append(s_obj.sort_by_scores(query=query, docs=docs, **kwargs))
+
+    chunk_score_map = {}
+    for doc in docs:
+        chunk_score_map[doc.url] = [0] * len(doc.raw)
+
+    for chunk_and_score in chunk_and_score_list:
+        for i in range(len(chunk_and_score)):
+            doc_id = chunk_and_score[i][0]
+            chunk_id = chunk_and_score[i][1]
+            score = chunk_and_score[i][2]
+            if score == POSITIVE_INFINITY:
+                chunk_score_map[doc_id][chunk_id] = POSITIVE_INFINITY
+            else:
+                chunk_score_map[doc_id][chunk_id] += 1 / (i + 1 + 60)
+
+    all_chunk_and_score = []
+    for k, v in chunk_score_map.items():
+        for i, x in enumerate(v):
+            all_chunk_and_score.append((k, i, x))
+    all_chunk_and_score.sort(key=lambda item: item[2], reverse=True)
+    return all_chunk_and_score
+
+
+def retrieved_chunks(res: list) -> set:
+    return {(x['url'], text) for x in res for text in x['text']}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=4)
+    parser.add_argument('--pages', type=int, default=20000, help='总页数（分块数）')
+    parser.add_argument('--words', type=int, default=60, help='每个分块的词数')
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--max-ref-token', type=int, default=4000)
+    parser.add_argument('--embedding-ms', type=float, default=60, help='每次 embed_query 的延迟')
+    args = parser.parse_args()
+    logger.setLevel(logging.WARNING)
+
+    docs = make_docs(args.docs, args.pages // args.docs, args.words)
+    rng = np.random.default_rng(1)
+    queries = [' '.join(rng.choice(VOCAB, 3, replace=False)) for _ in range(args.queries)]
+
+    workspace = tempfile.mkdtemp()
+    try:
+        search = HybridSearch({
+            'path': workspace,
+            'rag_searchers': ['keyword_search', 'vector_search', 'front_page_search'],
+            'embeddings': SlowHashEmbeddings(args.embedding_ms / 1000),
+        })
+        search.search(queries[0], docs, max_ref_token=args.max_ref_token)  # 建索引
+
+        baseline, parallel, fuse_old, fuse_new, overlap = [], [], [], [], []
+        for query in queries:
+            t0 = time.perf_counter()
+            chunk_and_score = baseline_sort_by_scores(search, query, docs, max_ref_token=args.max_ref_token)
+            old_res = search.get_topk(chunk_and_score, docs, max_ref_token=args.max_ref_token)
+            baseline.append((time.perf_counter() - t0) * 1000)
+
+            t0 = time.perf_counter()
+            new_res = search.search(query, docs, max_ref_token=args.max_ref_token)
+            parallel.append((time.perf_counter() - t0) * 1000)
+
+            old_chunks, new_chunks = retrieved_chunks(old_res), retrieved_chunks(new_res)
+            overlap.append(len(old_chunks & new_chunks) / len(old_chunks | new_chunks))
+
+        # 只计融合：子检索器的结果已经算好
+        query = queries[0]
+        lists = [s_obj.sort_by_scores(query=query, docs=docs, max_ref_token=args.max_ref_token)
+                 for s_obj in search.search_objs]
+        for s_obj in search.search_objs:
+            s_obj.sort_by_scores = lambda *a, _lists=lists, _i=search.search_objs.index(s_obj), **kw: _lists[_i]
+        for _ in range(5):
+            t0 = time.perf_counter()
+            baseline_sort_by_scores(search, query, docs, max_ref_token=args.max_ref_token)
+            fuse_old.append((time.perf_counter() - t0) * 1000)
+            t0 = time.perf_counter()
+            search.sort_by_scores(query, docs, max_ref_token=args.max_ref_token)
+            fuse_new.append((time.perf_counter() - t0) * 1000)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    print(f'分块数: {sum(len(d.raw) for d in docs)}，max_ref_token: {args.max_ref_token}，'
+          f'embedding 延迟: {args.embedding_ms:.0f} ms')
+    for name, latencies in [('baseline', baseline), ('parallel', parallel)]:
+        print(f'{name}: p50 {statistics.median(latencies):.1f} ms, p95 {np.percentile(latencies, 95):.1f} ms')
+    print(f'融合: {statistics.median(fuse_old):.1f} ms -> {statistics.median(fuse_new):.1f} ms')
+    print(f'取回的分块与 baseline 的重合度 (Jaccard): 平均 {np.mean(overlap):.2f}，最低 {min(overlap):.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+benchmark_import_time - qwen_agent 冷启动耗时
+
+统计两部分耗时（每次都在新的子进程中测量）：
+  1. import:    python -X importtime -c "import qwen_agent" 的累计耗时，以及自身耗时最多的模块
+  2. tokenizer: 首次调用 count_tokens 的耗时（词表缓存为空 / 已缓存）
+
+用法: python benchmark_import_time.py --runs 5 [--max-import-ms 1500]
+  设置 --max-import-ms 后，import 耗时的中位数超过该值时以非 0 状态码退出，可用于 CI 中跟踪回归。
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+FIRST_USE_SCRIPT = """
+import time
+from qwen_agent.utils.tokenization_qwen import count_tokens
+t0 = time.perf_counter()
+count_tokens('hello 你好')
+print((time.perf_counter() - t0) * 1000)
+"""
+
+
+def run_importtime() -> dict:
+    """返回 {模块名: (自身耗时 us, 累计耗时 us)}"""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import qwen_agent'],
+                          capture_output=True,
+                          text=True,
+                          check=True)
+    res = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        res[name.strip()] = (int(self_us), int(cumulative_us))
+    return res
+
+
+def run_first_use(cache_dir: str) -> float:
+    env = dict(os.environ, QWEN_AGENT_TOKENIZER_CACHE_DIR=cache_dir)
+    proc = subprocess.run([sys.executable, '-c', FIRST_USE_SCRIPT], capture_output=True, text=True, check=True, env=env)
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='打印自身耗时最多的模块数')
+    parser.add_argument('--max-import-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    runs = [run_importtime() for _ in range(args.runs)]
+    import_ms = statistics.median(r['qwen_agent'][1] / 1000 for r in runs)
+    tokenization_ms = statistics.median(r.get('qwen_agent.utils.tokenization_qwen', (0, 0))[1] / 1000 for r in runs)
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cold = run_first_use(cache_dir)
+        warm = statistics.median(run_first_use(cache_dir) for _ in range(args.runs))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print(f'import qwen_agent:                {import_ms:.1f} ms (p50)')
+    print(f'  of which tokenization_qwen:     {tokenization_ms:.1f} ms')
+    print(f'first count_tokens, cold cache:   {cold:.1f} ms')
+    print(f'first count_tokens, warm cache:   {warm:.1f} ms (p50)')
+    print(f'top {args.top} modules by self time:')
+    for name, (self_us, _) in sorted(runs[-1].items(), key=lambda x: -x[1][0])[:args.top]:
+        print(f'  {self_us / 1000:8.1f} ms  {name}')
+
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print(f'import time {import_ms:.1f} ms exceeds {args.max_import_ms} ms')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
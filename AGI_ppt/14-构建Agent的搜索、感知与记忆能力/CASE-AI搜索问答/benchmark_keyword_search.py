@@ -0,0 +1,98 @@
+"""
+benchmark_keyword_search - KeywordSearch 查询耗时对比
+
+对比三种情况下 sort_by_scores 的耗时：
+  1. baseline: 每次查询都重新分词并构建 BM25Okapi（旧实现）
+  2. cold:     首次查询，需要为每个文档构建并持久化倒排索引
+  3. warm:     索引已在内存 / 磁盘中，只需按查询词打分
+
+用法: python benchmark_keyword_search.py --pages 2000 --queries 20
+"""
+import argparse
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from qwen_agent.tools.doc_parser import Chunk, Record
+from qwen_agent.tools.search_tools.keyword_search import (TOKEN_CACHE, KeywordSearch, parse_keyword,
+                                                          split_text_into_keywords)
+
+VOCAB = ['保险', '理赔', '保费', '合同', '责任', '免除', '等待期', '身故', '重大疾病', '医疗', '住院', '年金', '分红',
+         '受益人', '投保人', '被保险人', '犹豫期', '退保', '现金价值', 'policy', 'claim', 'premium', 'coverage',
+         'benefit', 'insured', 'hospital', 'annuity', 'dividend', 'surrender', 'beneficiary']
+
+
+def make_docs(num_docs: int, pages_per_doc: int, words_per_page: int) -> list:
+    rng = random.Random(0)
+    docs = []
+    for d in range(num_docs):
+        url = f'bench_doc_{d}.pdf'
+        raw = []
+        for i in range(pages_per_doc):
+            content = ' '.join(rng.choice(VOCAB) for _ in range(words_per_page))
+            metadata = {'source': url, 'title': url, 'chunk_id': i}
+            raw.append(Chunk(content=content, metadata=metadata, token=words_per_page))
+        docs.append(Record(url=url, raw=raw, title=url))
+    return docs
+
+
+def baseline_sort_by_scores(query: str, docs: list) -> list:
+    from rank_bm25 import BM25Okapi
+    TOKEN_CACHE.clear()  # 旧实现没有分词缓存
+    wordlist = parse_keyword(query)
+    all_chunks = []
+    for doc in docs:
+        all_chunks.extend(doc.raw)
+    bm25 = BM25Okapi([split_text_into_keywords(x.content) for x in all_chunks])
+    doc_scores = bm25.get_scores(wordlist)
+    chunk_and_score = [
+        (chk.metadata['source'], chk.metadata['chunk_id'], score) for chk, score in zip(all_chunks, doc_scores)
+    ]
+    chunk_and_score.sort(key=lambda item: item[2], reverse=True)
+    return chunk_and_score
+
+
+def timeit(fn, *args) -> float:
+    t0 = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - t0) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=4)
+    parser.add_argument('--pages', type=int, default=2000, help='总页数（分块数）')
+    parser.add_argument('--words', type=int, default=120, help='每个分块的词数')
+    parser.add_argument('--queries', type=int, default=20)
+    args = parser.parse_args()
+
+    docs = make_docs(args.docs, args.pages // args.docs, args.words)
+    rng = random.Random(1)
+    queries = [' '.join(rng.sample(VOCAB, 3)) for _ in range(args.queries)]
+
+    workspace = tempfile.mkdtemp()
+    try:
+        search = KeywordSearch({'path': workspace})
+        baseline = [timeit(baseline_sort_by_scores, q, docs) for q in queries[:3]]
+        TOKEN_CACHE.clear()
+        cold = timeit(search.sort_by_scores, queries[0], docs)
+        warm = [timeit(search.sort_by_scores, q, docs) for q in queries]
+        # 新进程：内存中没有索引，从磁盘加载
+        disk = timeit(KeywordSearch({'path': workspace}).sort_by_scores, queries[0], docs)
+
+        assert [x[:2] for x in baseline_sort_by_scores(queries[0], docs)[:10]] == \
+               [x[:2] for x in search.sort_by_scores(queries[0], docs)[:10]]
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    print(f'分块数: {sum(len(d.raw) for d in docs)}')
+    print(f'baseline (每次重建 BM25): {statistics.median(baseline):.1f} ms/query')
+    print(f'cold (首次构建索引):      {cold:.1f} ms')
+    print(f'warm from disk:           {disk:.1f} ms')
+    print(f'warm in memory:           {statistics.median(warm):.1f} ms/query (p50)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+benchmark_parallel_doc_qa - ParallelDocQA 每个问题的 LLM 调用数与耗时
+
+使用本地的假 LLM（每次调用等待 --latency 秒）和合成的 txt 文档（--chunks 个 1000 token 的分块），
+只有 --needles 个分块包含问题的答案，其余分块的成员回答 none。对同一个问题对比：
+  1. baseline: 旧实现，所有分块的成员一次全部提交（jitter=0.5），全部结束后再生成关键词、检索、总结
+  2. scheduled: 成员按分块的 BM25 预评分依次启动，拿到 MIN_MEMBER_ANSWERS 个回答后不再启动新的成员；
+               关键词生成和检索的文档解析与成员并行
+  3. cached: 再问一次同样的问题，成员的回答来自缓存
+  4. follow-up: 同样的问题前面多一轮对话，成员看到的上下文不同，不复用 3 的缓存
+输出 LLM 调用数（成员 / 关键词 / 总结）、总耗时，以及三者取回的参考资料是否都包含答案。
+
+用法: python benchmark_parallel_doc_qa.py --chunks 40 --needles 3 --latency 0.8
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterator, List
+
+from qwen_agent.agents.doc_qa import parallel_doc_qa
+from qwen_agent.agents.doc_qa.parallel_doc_qa import MAX_NO_RESPONSE_RETRY, ParallelDocQA
+from qwen_agent.llm.function_calling import BaseFnCallModel
+from qwen_agent.llm.schema import ASSISTANT, USER, Message
+from qwen_agent.log import logger
+from qwen_agent.utils.parallel_executor import parallel_exec
+from qwen_agent.utils.utils import extract_text_from_message
+
+FILLER = ['river', 'market', 'engine', 'garden', 'signal', 'winter', 'harbor', 'ladder', 'copper', 'meadow', 'planet',
+          'window', 'basket', 'canyon', 'violin', 'tunnel', 'forest', 'button', 'marble', 'pepper', 'rocket', 'saddle']
+QUESTION = 'What is the launch code of project Aurora?'
+NEEDLE = 'The launch code of project Aurora is {code}.'
+
+
+class FakeLLM(BaseFnCallModel):
+    """按提示词区分成员 / 关键词生成 / 总结，成员只在分块包含答案时回答"""
+
+    def __init__(self, latency: float):
+        super().__init__({'model': 'fake-llm'})
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _reply(self, messages: List[Message]) -> str:
+        prompt = extract_text_from_message(messages[-1], add_upload_info=False)
+        if '"keywords_zh"' in prompt:
+            kind, text = 'keygen', json.dumps({'keywords_zh': ['发射', '代码'], 'keywords_en': ['launch', 'code', 'Aurora']})
+        elif 'Document:' in prompt:
+            kind = 'member'
+            if 'Aurora is' in prompt:
+                text = json.dumps({'res': 'ans', 'content': prompt[prompt.index('The launch code'):].split('.')[0]})
+            else:
+                text = json.dumps({'res': 'none', 'content': parallel_doc_qa.NO_RESPONSE})
+        else:
+            kind, text = 'summary', 'The launch code of project Aurora is in the knowledge base.'
+        with self._lock:
+            self.calls[kind] += 1
+        time.sleep(self.latency)
+        return text
+
+    def _chat_stream(self, messages: List[Message], delta_stream: bool, generate_cfg: dict) -> Iterator[List[Message]]:
+        yield [Message(ASSISTANT, self._reply(messages))]
+
+    def _chat_no_stream(self, messages: List[Message], generate_cfg: dict) -> List[Message]:
+        return [Message(ASSISTANT, self._reply(messages))]
+
+
+def make_doc(path: str, chunks: int, needles: int, rng: random.Random):
+    """每个分块约 1000 token（一段 700 个词），答案分散在 needles 个随机的分块中"""
+    needle_chunks = set(rng.sample(range(chunks), needles))
+    paragraphs = []
+    for i in range(chunks):
+        words = [rng.choice(FILLER) for _ in range(700)]
+        if i in needle_chunks:
+            words.insert(rng.randrange(len(words)), NEEDLE.format(code=rng.randint(1000, 9999)))
+        paragraphs.append(' '.join(words))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join(paragraphs))
+    return sorted(needle_chunks)
+
+
+def baseline_run(agent: ParallelDocQA, messages: List[Message], lang: str = 'en') -> Iterator[List[Message]]:
+    """旧实现的 ParallelDocQA._run：所有成员全部结束后，才用问题和成员的回答生成关键词并检索"""
+    user_question = extract_text_from_message(messages[-1], add_upload_info=False)
+    data = []
+    for record in agent._parse_and_chunk_files(messages=messages):
+        for chunk in record['raw']:
+            data.append({
+                'index': len(data),
+                'messages': messages,
+                'lang': lang,
+                'knowledge': chunk['content'],
+                'instruction': user_question,
+            })
+    member_res = ''
+    for _ in range(MAX_NO_RESPONSE_RETRY):
+        results = parallel_exec(agent._ask_member_agent, data, jitter=0.5)
+        answers = [agent._parse_member_answer(text) for index, text in results]
+        member_res = '\n\n'.join(answer for answer in answers if answer)
+        if member_res:
+            break
+    keyword_dict = agent._gen_keyword(f'{user_question}\n\n{member_res}')
+    retrieve_content = agent._retrieve_according_to_member_responses(messages=messages,
+                                                                    lang=lang,
+                                                                    user_question=user_question,
+                                                                    member_res=member_res,
+                                                                    keyword_dict=keyword_dict)
+    yield from agent.summary_agent.run(messages=messages, lang=lang, knowledge=retrieve_content)
+
+
+def run_once(name: str,
+             args,
+             doc_path: str,
+             workspace: str,
+             baseline: bool = False,
+             history: List[Message] = None) -> Dict:
+    os.chdir(workspace)  # 文档解析与检索的缓存在当前目录的 workspace 下，每种方式单独一份
+    llm = FakeLLM(args.latency)
+    agent = ParallelDocQA(llm=llm)
+    messages = (history or []) + [Message(USER, [{'text': QUESTION}, {'file': doc_path}])]
+    knowledge = []
+    summary_run = agent.summary_agent._run
+
+    def _capture_knowledge(messages, knowledge_: str = '', **kwargs):
+        knowledge.append(knowledge_)
+        return summary_run(messages, knowledge=knowledge_, **kwargs)
+
+    agent.summary_agent._run = lambda messages, knowledge='', **kwargs: _capture_knowledge(messages, knowledge, **kwargs)
+    t0 = time.perf_counter()
+    runner = baseline_run(agent, messages) if baseline else agent.run(messages)
+    for _ in runner:
+        pass
+    total = time.perf_counter() - t0
+    found = bool(knowledge) and all('Aurora is' in k for k in knowledge)
+    print(f'{name:10s} 总耗时 {total:5.1f} s，LLM 调用 {sum(llm.calls.values()):3d} 次 '
+          f'(成员 {llm.calls["member"]}，关键词 {llm.calls["keygen"]}，总结 {llm.calls["summary"]})，'
+          f'参考资料包含答案: {"是" if found else "否"}')
+    if not baseline:
+        print(f'{"":10s} last_run_stats: {agent.last_run_stats}')
+    return dict(llm.calls)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=40, help='文档的分块数，即 baseline 的成员数')
+    parser.add_argument('--needles', type=int, default=3, help='包含答案的分块数')
+    parser.add_argument('--latency', type=float, default=0.8, help='每次 LLM 调用的耗时（秒）')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logger.setLevel(logging.WARNING)
+
+    tmp = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        doc_path = os.path.join(tmp, 'aurora.txt')
+        needle_chunks = make_doc(doc_path, args.chunks, args.needles, random.Random(args.seed))
+        print(f'{args.chunks} 个分块，答案在第 {needle_chunks} 块，每次 LLM 调用 {args.latency} s')
+        workspaces = [os.path.join(tmp, name) for name in ('baseline', 'scheduled')]
+        for workspace in workspaces:
+            os.makedirs(workspace)
+
+        parallel_doc_qa.MEMBER_ANSWER_CACHE.clear()
+        run_once('baseline', args, doc_path, workspaces[0], baseline=True)
+        parallel_doc_qa.MEMBER_ANSWER_CACHE.clear()
+        run_once('scheduled', args, doc_path, workspaces[1])
+        run_once('cached', args, doc_path, workspaces[1])
+        history = [Message(USER, 'Which projects are in the document?'), Message(ASSISTANT, 'Project Aurora.')]
+        calls = run_once('follow-up', args, doc_path, workspaces[1], history=history)
+        assert calls['member'] > 0, calls
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+benchmark_parallel_exec - 并行调用 LLM 时 parallel_exec 的总耗时、首个结果的延迟与 QPS
+
+模拟的 LLM 调用：耗时服从对数正态分布（中位数 --latency 秒），其中 --straggler-ratio 的调用会卡住 --straggler 秒。
+对同一批 --tasks 个调用对比：
+  1. baseline: 旧 parallel_exec，全部任务一次提交，提交线程每次 sleep(jitter * random())，所有任务结束后才返回
+  2. thread:   iter_parallel_exec，令牌桶限速（与 jitter 的平均速率相同），单个任务超时 --timeout 秒，边完成边产出
+  3. asyncio:  aiter_parallel_exec，同 2
+  4. early stop: 拿到 --stop-after 个结果后停止启动新任务
+输出总耗时、首个结果的延迟、实际发起的调用数，以及任意 1 秒内的最大调用数（检查限速）。
+
+用法: python benchmark_parallel_exec.py --tasks 200 --workers 16 --jitter 0.1 --timeout 2
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from qwen_agent.utils.parallel_executor import TokenBucket, aiter_parallel_exec, iter_parallel_exec
+
+
+class FakeLLM:
+
+    def __init__(self, latency: float, straggler: float, straggler_ratio: float, seed: int = 0):
+        self.latency = latency
+        self.straggler = straggler
+        self.straggler_ratio = straggler_ratio
+        self.seed = seed
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _delay(self, index: int) -> float:
+        rng = random.Random(self.seed * 100003 + index)
+        if rng.random() < self.straggler_ratio:
+            return self.straggler
+        return self.latency * float(np.exp(rng.gauss(0, 0.5)))
+
+    def _record(self):
+        with self._lock:
+            self.calls.append(time.monotonic())
+
+    def call(self, index: int) -> int:
+        self._record()
+        time.sleep(self._delay(index))
+        return index
+
+    async def acall(self, index: int) -> int:
+        self._record()
+        await asyncio.sleep(self._delay(index))
+        return index
+
+    def max_qps(self) -> int:
+        calls = np.array(sorted(self.calls))
+        return int(max(np.searchsorted(calls, t + 1.0) - i for i, t in enumerate(calls))) if len(calls) else 0
+
+
+def baseline_parallel_exec(fn, list_of_kwargs, max_workers=None, jitter=0.0) -> list:
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for kwargs in list_of_kwargs:
+            futures.append(executor.submit(fn, **kwargs))
+            if jitter > 0.0:
+                time.sleep(jitter * random.random())
+        for future in as_completed(futures):
+            results.append(future.result())
+    return results
+
+
+def run_thread(llm: FakeLLM, args, **kwargs):
+    t0 = time.perf_counter()
+    first, n = None, 0
+    for _ in iter_parallel_exec(llm.call, [{'index': i} for i in range(args.tasks)],
+                                max_workers=args.workers,
+                                rate_limiter=TokenBucket(rate=2 / args.jitter, capacity=1),
+                                timeout=args.timeout,
+                                return_exceptions=True,
+                                **kwargs):
+        first = first or time.perf_counter() - t0
+        n += 1
+    return time.perf_counter() - t0, first, n
+
+
+async def run_asyncio(llm: FakeLLM, args, **kwargs):
+    t0 = time.perf_counter()
+    first, n = None, 0
+    async for _ in aiter_parallel_exec(llm.acall, [{'index': i} for i in range(args.tasks)],
+                                       max_in_flight=args.workers,
+                                       rate_limiter=TokenBucket(rate=2 / args.jitter, capacity=1),
+                                       timeout=args.timeout,
+                                       return_exceptions=True,
+                                       **kwargs):
+        first = first or time.perf_counter() - t0
+        n += 1
+    return time.perf_counter() - t0, first, n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.5, help='LLM 调用耗时的中位数（秒）')
+    parser.add_argument('--straggler', type=float, default=10, help='卡住的调用的耗时（秒）')
+    parser.add_argument('--straggler-ratio', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.1, help='旧实现的 jitter，新实现用同样平均速率的令牌桶')
+    parser.add_argument('--timeout', type=float, default=2.0, help='单个任务的超时（秒）')
+    parser.add_argument('--stop-after', type=int, default=20)
+    args = parser.parse_args()
+    print(f'{args.tasks} 个调用，{args.workers} 并发，限速 {2 / args.jitter:.0f} QPS，'
+          f'{args.straggler_ratio:.0%} 的调用卡住 {args.straggler:.0f} 秒')
+
+    def report(name, llm, total, first, n):
+        print(f'{name:10s} 总耗时 {total:5.1f} s，首个结果 {first:5.2f} s，结果 {n} 个，'
+              f'发起调用 {len(llm.calls)} 次，1 秒内最多 {llm.max_qps()} 次')
+
+    llm = FakeLLM(args.latency, args.straggler, args.straggler_ratio)
+    t0 = time.perf_counter()
+    results = baseline_parallel_exec(llm.call, [{'index': i} for i in range(args.tasks)], args.workers, args.jitter)
+    total = time.perf_counter() - t0
+    report('baseline', llm, total, total, len(results))
+
+    llm = FakeLLM(args.latency, args.straggler, args.straggler_ratio)
+    report('thread', llm, *run_thread(llm, args))
+
+    llm = FakeLLM(args.latency, args.straggler, args.straggler_ratio)
+    report('asyncio', llm, *asyncio.run(run_asyncio(llm, args)))
+
+    finished = itertools.count(1)
+    llm = FakeLLM(args.latency, args.straggler, args.straggler_ratio)
+    report('early stop', llm, *run_thread(llm, args, stop_when=lambda index, result: next(finished) >= args.stop_after))
+
+
+if __name__ == '__main__':
+    main()
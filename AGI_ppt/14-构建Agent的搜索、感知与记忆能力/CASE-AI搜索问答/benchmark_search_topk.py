@@ -0,0 +1,147 @@
+"""
+benchmark_search_topk - 打分之后取 top-k 的耗时（KeywordSearch / VectorSearch 的 search()）
+
+对同一批查询对比：
+  1. baseline: 子检索器返回所有分块按分数整体排序后的 (url, chunk_id, score) 列表，
+               get_topk 为每个文档建 [''] * 分块数 的列表再逐个填入（旧实现）
+  2. ranked:   子检索器返回 RankedChunks，get_topk 只读取能放进 max_ref_token 的头部，
+               排序用 argpartition / faiss 的 top-k 按需分块扩展
+两者取回的分块应完全相同（新实现会把相邻的分块合并为一段，比较前按块展开）。
+另外对比 format_docs 处理字符串文档的耗时（旧实现每个文档新建一个 DocParser）。
+
+用法: python benchmark_search_topk.py --pages 200000 --queries 20
+"""
+import argparse
+import logging
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark_hybrid_search import SlowHashEmbeddings
+from benchmark_keyword_search import VOCAB, make_docs
+from qwen_agent.log import logger
+from qwen_agent.tools.doc_parser import DocParser, Record
+from qwen_agent.tools.search_tools.base_search import RefMaterialOutput
+from qwen_agent.tools.search_tools.keyword_search import KeywordSearch, parse_keyword
+from qwen_agent.tools.search_tools.vector_search import VectorSearch
+from qwen_agent.utils.tokenization_qwen import count_tokens, refine_token_count, tokenizer
+
+
+def baseline_keyword(search: KeywordSearch, query: str, docs: list) -> list:
+    bm25_index = search.bm25_index
+    bm25 = bm25_index._get_corpus([bm25_index.get_record_index(doc) for doc in docs])
+    scores = bm25.get_scores(parse_keyword(query))
+    all_chunk_ids = [(doc.url, chunk_id) for doc in docs for chunk_id in range(len(doc.raw))]
+    return [(*all_chunk_ids[i], float(scores[i])) for i in np.argsort(-scores, kind='stable')]
+
+
+def baseline_vector(search: VectorSearch, query: str, docs: list) -> list:
+    import faiss
+    all_chunk_ids = [(doc.url, chunk_id) for doc in docs for chunk_id in range(len(doc.raw))]
+    index = search._get_index(docs, faiss)
+    query_vec = np.asarray([search._get_embeddings().embed_query(query)], dtype=np.float32)
+    distances, indices = index.search(query_vec, len(all_chunk_ids))
+    return [(*all_chunk_ids[i], float(score)) for score, i in zip(distances[0], indices[0]) if i >= 0]
+
+
+def baseline_get_topk(chunk_and_score: list, docs: list, max_ref_token: int) -> list:
+    available_token = max_ref_token
+    docs_retrieved = {}
+    docs_map = {}
+    for doc in docs:
+        docs_map[doc.url] = doc
+        docs_retrieved[doc.url] = RefMaterialOutput(url=doc.url, text=[''] * len(doc.raw))
+    for doc_id, chunk_id, _ in chunk_and_score:
+        if available_token <= 0:
+            break
+        page = docs_map[doc_id].raw[chunk_id]
+        if docs_retrieved[doc_id].text[chunk_id]:
+            continue
+        token = refine_token_count(page.content, page.token, available_token)
+        if available_token < token:
+            docs_retrieved[doc_id].text[chunk_id] = tokenizer.truncate(page.content, max_token=available_token)
+            break
+        docs_retrieved[doc_id].text[chunk_id] = page.content
+        available_token -= token
+    res = []
+    for x in docs_retrieved.values():
+        x.text = [chk for chk in x.text if chk]
+        if x.text:
+            res.append(x.to_dict())
+    return res
+
+
+def baseline_format_docs(docs: list) -> list:
+    new_docs = []
+    for i, doc in enumerate(docs):
+        parser = DocParser()
+        pages = [{'page_num': 0, 'content': [{'text': doc, 'token': count_tokens(doc)}]}]
+        new_docs.append(Record(url=f'doc_{i}', raw=list(parser.split_doc_to_chunk(pages, path=f'doc_{i}')), title=''))
+    return new_docs
+
+
+def ms(fn, *args):
+    t0 = time.perf_counter()
+    res = fn(*args)
+    return (time.perf_counter() - t0) * 1000, res
+
+
+def retrieved_chunks(res: list, contents: dict) -> set:
+    """取回的 (url, chunk_id)；合成的分块之间没有重叠，合并后的段落按换行还原为分块"""
+    return {(x['url'], contents[x['url']].get(part)) for x in res for text in x['text'] for part in text.split('\n')}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=4)
+    parser.add_argument('--pages', type=int, default=200000, help='总页数（分块数）')
+    parser.add_argument('--words', type=int, default=8, help='每个分块的词数，太多时每个词都出现在几乎所有分块中')
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--max-ref-token', type=int, default=4000)
+    parser.add_argument('--string-docs', type=int, default=200, help='format_docs 的字符串文档数')
+    args = parser.parse_args()
+    logger.setLevel(logging.WARNING)
+
+    docs = make_docs(args.docs, args.pages // args.docs, args.words)
+    rng = np.random.default_rng(1)
+    queries = [' '.join(rng.choice(VOCAB, 3, replace=False)) for _ in range(args.queries)]
+    contents = {doc.url: {chk.content: i for i, chk in enumerate(doc.raw)} for doc in docs}
+    print(f'分块数: {sum(len(d.raw) for d in docs)}，max_ref_token: {args.max_ref_token}')
+
+    workspace = tempfile.mkdtemp()
+    try:
+        searchers = [
+            ('keyword_search', KeywordSearch({'path': workspace}), baseline_keyword),
+            ('vector_search', VectorSearch({'path': workspace, 'embeddings': SlowHashEmbeddings(0)}), baseline_vector),
+        ]
+        for name, search, baseline_sort in searchers:
+            search.search(queries[0], docs, max_ref_token=args.max_ref_token)  # 建索引
+            old, new, passages, same = [], [], [], 0
+            for query in queries:
+                t_sort, chunk_and_score = ms(baseline_sort, search, query, docs)
+                if chunk_and_score[0][-1] == 0:  # 与 KeywordSearch.search 相同，没有命中时取文档开头
+                    t_topk, old_res = ms(search._get_the_front_part, docs, args.max_ref_token)
+                else:
+                    t_topk, old_res = ms(baseline_get_topk, chunk_and_score, docs, args.max_ref_token)
+                old.append(t_sort + t_topk)
+                t, new_res = ms(search.search, query, docs, args.max_ref_token)
+                new.append(t)
+                passages.append((sum(len(x['text']) for x in old_res), sum(len(x['text']) for x in new_res)))
+                same += retrieved_chunks(old_res, contents) == retrieved_chunks(new_res, contents)
+            print(f'{name}: baseline p50 {statistics.median(old):.1f} ms -> ranked p50 {statistics.median(new):.1f} ms，'
+                  f'取回的分块相同 {same}/{len(queries)}，'
+                  f'平均 {np.mean([p[0] for p in passages]):.1f} 个分块合并为 {np.mean([p[1] for p in passages]):.1f} 段')
+
+        string_docs = [' '.join(rng.choice(VOCAB, args.words)) for _ in range(args.string_docs)]
+        t_old, _ = ms(baseline_format_docs, string_docs)
+        t_new, _ = ms(KeywordSearch({'path': workspace}).format_docs, string_docs)
+        print(f'format_docs ({args.string_docs} 个字符串文档): {t_old:.1f} ms -> {t_new:.1f} ms')
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
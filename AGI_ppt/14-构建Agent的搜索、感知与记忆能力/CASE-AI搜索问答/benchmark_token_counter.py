@@ -0,0 +1,112 @@
+"""
+benchmark_token_counter - 近似 token 计数的速度与误差
+
+在一批文本（按空行切分的段落）上对比：
+  1. exact:  tokenizer.count_tokens（BPE 精确计数）
+  2. approx: estimate_tokens（按字符类别估算）
+输出每秒计数次数、相对误差的分布，以及误差落在 APPROX_TOKEN_ERROR_RATE * 估计值 + APPROX_TOKEN_ERROR_SLACK 内的比例。
+
+加 --fit 时用前 2/3 的文本重新拟合 APPROX_TOKENS_PER_CHAR（非负最小二乘），在其余文本上评估，
+可用于针对自己的文档重新校准系数。
+
+用法: python benchmark_token_counter.py [--files docs/*.txt ...] [--fit]
+  不指定 --files 时使用 qwen_agent 下的源码与文档作为语料。
+"""
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+
+from qwen_agent.utils import tokenization_qwen
+from qwen_agent.utils.tokenization_qwen import (APPROX_TOKEN_ERROR_RATE, APPROX_TOKEN_ERROR_SLACK,
+                                                APPROX_TOKENS_PER_CHAR, estimate_tokens, tokenizer)
+
+FEATURES = list(APPROX_TOKENS_PER_CHAR.keys())
+
+
+def load_texts(patterns: list, min_chars: int) -> list:
+    texts = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            if not os.path.isfile(path):
+                continue
+            with open(path, encoding='utf-8', errors='ignore') as f:
+                texts.extend(x.strip() for x in f.read().split('\n\n'))
+    return [x for x in texts if len(x) >= min_chars]
+
+
+def char_features(text: str) -> list:
+    """与 estimate_tokens 相同的字符计数"""
+    data = text.encode('utf-8')
+    num_wide = (len(data) - len(text)) / 2
+    num_newline = data.count(b'\n')
+    num_digit = len(data) - len(data.translate(None, tokenization_qwen._DIGITS))
+    num_punct = len(data) - len(data.translate(None, tokenization_qwen._PUNCTS))
+    num_letter = len(text) - num_wide - data.count(b' ') - num_newline - num_digit - num_punct
+    return [num_wide, num_letter, num_newline, num_digit, num_punct]
+
+
+def throughput(fn, texts: list) -> float:
+    t0 = time.perf_counter()
+    for x in texts:
+        fn(x)
+    return len(texts) / (time.perf_counter() - t0)
+
+
+def report_errors(exact: np.ndarray, approx: np.ndarray, min_tokens: int):
+    mask = exact >= min_tokens
+    exact, approx = exact[mask], approx[mask]
+    rel = (approx - exact) / exact
+    bound = APPROX_TOKEN_ERROR_RATE * approx + APPROX_TOKEN_ERROR_SLACK
+    print(f'文本数 (>= {min_tokens} tokens): {len(exact)}')
+    print(f'相对误差 |err|: p50 {np.percentile(np.abs(rel), 50):.1%}  p95 {np.percentile(np.abs(rel), 95):.1%}  '
+          f'p99 {np.percentile(np.abs(rel), 99):.1%}  max {np.abs(rel).max():.1%}')
+    print(f'平均偏差: {rel.mean():+.2%}  总量误差: {approx.sum() / exact.sum() - 1:+.2%}')
+    print(f'误差界内的比例 (|err| <= {APPROX_TOKEN_ERROR_RATE} * est + {APPROX_TOKEN_ERROR_SLACK}): '
+          f'{np.mean(np.abs(approx - exact) <= bound):.2%}')
+
+
+def fit(texts: list, exact: np.ndarray) -> np.ndarray:
+    from scipy.optimize import nnls
+    x = np.array([char_features(t) for t in texts])
+    # 按 1/sqrt(tokens) 加权，避免长文本主导拟合
+    w = 1 / np.sqrt(np.maximum(exact, 1))
+    coef, _ = nnls(x * w[:, None], exact * w)
+    return coef
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', nargs='+', default=['qwen_agent/**/*.py', 'qwen_agent/**/*.md', '*.py'])
+    parser.add_argument('--min-chars', type=int, default=20)
+    parser.add_argument('--min-tokens', type=int, default=50, help='只对不少于该 token 数的文本统计误差')
+    parser.add_argument('--fit', action='store_true')
+    args = parser.parse_args()
+
+    texts = load_texts(args.files, args.min_chars)
+    if not texts:
+        raise SystemExit('语料为空')
+    tokenizer.count_tokens('warmup')
+
+    exact = np.array([tokenizer.count_tokens(x) for x in texts], dtype=np.float64)
+    if args.fit:
+        split = len(texts) * 2 // 3
+        coef = fit(texts[:split], exact[:split])
+        print('拟合系数: ' + ', '.join(f"'{k}': {v:.3f}" for k, v in zip(FEATURES, coef)))
+        APPROX_TOKENS_PER_CHAR.update(zip(FEATURES, coef.tolist()))
+        texts, exact = texts[split:], exact[split:]
+
+    approx = np.array([estimate_tokens(x) for x in texts], dtype=np.float64)
+    exact_rate = throughput(tokenizer.count_tokens, texts)
+    approx_rate = throughput(estimate_tokens, texts)
+
+    print(f'语料: {len(texts)} 段, {int(exact.sum())} tokens')
+    print(f'exact:  {exact_rate:,.0f} 次/s')
+    print(f'approx: {approx_rate:,.0f} 次/s ({approx_rate / exact_rate:.1f}x)')
+    report_errors(exact, approx, args.min_tokens)
+
+
+if __name__ == '__main__':
+    main()
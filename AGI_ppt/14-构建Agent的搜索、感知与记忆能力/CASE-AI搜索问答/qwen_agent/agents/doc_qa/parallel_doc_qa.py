@@ -15,10 +15,14 @@
 import copy
 import json
 import re
+import threading
 import time
-from typing import Dict, Iterator, List, Optional, Union
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 import json5
+import numpy as np
 
 from qwen_agent.agents.assistant import KNOWLEDGE_SNIPPET, Assistant, format_knowledge_to_source_and_content
 from qwen_agent.agents.doc_qa.parallel_doc_qa_member import NO_RESPONSE, ParallelDocQAMember
@@ -29,11 +33,12 @@ from qwen_agent.llm.schema import DEFAULT_SYSTEM_MESSAGE, USER, Message
 from qwen_agent.log import logger
 from qwen_agent.tools import BaseTool
 from qwen_agent.tools.doc_parser import DocParser
+from qwen_agent.tools.search_tools.keyword_search import parse_keyword, split_text_into_keywords
 from qwen_agent.tools.simple_doc_parser import PARSER_SUPPORTED_FILE_TYPES
-from qwen_agent.utils.parallel_executor import parallel_exec
-from qwen_agent.utils.tokenization_qwen import count_tokens
+from qwen_agent.utils.parallel_executor import TokenBucket, iter_parallel_exec
+from qwen_agent.utils.sparse_bm25 import SparseBM25
 from qwen_agent.utils.utils import (extract_files_from_messages, extract_text_from_message, get_file_type,
-                                    print_traceback)
+                                    hash_sha256, print_traceback)
 
 MAX_NO_RESPONSE_RETRY = 4
 DEFAULT_NAME = 'Simple Parallel DocQA With RAG Sum Agents'
@@ -44,6 +49,57 @@ PARALLEL_CHUNK_SIZE = 1000  # chunk size param for parallel chunk
 MAX_RAG_TOKEN_SIZE = 4500
 RAG_CHUNK_SIZE = 300
 
+# The members are asked in the order of the BM25 pre-score of their chunks,
+# and no more members are launched once this many chunks have answered
+MIN_MEMBER_ANSWERS = 3
+MAX_MEMBERS_IN_FLIGHT = 8
+# The default rate of each agent, the same average rate as the former jitter of 0.5 seconds between submissions
+MEMBER_QPS = 4
+MEMBER_ANSWER_CACHE_SIZE = 10000
+
+
+class MemberAnswerCache:
+    """The answers of the member agents keyed by (the model, the prior turns, the question, the chunk hash)
+
+    Only the real answers are cached, since a "none" answer is asked again when no chunk answers at all.
+    It is shared by all ParallelDocQA agents in the process.
+    """
+
+    def __init__(self, max_size: int = MEMBER_ANSWER_CACHE_SIZE):
+        self.max_size = max_size
+        self._lru: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def hash_history(messages: List[Message]) -> str:
+        """The hash of the turns before the question, which the members see as well"""
+        return hash_sha256(json.dumps([msg.model_dump() for msg in messages[:-1]], ensure_ascii=False, sort_keys=True))
+
+    @staticmethod
+    def make_key(model: str, lang: str, history: str, question: str, chunk: str) -> str:
+        return hash_sha256(json.dumps([model, lang, history, question, hash_sha256(chunk)], ensure_ascii=False))
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            answer = self._lru.get(key)
+            if answer is not None:
+                self._lru.move_to_end(key)
+            return answer
+
+    def set(self, key: str, answer: str):
+        with self._lock:
+            self._lru[key] = answer
+            self._lru.move_to_end(key)
+            if len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+
+
+MEMBER_ANSWER_CACHE = MemberAnswerCache()
+
 
 class ParallelDocQA(Assistant):
 
@@ -53,7 +109,14 @@ class ParallelDocQA(Assistant):
                  system_message: Optional[str] = DEFAULT_SYSTEM_MESSAGE,
                  name: Optional[str] = DEFAULT_NAME,
                  description: Optional[str] = DEFAULT_DESC,
-                 files: Optional[List[str]] = None):
+                 files: Optional[List[str]] = None,
+                 member_rate_limiter: Optional[TokenBucket] = None):
+        """Initialization the agent.
+
+        Args:
+            member_rate_limiter: The rate limit of the member calls of this agent, MEMBER_QPS by default.
+              Pass the same bucket to several agents to share the quota of one LLM service among them.
+        """
 
         function_list = function_list or []
         super().__init__(
@@ -72,6 +135,8 @@ class ParallelDocQA(Assistant):
 
         self.doc_parse = DocParser()
         self.summary_agent = ParallelDocQASummary(llm=self.llm)
+        self.member_rate_limiter = member_rate_limiter or TokenBucket(rate=MEMBER_QPS)
+        self.last_run_stats: Dict[str, Union[int, float]] = {}
 
     def _get_files(self, messages: List[Message]):
         session_files = extract_files_from_messages(messages, include_images=False)
@@ -94,27 +159,13 @@ class ParallelDocQA(Assistant):
             records.append(_record)
         return records
 
-    def _retrieve_according_to_member_responses(
-        self,
-        messages: List[Message],
-        lang: str = 'en',
-        user_question: str = '',
-        member_res: str = '',
-    ):
-        messages = copy.deepcopy(messages)
-        valid_files = self._get_files(messages)
-
+    def _gen_keyword(self, query: str) -> Optional[dict]:
         keygen = GenKeyword(llm=self.llm)
-        member_res_token_num = count_tokens(member_res)
-
-        # Limit the token length of keygen input to avoid wasting tokens due to excessively long docqa member output.
-        unuse_member_res = member_res_token_num > MAX_RAG_TOKEN_SIZE
-        query = user_question if unuse_member_res else f'{user_question}\n\n{member_res}'
-
         try:
             *_, last = keygen.run([Message(USER, query)])
         except ModelServiceError:
             print_traceback()
+            return None
 
         keyword = last[-1].content
         keyword = keyword.strip()
@@ -126,14 +177,50 @@ class ParallelDocQA(Assistant):
         try:
             logger.info(keyword)
             keyword_dict = json5.loads(keyword)
-            keyword_dict['text'] = query
-            if unuse_member_res:
-                keyword_dict['text'] += '\n\n' + member_res
-            rag_query = json.dumps(keyword_dict, ensure_ascii=False)
+            assert isinstance(keyword_dict, dict)
+            return keyword_dict
         except Exception:
+            return None
+
+    def _prepare_retrieval(self, messages: List[Message], user_question: str) -> Optional[dict]:
+        """Run while the members are running: generate the keywords of the question,
+        and parse and index the files for retrieval, so that the retrieval afterwards only has to search.
+
+        A failure to parse or index is only logged here, the retrieval afterwards meets and reports it again.
+        """
+        keyword_dict = self._gen_keyword(user_question)
+        retrieval = self.function_map['retrieval']
+        bm25_index = getattr(retrieval.search, 'bm25_index', None)
+        try:
+            for record in retrieval.doc_parse.get_records(self._get_files(messages),
+                                                          max_ref_token=MAX_RAG_TOKEN_SIZE,
+                                                          parser_page_size=RAG_CHUNK_SIZE):
+                if (bm25_index is not None) and (not isinstance(record, Exception)):
+                    bm25_index.get_record_index(record)
+        except Exception:
+            print_traceback()
+        return keyword_dict
+
+    def _retrieve_according_to_member_responses(
+        self,
+        messages: List[Message],
+        lang: str = 'en',
+        user_question: str = '',
+        member_res: str = '',
+        keyword_dict: Optional[dict] = None,
+    ):
+        valid_files = self._get_files(messages)
+
+        # The keywords are generated from the question only, so that they can be generated while the members
+        # are running. This also replaces the former limit of MAX_RAG_TOKEN_SIZE tokens on the member responses
+        # in the keyword generation input, since they are no longer part of it at all.
+        # The member responses still take part in the retrieval as the text of the query, in full as before.
+        query = f'{user_question}\n\n{member_res}' if member_res else user_question
+        if keyword_dict is not None:
+            keyword_dict = {**keyword_dict, 'text': query}
+            rag_query = json.dumps(keyword_dict, ensure_ascii=False)
+        else:
             rag_query = query
-            if unuse_member_res:
-                rag_query += '\n\n' + member_res
 
         # max_ref_token is the retrieve doc token size
         # parser_page_size is the chunk size in retrieve
@@ -186,8 +273,81 @@ class ParallelDocQA(Assistant):
         except Exception:
             return False, content
 
-    def _run(self, messages: List[Message], lang: str = 'en', **kwargs) -> Iterator[List[Message]]:
+    def _parse_member_answer(self, text: str) -> str:
+        """The answer of a member, or '' if the chunk can not answer the question"""
+        parser_success, parser_json_content = self._parser_json(text)
+        if parser_success and ('res' in parser_json_content) and ('content' in parser_json_content):
+            pa_res, pa_cotent = parser_json_content['res'], parser_json_content['content']
+            if (pa_res in ['ans', 'none']) and (isinstance(pa_cotent, str)):
+                if pa_res == 'ans':
+                    return pa_cotent.strip()
+                elif pa_res == 'none':
+                    return ''
+        if self._is_none_response(text):
+            return ''
+        return self._extract_text_from_output(text).strip()
+
+    @staticmethod
+    def _prioritize_chunks(question: str, chunks: List[str]) -> List[int]:
+        """The chunk indexes sorted by a BM25 pre-score against the question.
+        The chunks that hit no keyword keep their order at the end."""
+        bm25 = SparseBM25([split_text_into_keywords(chunk) for chunk in chunks])
+        scores = bm25.get_scores(parse_keyword(question))
+        return np.argsort(-scores, kind='stable').tolist()
+
+    def _ask_members(self, messages: List[Message], lang: str, user_question: str,
+                     chunks: List[str]) -> Tuple[List[Tuple[int, str]], Dict[str, int]]:
+        """Ask the member agents in the order of priority, until MIN_MEMBER_ANSWERS chunks have answered
+
+        Returns:
+            The (chunk index, answer) list in the order of the chunks, and the call counts.
+        """
+        model = getattr(self.llm, 'model', '')
+        history = MEMBER_ANSWER_CACHE.hash_history(messages)
+        keys = [MEMBER_ANSWER_CACHE.make_key(model, lang, history, user_question, chunk) for chunk in chunks]
+        answers = {}
+        todo = []
+        for index in self._prioritize_chunks(user_question, chunks):
+            cached = MEMBER_ANSWER_CACHE.get(keys[index])
+            if cached is not None:
+                answers[index] = cached
+            else:
+                todo.append(index)
+        stats = {'cached_answers': len(answers), 'member_calls': 0}
+
+        def _tasks() -> Iterator[dict]:
+            # Consumed lazily by the executor, so the members still in flight are the only ones asked after
+            # there are enough answers
+            for index in todo:
+                if len(answers) >= MIN_MEMBER_ANSWERS:
+                    return
+                yield {
+                    'index': index,
+                    'messages': messages,
+                    'lang': lang,
+                    'knowledge': chunks[index],
+                    'instruction': user_question,
+                }
 
+        # Retry for None in 7b model
+        retry_cnt = MAX_NO_RESPONSE_RETRY
+        while retry_cnt > 0:
+            for _, (index, text) in iter_parallel_exec(self._ask_member_agent,
+                                                       _tasks(),
+                                                       max_workers=MAX_MEMBERS_IN_FLIGHT,
+                                                       rate_limiter=self.member_rate_limiter):
+                stats['member_calls'] += 1
+                answer = self._parse_member_answer(text)
+                if answer:
+                    answers[index] = answer
+                    MEMBER_ANSWER_CACHE.set(keys[index], answer)
+            if answers:
+                break
+            retry_cnt -= 1
+        return sorted(answers.items()), stats
+
+    def _run(self, messages: List[Message], lang: str = 'en', **kwargs) -> Iterator[List[Message]]:
+        time1 = time.time()
         messages = copy.deepcopy(messages)
         # Extract User Question
         user_question = extract_text_from_message(messages[-1], add_upload_info=False)
@@ -197,59 +357,37 @@ class ParallelDocQA(Assistant):
         records = self._parse_and_chunk_files(messages=messages)
         assert len(records) > 0, 'records is empty, all url parsing failed.'
 
-        data = []
-        idx = 0
+        chunks = []
         for record in records:
             assert len(record['raw']) > 0, 'Document content cannot be empty or null.'
-            for chunk in record['raw']:
-                chunk_text = chunk['content']
-                data.append({
-                    'index': idx,
-                    'messages': messages,
-                    'lang': lang,
-                    'knowledge': chunk_text,
-                    'instruction': user_question,
-                })
-                idx += 1
-        logger.info('Parallel Member Num: ' + str(len(data)))
+            chunks.extend(chunk['content'] for chunk in record['raw'])
+        logger.info('Parallel Member Num: ' + str(len(chunks)))
 
-        # Retry for None in 7b model
-        retry_cnt = MAX_NO_RESPONSE_RETRY
-        member_res = ''
-        while retry_cnt > 0:
-            time1 = time.time()
-            results = parallel_exec(self._ask_member_agent, data, jitter=0.5)
-            # results = serial_exec(self._qa, data)
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='parallel_doc_qa') as executor:
+            prepared = executor.submit(self._prepare_retrieval, messages, user_question)
+            answers, stats = self._ask_members(messages, lang, user_question, chunks)
             time2 = time.time()
-            logger.info(f'Finished parallel_exec. Time spent: {time2 - time1} seconds.')
-            ordered_results = sorted(results, key=lambda x: x[0])
-            filtered_results = []
-
-            for index, text in ordered_results:
-                parser_success, parser_json_content = self._parser_json(text)
-                if parser_success and ('res' in parser_json_content) and ('content' in parser_json_content):
-                    pa_res, pa_cotent = parser_json_content['res'], parser_json_content['content']
-                    if (pa_res in ['ans', 'none']) and (isinstance(pa_cotent, str)):
-                        if pa_res == 'ans':
-                            filtered_results.append((index, pa_cotent.strip()))
-                            continue
-                        elif pa_res == 'none':
-                            continue
-                if self._is_none_response(text):
-                    continue
-                clean_output = self._extract_text_from_output(text)
-                filtered_results.append((index, clean_output.strip()))
-
-            if filtered_results:
-                member_res = '\n\n'.join(text for index, text in filtered_results)
-                break
-            retry_cnt -= 1
+            logger.info(f'Finished the members. Time spent: {time2 - time1} seconds.')
+            keyword_dict = prepared.result()
+        member_res = '\n\n'.join(text for index, text in answers)
 
         retrieve_content = self._retrieve_according_to_member_responses(messages=messages,
                                                                         lang=lang,
                                                                         user_question=user_question,
-                                                                        member_res=member_res)
-        return self.summary_agent.run(messages=messages, lang=lang, knowledge=retrieve_content)
+                                                                        member_res=member_res,
+                                                                        keyword_dict=keyword_dict)
+        yield from self.summary_agent.run(messages=messages, lang=lang, knowledge=retrieve_content)
+
+        # The keyword generation and the summary are one call each
+        self.last_run_stats = {
+            'chunks': len(chunks),
+            'member_answers': len(answers),
+            **stats,
+            'llm_calls': stats['member_calls'] + 2,
+            'member_time': time2 - time1,
+            'wall_time': time.time() - time1,
+        }
+        logger.info(f'ParallelDocQA stats: {self.last_run_stats}')
 
     def _ask_member_agent(self,
                           index: int,
@@ -12,7 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import os
+import weakref
 from typing import Dict, Optional
 
 import openai
@@ -52,4 +54,14 @@ class TextChatAtAzure(TextChatAtOAI):
             client = openai.AzureOpenAI(**api_kwargs)
             return client.chat.completions.create(*args, **kwargs)
 
+        async_clients = weakref.WeakKeyDictionary()
+
+        async def _achat_complete_create(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            client = async_clients.get(loop)
+            if client is None:
+                client = async_clients[loop] = openai.AsyncAzureOpenAI(**api_kwargs)
+            return await client.chat.completions.create(*args, **kwargs)
+
         self._chat_complete_create = _chat_complete_create
+        self._achat_complete_create = _achat_complete_create
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import copy
 import json
 import os
@@ -20,12 +21,12 @@ import time
 from abc import ABC, abstractmethod
 from collections import defaultdict
 from pprint import pformat
-from typing import Any, Dict, Iterator, List, Literal, Optional, Tuple, Union
+from typing import Any, AsyncIterator, Awaitable, Dict, Iterator, List, Literal, Optional, Tuple, Union
 
 from qwen_agent.llm.schema import ASSISTANT, DEFAULT_SYSTEM_MESSAGE, FUNCTION, SYSTEM, USER, Message
 from qwen_agent.log import logger
 from qwen_agent.settings import DEFAULT_MAX_INPUT_TOKENS
-from qwen_agent.utils.tokenization_qwen import tokenizer
+from qwen_agent.utils.tokenization_qwen import approx_token_margin, count_tokens, tokenizer
 from qwen_agent.utils.utils import (extract_text_from_message, format_as_multimodal_message, format_as_text_message,
                                     has_chinese_messages, json_dumps_compact, merge_generate_cfgs, print_traceback)
 
@@ -80,6 +81,7 @@ class BaseChatModel(ABC):
         self.model = cfg.get('model', '').strip()
         generate_cfg = copy.deepcopy(cfg.get('generate_cfg', {}))
         cache_dir = cfg.get('cache_dir', generate_cfg.pop('cache_dir', None))
+        semantic_cache_cfg = cfg.get('semantic_cache', generate_cfg.pop('semantic_cache', None))
         self.max_retries = generate_cfg.pop('max_retries', 0)
         self.generate_cfg = generate_cfg
         self.model_type = cfg.get('model_type', '')
@@ -108,6 +110,14 @@ class BaseChatModel(ABC):
         else:
             self.cache = None
 
+        if semantic_cache_cfg:
+            from qwen_agent.llm.semantic_cache import SemanticResponseCache
+            if not isinstance(semantic_cache_cfg, dict):
+                semantic_cache_cfg = {}  # `semantic_cache: True` uses the default settings
+            self.semantic_cache = SemanticResponseCache(semantic_cache_cfg)
+        else:
+            self.semantic_cache = None
+
     def quick_chat(self, prompt: str) -> str:
         *_, responses = self.chat(messages=[Message(role=USER, content=prompt)])
         assert len(responses) == 1
@@ -133,38 +143,198 @@ class BaseChatModel(ABC):
               (1) When False (recommended): Stream the full response every iteration.
               (2) When True: Stream the chunked response, i.e, delta responses.
             extra_generate_cfg: Extra LLM generation hyper-parameters.
+              Set `semantic_cache` to False in it to bypass the semantic cache for this call.
 
         Returns:
             the generated message list response by llm.
         """
 
+        req = self._prepare_chat(messages, functions, stream, delta_stream, extra_generate_cfg)
+        if req.cached_response is not None:
+            return req.cached_response
+
+        if self.use_raw_api:
+            logger.debug('`use_raw_api` takes effect.')
+            assert stream and (not delta_stream), '`use_raw_api` only support full stream!!!'
+            return self.raw_chat(messages=req.messages,
+                                 functions=functions,
+                                 stream=stream,
+                                 generate_cfg=req.generate_cfg)
+
+        def _call_model_service():
+            if req.fncall_mode:
+                return self._chat_with_functions(
+                    messages=req.messages,
+                    functions=functions,
+                    stream=stream,
+                    delta_stream=delta_stream,
+                    generate_cfg=req.generate_cfg,
+                    lang=req.lang,
+                )
+            else:
+                # TODO: Optimize code structure
+                if req.messages[-1].role == ASSISTANT:
+                    assert not delta_stream, 'Continuation mode does not currently support `delta_stream`'
+                    return self._continue_assistant_response(req.messages, generate_cfg=req.generate_cfg, stream=stream)
+                else:
+                    return self._chat(
+                        req.messages,
+                        stream=stream,
+                        delta_stream=delta_stream,
+                        generate_cfg=req.generate_cfg,
+                    )
+
+        if stream and delta_stream:
+            # No retry for delta streaming
+            output = _call_model_service()
+        elif stream and (not delta_stream):
+            output = retry_model_service_iterator(_call_model_service, max_retries=self.max_retries)
+        else:
+            output = retry_model_service(_call_model_service, max_retries=self.max_retries)
+
+        if isinstance(output, list):
+            assert not stream
+            return self._finish_chat(req, output)
+        else:
+            assert stream
+            output = self._postprocess_messages_iterator(output,
+                                                         fncall_mode=req.fncall_mode,
+                                                         generate_cfg=self._get_stream_postproc_cfg(req))
+
+            def _format_and_cache() -> Iterator[List[Message]]:
+                o = []
+                for o in output:
+                    if o:
+                        if not self.support_multimodal_output:
+                            o = _format_as_text_messages(messages=o)
+                        yield o
+                if o:
+                    self._cache_response(req, o)
+
+            return self._convert_messages_iterator_to_target_type(_format_and_cache(), req.return_message_type)
+
+    async def achat(
+        self,
+        messages: List[Union[Message, Dict]],
+        functions: Optional[List[Dict]] = None,
+        extra_generate_cfg: Optional[Dict] = None,
+    ) -> Union[List[Message], List[Dict]]:
+        """The async version of `chat(stream=False)`.
+
+        The retry, stop word postprocessing and caching behave the same as `chat`. Models without a native
+        async client run the blocking calls in worker threads.
+        """
+        req = await self._aprepare_chat(messages, functions, False, False, extra_generate_cfg)
+        if req.cached_response is not None:
+            return req.cached_response
+        assert not self.use_raw_api, '`use_raw_api` only support full stream!!!'
+
+        output = await aretry_model_service(lambda: self._acall_model_service(req, stream=False, delta_stream=False),
+                                            max_retries=self.max_retries)
+        if req.semantic_cache_key is not None:
+            # Updating the semantic cache embeds the query by a blocking request
+            return await asyncio.to_thread(self._finish_chat, req, output)
+        return self._finish_chat(req, output)
+
+    async def astream(
+        self,
+        messages: List[Union[Message, Dict]],
+        functions: Optional[List[Dict]] = None,
+        delta_stream: bool = False,
+        extra_generate_cfg: Optional[Dict] = None,
+    ) -> Union[AsyncIterator[List[Message]], AsyncIterator[List[Dict]]]:
+        """The async version of `chat(stream=True)`, i.e., `async for rsp in llm.astream(messages): ...`"""
+        req = await self._aprepare_chat(messages, functions, True, delta_stream, extra_generate_cfg)
+        if req.cached_response is not None:
+            for rsp in req.cached_response:
+                yield rsp
+            return
+
+        if self.use_raw_api:
+            logger.debug('`use_raw_api` takes effect.')
+            assert not delta_stream, '`use_raw_api` only support full stream!!!'
+            async for rsp in _aiter_in_thread(lambda: self.raw_chat(
+                    messages=req.messages, functions=functions, stream=True, generate_cfg=req.generate_cfg)):
+                yield rsp
+            return
+
+        if delta_stream:
+            # No retry for delta streaming
+            output = self._acall_model_service(req, stream=True, delta_stream=True)
+        else:
+            output = aretry_model_service_iterator(
+                lambda: self._acall_model_service(req, stream=True, delta_stream=False),
+                max_retries=self.max_retries)
+
+        generate_cfg = self._get_stream_postproc_cfg(req)
+        o = pre_msg = []
+        async for pre_msg in output:
+            o = self._postprocess_messages(pre_msg, fncall_mode=req.fncall_mode, generate_cfg=generate_cfg)
+            if o:
+                if not self.support_multimodal_output:
+                    o = _format_as_text_messages(messages=o)
+                yield self._convert_messages_to_target_type(o, req.return_message_type)
+        logger.debug(f'LLM Output: \n{pformat([_.model_dump() for _ in pre_msg], indent=2)}')
+        if o:
+            if req.semantic_cache_key is not None:
+                await asyncio.to_thread(self._cache_response, req, o)
+            else:
+                self._cache_response(req, o)
+
+    async def _aprepare_chat(self, *args) -> '_ChatRequest':
+        """`_prepare_chat` for `achat` and `astream`, in a worker thread if the semantic cache may embed the query"""
+        if self.semantic_cache is not None:
+            return await asyncio.to_thread(self._prepare_chat, *args)
+        return self._prepare_chat(*args)
+
+    def _prepare_chat(
+        self,
+        messages: List[Union[Message, Dict]],
+        functions: Optional[List[Dict]],
+        stream: bool,
+        delta_stream: bool,
+        extra_generate_cfg: Optional[Dict],
+    ) -> '_ChatRequest':
+        """Everything `chat` and `achat` do before calling the model service, including the cache lookup"""
+        req = _ChatRequest()
+
         # Unify the input messages to type List[Message]:
         messages = copy.deepcopy(messages)
-        _return_message_type = 'dict'
+        req.return_message_type = 'dict'
         new_messages = []
         for msg in messages:
             if isinstance(msg, dict):
                 new_messages.append(Message(**msg))
             else:
                 new_messages.append(msg)
-                _return_message_type = 'message'
+                req.return_message_type = 'message'
         messages = new_messages
 
         if not messages:
             raise ValueError('Messages can not be empty.')
 
+        use_semantic_cache = True
+        if extra_generate_cfg and ('semantic_cache' in extra_generate_cfg):
+            extra_generate_cfg = copy.copy(extra_generate_cfg)
+            use_semantic_cache = extra_generate_cfg.pop('semantic_cache')
+
         # Cache lookup:
         if self.cache is not None:
             cache_key = dict(messages=messages, functions=functions, extra_generate_cfg=extra_generate_cfg)
-            cache_key: str = json_dumps_compact(cache_key, sort_keys=True)
-            cache_value: str = self.cache.get(cache_key)
+            req.cache_key = json_dumps_compact(cache_key, sort_keys=True)
+            cache_value: str = self.cache.get(req.cache_key)
             if cache_value:
-                cache_value: List[dict] = json.loads(cache_value)
-                if _return_message_type == 'message':
-                    cache_value: List[Message] = [Message(**m) for m in cache_value]
-                if stream:
-                    cache_value: Iterator[List[Union[Message, dict]]] = iter([cache_value])
-                return cache_value
+                req.cached_response = _load_cached_response(json.loads(cache_value), req.return_message_type, stream)
+                return req
+
+        if (self.semantic_cache is not None) and use_semantic_cache and (not delta_stream):
+            req.semantic_cache_key = self.semantic_cache.make_key(messages, functions, extra_generate_cfg)
+            if req.semantic_cache_key is not None:
+                cache_value = self.semantic_cache.get(req.semantic_cache_key)
+                if cache_value is not None:
+                    req.cached_response = _load_cached_response(copy.deepcopy(cache_value), req.return_message_type,
+                                                                stream)
+                    return req
 
         if stream and delta_stream:
             logger.warning(
@@ -217,77 +387,50 @@ class BaseChatModel(ABC):
         if not self.support_multimodal_input:
             messages = [format_as_text_message(msg, add_upload_info=False) for msg in messages]
 
-        if self.use_raw_api:
-            logger.debug('`use_raw_api` takes effect.')
-            assert stream and (not delta_stream), '`use_raw_api` only support full stream!!!'
-            return self.raw_chat(messages=messages, functions=functions, stream=stream, generate_cfg=generate_cfg)
-
-        if not fncall_mode:
+        if (not self.use_raw_api) and (not fncall_mode):
             for k in ['parallel_function_calls', 'function_choice', 'thought_in_content']:
                 if k in generate_cfg:
                     del generate_cfg[k]
 
-        def _call_model_service():
-            if fncall_mode:
-                return self._chat_with_functions(
-                    messages=messages,
-                    functions=functions,
-                    stream=stream,
-                    delta_stream=delta_stream,
-                    generate_cfg=generate_cfg,
-                    lang=lang,
-                )
-            else:
-                # TODO: Optimize code structure
-                if messages[-1].role == ASSISTANT:
-                    assert not delta_stream, 'Continuation mode does not currently support `delta_stream`'
-                    return self._continue_assistant_response(messages, generate_cfg=generate_cfg, stream=stream)
-                else:
-                    return self._chat(
-                        messages,
-                        stream=stream,
-                        delta_stream=delta_stream,
-                        generate_cfg=generate_cfg,
-                    )
-
-        if stream and delta_stream:
-            # No retry for delta streaming
-            output = _call_model_service()
-        elif stream and (not delta_stream):
-            output = retry_model_service_iterator(_call_model_service, max_retries=self.max_retries)
-        else:
-            output = retry_model_service(_call_model_service, max_retries=self.max_retries)
-
-        if isinstance(output, list):
-            assert not stream
-            logger.debug(f'LLM Output: \n{pformat([_.model_dump() for _ in output], indent=2)}')
-            output = self._postprocess_messages(output, fncall_mode=fncall_mode, generate_cfg=generate_cfg)
-            if not self.support_multimodal_output:
-                output = _format_as_text_messages(messages=output)
-            if self.cache:
-                self.cache.set(cache_key, json_dumps_compact(output))
-            return self._convert_messages_to_target_type(output, _return_message_type)
-        else:
-            assert stream
-            if delta_stream:
-                # Hack: To avoid potential errors during the postprocessing of stop words when delta_stream=True.
-                # Man, we should never have implemented the support for `delta_stream=True` in the first place!
-                generate_cfg = copy.deepcopy(generate_cfg)  # copy to avoid conflicts with `_call_model_service`
-                assert 'skip_stopword_postproc' not in generate_cfg
-                generate_cfg['skip_stopword_postproc'] = True
-            output = self._postprocess_messages_iterator(output, fncall_mode=fncall_mode, generate_cfg=generate_cfg)
+        req.messages = messages
+        req.functions = functions
+        req.stream = stream
+        req.delta_stream = delta_stream
+        req.generate_cfg = generate_cfg
+        req.fncall_mode = fncall_mode
+        req.lang = lang
+        return req
+
+    def _finish_chat(self, req: '_ChatRequest', output: List[Message]) -> Union[List[Message], List[Dict]]:
+        logger.debug(f'LLM Output: \n{pformat([_.model_dump() for _ in output], indent=2)}')
+        output = self._postprocess_messages(output, fncall_mode=req.fncall_mode, generate_cfg=req.generate_cfg)
+        if not self.support_multimodal_output:
+            output = _format_as_text_messages(messages=output)
+        self._cache_response(req, output)
+        return self._convert_messages_to_target_type(output, req.return_message_type)
 
-            def _format_and_cache() -> Iterator[List[Message]]:
-                o = []
-                for o in output:
-                    if o:
-                        if not self.support_multimodal_output:
-                            o = _format_as_text_messages(messages=o)
-                        yield o
-                if o and (self.cache is not None):
-                    self.cache.set(cache_key, json_dumps_compact(o))
+    @staticmethod
+    def _get_stream_postproc_cfg(req: '_ChatRequest') -> dict:
+        generate_cfg = req.generate_cfg
+        if req.delta_stream:
+            # Hack: To avoid potential errors during the postprocessing of stop words when delta_stream=True.
+            # Man, we should never have implemented the support for `delta_stream=True` in the first place!
+            generate_cfg = copy.deepcopy(generate_cfg)  # copy to avoid conflicts with `_call_model_service`
+            assert 'skip_stopword_postproc' not in generate_cfg
+            generate_cfg['skip_stopword_postproc'] = True
+        return generate_cfg
+
+    def _cache_response(self, req: '_ChatRequest', output: List[Message]):
+        if self.cache is not None:
+            self.cache.set(req.cache_key, json_dumps_compact(output))
+        if req.semantic_cache_key is not None:
+            self._put_semantic_cache(req.semantic_cache_key, output)
 
-            return self._convert_messages_iterator_to_target_type(_format_and_cache(), _return_message_type)
+    def _put_semantic_cache(self, key, output: List[Message]):
+        # Function calls depend on the tool results that follow, so only final answers are reused
+        if any(msg.function_call for msg in output):
+            return
+        self.semantic_cache.put(key, json.loads(json_dumps_compact(output)))
 
     def _chat(
         self,
@@ -338,6 +481,85 @@ class BaseChatModel(ABC):
     ) -> List[Message]:
         raise NotImplementedError
 
+    def _acall_model_service(
+        self,
+        req: '_ChatRequest',
+        stream: bool,
+        delta_stream: bool,
+    ) -> Union[Awaitable[List[Message]], AsyncIterator[List[Message]]]:
+        if req.fncall_mode:
+            return self._achat_with_functions(
+                messages=req.messages,
+                functions=req.functions,
+                stream=stream,
+                delta_stream=delta_stream,
+                generate_cfg=req.generate_cfg,
+                lang=req.lang,
+            )
+        elif req.messages[-1].role == ASSISTANT:
+            assert not delta_stream, 'Continuation mode does not currently support `delta_stream`'
+            return self._acontinue_assistant_response(req.messages, generate_cfg=req.generate_cfg, stream=stream)
+        else:
+            return self._achat(req.messages, stream=stream, delta_stream=delta_stream, generate_cfg=req.generate_cfg)
+
+    # The async counterparts of the methods above. Each of them returns an awaitable when stream=False,
+    # or an async iterator when stream=True. By default they run the sync methods in worker threads,
+    # override them (mainly `_achat_stream` and `_achat_no_stream`) when the model service has an async client.
+
+    def _achat(
+        self,
+        messages: List[Message],
+        stream: bool,
+        delta_stream: bool,
+        generate_cfg: dict,
+    ) -> Union[Awaitable[List[Message]], AsyncIterator[List[Message]]]:
+        if stream:
+            return self._achat_stream(messages, delta_stream=delta_stream, generate_cfg=generate_cfg)
+        else:
+            return self._achat_no_stream(messages, generate_cfg=generate_cfg)
+
+    def _achat_with_functions(
+        self,
+        messages: List[Message],
+        functions: List[Dict],
+        stream: bool,
+        delta_stream: bool,
+        generate_cfg: dict,
+        lang: Literal['en', 'zh'],
+    ) -> Union[Awaitable[List[Message]], AsyncIterator[List[Message]]]:
+        return _run_in_thread(lambda: self._chat_with_functions(messages,
+                                                                functions=functions,
+                                                                stream=stream,
+                                                                delta_stream=delta_stream,
+                                                                generate_cfg=generate_cfg,
+                                                                lang=lang),
+                              stream=stream)
+
+    def _acontinue_assistant_response(
+        self,
+        messages: List[Message],
+        generate_cfg: dict,
+        stream: bool,
+    ) -> Union[Awaitable[List[Message]], AsyncIterator[List[Message]]]:
+        return _run_in_thread(lambda: self._continue_assistant_response(messages, generate_cfg=generate_cfg,
+                                                                        stream=stream),
+                              stream=stream)
+
+    def _achat_stream(
+        self,
+        messages: List[Message],
+        delta_stream: bool,
+        generate_cfg: dict,
+    ) -> AsyncIterator[List[Message]]:
+        return _aiter_in_thread(lambda: self._chat_stream(messages, delta_stream=delta_stream, generate_cfg=generate_cfg))
+
+    async def _achat_no_stream(
+        self,
+        messages: List[Message],
+        generate_cfg: dict,
+    ) -> List[Message]:
+        return await asyncio.to_thread(self._chat_no_stream, messages, generate_cfg=generate_cfg)
+
     def _preprocess_messages(
         self,
         messages: List[Message],
@@ -599,6 +821,32 @@ def _truncate_at_stop_word(text: str, stop: List[str]):
     return truncated, text
 
 
+def _load_cached_response(cache_value: List[dict], return_message_type: str,
+                          stream: bool) -> Union[List[Message], List[Dict], Iterator[List[Message]], Iterator[List[Dict]]]:
+    if return_message_type == 'message':
+        cache_value: List[Message] = [Message(**m) for m in cache_value]
+    if stream:
+        cache_value: Iterator[List[Union[Message, dict]]] = iter([cache_value])
+    return cache_value
+
+
+class _ChatRequest:
+    """The state of a chat call, shared by `chat`, `achat` and `astream`"""
+
+    def __init__(self):
+        self.messages: List[Message] = []
+        self.functions: Optional[List[Dict]] = None
+        self.stream = True
+        self.delta_stream = False
+        self.generate_cfg: dict = {}
+        self.fncall_mode = False
+        self.lang: Literal['en', 'zh'] = 'en'
+        self.return_message_type = 'dict'
+        self.cache_key: Optional[str] = None
+        self.semantic_cache_key = None
+        self.cached_response = None  # Set when the response is found in the cache
+
+
 def _truncate_input_messages_roughly(messages: List[Message], max_tokens: int) -> List[Message]:
     if len([m for m in messages if m.role == SYSTEM]) >= 2:
         raise ModelServiceError(
@@ -624,10 +872,11 @@ def _truncate_input_messages_roughly(messages: List[Message], max_tokens: int) -
                     message='The input messages (excluding the system message) must start with a user message.',
                 )
 
-    def _count_tokens(msg: Message) -> int:
+    def _count_tokens(msg: Message, exact: bool = False) -> int:
+        counter = tokenizer.count_tokens if exact else count_tokens
         if msg.role == ASSISTANT and msg.function_call:
-            return tokenizer.count_tokens(f'{msg.function_call}')
-        return tokenizer.count_tokens(extract_text_from_message(msg, add_upload_info=True))
+            return counter(f'{msg.function_call}')
+        return counter(extract_text_from_message(msg, add_upload_info=True))
 
     def _truncate_message(msg: Message, max_tokens: int, keep_both_sides: bool = False):
         if isinstance(msg.content, str):
@@ -777,6 +1026,16 @@ def _truncate_input_messages_roughly(messages: List[Message], max_tokens: int) -
         indexed_messages_per_user[last_user_idx].append([msg_idx, msg])
 
     all_tokens = sum([x for x in message_tokens.values()])
+    margin = approx_token_margin(all_tokens) + approx_token_margin(max_tokens - available_token)
+    if margin and all_tokens + margin > available_token:
+        # The approximate counts are only trusted when within the budget by the error bound, which holds for
+        # about 99% of texts, otherwise truncate by the exact counts
+        for msg_idx, msg in enumerate(messages):
+            if msg.role == SYSTEM:
+                available_token = max_tokens - _count_tokens(msg=msg, exact=True)
+            else:
+                message_tokens[msg_idx] = _count_tokens(msg=msg, exact=True)
+        all_tokens = sum([x for x in message_tokens.values()])
     logger.info(f'ALL tokens: {all_tokens}, Available tokens: {available_token}')
     if all_tokens <= available_token:
         return messages
@@ -836,6 +1095,40 @@ def retry_model_service_iterator(
             num_retries, delay = _raise_or_delay(e, num_retries, delay, max_retries)
 
 
+async def aretry_model_service(
+    fn,
+    max_retries: int = 10,
+) -> Any:
+    """Retry an async function, i.e., a function that returns an awaitable"""
+
+    num_retries, delay = 0, 1.0
+    while True:
+        try:
+            return await fn()
+
+        except ModelServiceError as e:
+            num_retries, delay = _get_retry_delay(e, num_retries, delay, max_retries)
+            await asyncio.sleep(delay)
+
+
+async def aretry_model_service_iterator(
+    it_fn,
+    max_retries: int = 10,
+) -> AsyncIterator:
+    """Retry an async iterator"""
+
+    num_retries, delay = 0, 1.0
+    while True:
+        try:
+            async for rsp in it_fn():
+                yield rsp
+            break
+
+        except ModelServiceError as e:
+            num_retries, delay = _get_retry_delay(e, num_retries, delay, max_retries)
+            await asyncio.sleep(delay)
+
+
 def _raise_or_delay(
     e: ModelServiceError,
     num_retries: int,
@@ -846,6 +1139,21 @@ def _raise_or_delay(
 ) -> Tuple[int, float]:
     """Retry with exponential backoff"""
 
+    num_retries, delay = _get_retry_delay(e, num_retries, delay, max_retries, max_delay, exponential_base)
+    time.sleep(delay)
+    return num_retries, delay
+
+
+def _get_retry_delay(
+    e: ModelServiceError,
+    num_retries: int,
+    delay: float,
+    max_retries: int = 10,
+    max_delay: float = 300.0,
+    exponential_base: float = 2.0,
+) -> Tuple[int, float]:
+    """Raise the error if it should not be retried, otherwise return the next retry count and delay"""
+
     if max_retries <= 0:  # no retry
         raise e
 
@@ -871,10 +1179,27 @@ def _raise_or_delay(
     num_retries += 1
     jitter = 1.0 + random.random()
     delay = min(delay * exponential_base, max_delay) * jitter
-    time.sleep(delay)
     return num_retries, delay
 
 
+def _run_in_thread(fn, stream: bool) -> Union[Awaitable, AsyncIterator]:
+    """Run a blocking model call in worker threads, returning an async iterator if it is a streaming call"""
+    if stream:
+        return _aiter_in_thread(fn)
+    return asyncio.to_thread(fn)
+
+
+async def _aiter_in_thread(it_fn) -> AsyncIterator:
+    """Iterate a blocking iterator in worker threads, one item at a time"""
+    it = await asyncio.to_thread(lambda: iter(it_fn()))
+    end = object()
+    while True:
+        rsp = await asyncio.to_thread(next, it, end)
+        if rsp is end:
+            break
+        yield rsp
+
+
 def _rm_think(text: str) -> str:
     if '</think>' in text:
         return text.split('</think>')[-1].lstrip('\n')
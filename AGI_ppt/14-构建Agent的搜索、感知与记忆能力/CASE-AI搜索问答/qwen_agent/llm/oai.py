@@ -12,11 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import copy
 import logging
 import os
+import weakref
 from pprint import pformat
-from typing import Dict, Iterator, List, Optional
+from typing import AsyncIterator, Dict, Iterator, List, Optional
 
 import openai
 
@@ -57,6 +59,7 @@ class TextChatAtOAI(BaseFnCallModel):
                 openai.api_key = api_key
             self._complete_create = openai.Completion.create
             self._chat_complete_create = openai.ChatCompletion.create
+            self._achat_complete_create = None  # Falls back to running `_chat_complete_create` in threads
         else:
             api_kwargs = {}
             if api_base:
@@ -64,7 +67,7 @@ class TextChatAtOAI(BaseFnCallModel):
             if api_key:
                 api_kwargs['api_key'] = api_key
 
-            def _chat_complete_create(*args, **kwargs):
+            def _convert_kwargs(kwargs):
                 # OpenAI API v1 does not allow the following args, must pass by extra_body
                 extra_params = ['top_k', 'repetition_penalty']
                 if any((k in kwargs) for k in extra_params):
@@ -74,26 +77,29 @@ class TextChatAtOAI(BaseFnCallModel):
                             kwargs['extra_body'][k] = kwargs.pop(k)
                 if 'request_timeout' in kwargs:
                     kwargs['timeout'] = kwargs.pop('request_timeout')
+                return kwargs
 
+            def _chat_complete_create(*args, **kwargs):
                 client = openai.OpenAI(**api_kwargs)
-                return client.chat.completions.create(*args, **kwargs)
+                return client.chat.completions.create(*args, **_convert_kwargs(kwargs))
 
             def _complete_create(*args, **kwargs):
-                # OpenAI API v1 does not allow the following args, must pass by extra_body
-                extra_params = ['top_k', 'repetition_penalty']
-                if any((k in kwargs) for k in extra_params):
-                    kwargs['extra_body'] = copy.deepcopy(kwargs.get('extra_body', {}))
-                    for k in extra_params:
-                        if k in kwargs:
-                            kwargs['extra_body'][k] = kwargs.pop(k)
-                if 'request_timeout' in kwargs:
-                    kwargs['timeout'] = kwargs.pop('request_timeout')
-
                 client = openai.OpenAI(**api_kwargs)
-                return client.completions.create(*args, **kwargs)
+                return client.completions.create(*args, **_convert_kwargs(kwargs))
+
+            # The async client keeps a connection pool, so it is shared by the calls on the same event loop
+            async_clients = weakref.WeakKeyDictionary()
+
+            async def _achat_complete_create(*args, **kwargs):
+                loop = asyncio.get_running_loop()
+                client = async_clients.get(loop)
+                if client is None:
+                    client = async_clients[loop] = openai.AsyncOpenAI(**api_kwargs)
+                return await client.chat.completions.create(*args, **_convert_kwargs(kwargs))
 
             self._complete_create = _complete_create
             self._chat_complete_create = _chat_complete_create
+            self._achat_complete_create = _achat_complete_create
 
     def _chat_stream(
         self,
@@ -107,54 +113,12 @@ class TextChatAtOAI(BaseFnCallModel):
             response = self._chat_complete_create(model=self.model, messages=messages, stream=True, **generate_cfg)
             if delta_stream:
                 for chunk in response:
-                    if chunk.choices:
-                        if hasattr(chunk.choices[0].delta,
-                                   'reasoning_content') and chunk.choices[0].delta.reasoning_content:
-                            yield [
-                                Message(role=ASSISTANT,
-                                        content='',
-                                        reasoning_content=chunk.choices[0].delta.reasoning_content)
-                            ]
-                        if hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
-                            yield [Message(role=ASSISTANT, content=chunk.choices[0].delta.content)]
+                    yield from _delta_stream_output(chunk)
             else:
-                full_response = ''
-                full_reasoning_content = ''
-                full_tool_calls = []
+                full_output = _FullStreamOutput()
                 for chunk in response:
                     if chunk.choices:
-                        if hasattr(chunk.choices[0].delta,
-                                   'reasoning_content') and chunk.choices[0].delta.reasoning_content:
-                            full_reasoning_content += chunk.choices[0].delta.reasoning_content
-                        if hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
-                            full_response += chunk.choices[0].delta.content
-                        if hasattr(chunk.choices[0].delta, 'tool_calls') and chunk.choices[0].delta.tool_calls:
-                            for tc in chunk.choices[0].delta.tool_calls:
-                                if full_tool_calls and (not tc.id or
-                                                        tc.id == full_tool_calls[-1]['extra']['function_id']):
-                                    if tc.function.name:
-                                        full_tool_calls[-1].function_call['name'] += tc.function.name
-                                    if tc.function.arguments:
-                                        full_tool_calls[-1].function_call['arguments'] += tc.function.arguments
-                                else:
-                                    full_tool_calls.append(
-                                        Message(role=ASSISTANT,
-                                                content='',
-                                                function_call=FunctionCall(name=tc.function.name,
-                                                                           arguments=tc.function.arguments),
-                                                extra={'function_id': tc.id}))
-
-                        res = []
-                        if full_reasoning_content:
-                            res.append(Message(role=ASSISTANT, content='', reasoning_content=full_reasoning_content))
-                        if full_response:
-                            res.append(Message(
-                                role=ASSISTANT,
-                                content=full_response,
-                            ))
-                        if full_tool_calls:
-                            res += full_tool_calls
-                        yield res
+                        yield full_output.update(chunk)
         except OpenAIError as ex:
             raise ModelServiceError(exception=ex)
 
@@ -166,14 +130,53 @@ class TextChatAtOAI(BaseFnCallModel):
         messages = self.convert_messages_to_dicts(messages)
         try:
             response = self._chat_complete_create(model=self.model, messages=messages, stream=False, **generate_cfg)
-            if hasattr(response.choices[0].message, 'reasoning_content'):
-                return [
-                    Message(role=ASSISTANT,
-                            content=response.choices[0].message.content,
-                            reasoning_content=response.choices[0].message.reasoning_content)
-                ]
+            return _no_stream_output(response)
+        except OpenAIError as ex:
+            raise ModelServiceError(exception=ex)
+
+    async def _achat_stream(
+        self,
+        messages: List[Message],
+        delta_stream: bool,
+        generate_cfg: dict,
+    ) -> AsyncIterator[List[Message]]:
+        if self._achat_complete_create is None:
+            async for rsp in super()._achat_stream(messages, delta_stream=delta_stream, generate_cfg=generate_cfg):
+                yield rsp
+            return
+        messages = self.convert_messages_to_dicts(messages)
+        logger.debug(f'LLM Input generate_cfg: \n{generate_cfg}')
+        try:
+            response = await self._achat_complete_create(model=self.model,
+                                                         messages=messages,
+                                                         stream=True,
+                                                         **generate_cfg)
+            if delta_stream:
+                async for chunk in response:
+                    for rsp in _delta_stream_output(chunk):
+                        yield rsp
             else:
-                return [Message(role=ASSISTANT, content=response.choices[0].message.content)]
+                full_output = _FullStreamOutput()
+                async for chunk in response:
+                    if chunk.choices:
+                        yield full_output.update(chunk)
+        except OpenAIError as ex:
+            raise ModelServiceError(exception=ex)
+
+    async def _achat_no_stream(
+        self,
+        messages: List[Message],
+        generate_cfg: dict,
+    ) -> List[Message]:
+        if self._achat_complete_create is None:
+            return await super()._achat_no_stream(messages, generate_cfg=generate_cfg)
+        messages = self.convert_messages_to_dicts(messages)
+        try:
+            response = await self._achat_complete_create(model=self.model,
+                                                         messages=messages,
+                                                         stream=False,
+                                                         **generate_cfg)
+            return _no_stream_output(response)
         except OpenAIError as ex:
             raise ModelServiceError(exception=ex)
 
@@ -188,3 +191,65 @@ class TextChatAtOAI(BaseFnCallModel):
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f'LLM Input: \n{pformat(messages, indent=2)}')
         return messages
+
+
+def _delta_stream_output(chunk) -> List[List[Message]]:
+    rsp = []
+    if chunk.choices:
+        if hasattr(chunk.choices[0].delta, 'reasoning_content') and chunk.choices[0].delta.reasoning_content:
+            rsp.append([Message(role=ASSISTANT, content='', reasoning_content=chunk.choices[0].delta.reasoning_content)])
+        if hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
+            rsp.append([Message(role=ASSISTANT, content=chunk.choices[0].delta.content)])
+    return rsp
+
+
+class _FullStreamOutput:
+    """Accumulates the streamed chunks into the full response so far"""
+
+    def __init__(self):
+        self.full_response = ''
+        self.full_reasoning_content = ''
+        self.full_tool_calls = []
+
+    def update(self, chunk) -> List[Message]:
+        full_tool_calls = self.full_tool_calls
+        if hasattr(chunk.choices[0].delta, 'reasoning_content') and chunk.choices[0].delta.reasoning_content:
+            self.full_reasoning_content += chunk.choices[0].delta.reasoning_content
+        if hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
+            self.full_response += chunk.choices[0].delta.content
+        if hasattr(chunk.choices[0].delta, 'tool_calls') and chunk.choices[0].delta.tool_calls:
+            for tc in chunk.choices[0].delta.tool_calls:
+                if full_tool_calls and (not tc.id or tc.id == full_tool_calls[-1]['extra']['function_id']):
+                    if tc.function.name:
+                        full_tool_calls[-1].function_call['name'] += tc.function.name
+                    if tc.function.arguments:
+                        full_tool_calls[-1].function_call['arguments'] += tc.function.arguments
+                else:
+                    full_tool_calls.append(
+                        Message(role=ASSISTANT,
+                                content='',
+                                function_call=FunctionCall(name=tc.function.name, arguments=tc.function.arguments),
+                                extra={'function_id': tc.id}))
+
+        res = []
+        if self.full_reasoning_content:
+            res.append(Message(role=ASSISTANT, content='', reasoning_content=self.full_reasoning_content))
+        if self.full_response:
+            res.append(Message(
+                role=ASSISTANT,
+                content=self.full_response,
+            ))
+        if full_tool_calls:
+            res += full_tool_calls
+        return res
+
+
+def _no_stream_output(response) -> List[Message]:
+    if hasattr(response.choices[0].message, 'reasoning_content'):
+        return [
+            Message(role=ASSISTANT,
+                    content=response.choices[0].message.content,
+                    reasoning_content=response.choices[0].message.reasoning_content)
+        ]
+    else:
+        return [Message(role=ASSISTANT, content=response.choices[0].message.content)]
@@ -16,7 +16,7 @@ import json
 import os
 from http import HTTPStatus
 from pprint import pformat
-from typing import Dict, Iterator, List, Optional
+from typing import AsyncIterator, Awaitable, Dict, Iterator, List, Optional, Union
 
 import dashscope
 
@@ -93,6 +93,14 @@ class QwenChatAtDS(BaseFnCallModel):
     ) -> Iterator[List[Message]]:
         return self._chat(messages, stream=stream, delta_stream=False, generate_cfg=generate_cfg)
 
+    def _acontinue_assistant_response(
+        self,
+        messages: List[Message],
+        generate_cfg: dict,
+        stream: bool,
+    ) -> Union[Awaitable[List[Message]], AsyncIterator[List[Message]]]:
+        return self._achat(messages, stream=stream, delta_stream=False, generate_cfg=generate_cfg)
+
     @staticmethod
     def _delta_stream_output(response) -> Iterator[List[Message]]:
         for chunk in response:
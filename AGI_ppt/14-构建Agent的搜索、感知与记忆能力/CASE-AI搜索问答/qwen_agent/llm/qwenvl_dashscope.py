@@ -17,7 +17,7 @@ import os
 import re
 from http import HTTPStatus
 from pprint import pformat
-from typing import Dict, Iterator, List, Optional
+from typing import AsyncIterator, Awaitable, Dict, Iterator, List, Optional, Union
 
 import dashscope
 
@@ -134,6 +134,14 @@ class QwenVLChatAtDS(BaseFnCallModel):
     ) -> Iterator[List[Message]]:
         return self._chat(messages, stream=stream, delta_stream=False, generate_cfg=generate_cfg)
 
+    def _acontinue_assistant_response(
+        self,
+        messages: List[Message],
+        generate_cfg: dict,
+        stream: bool,
+    ) -> Union[Awaitable[List[Message]], AsyncIterator[List[Message]]]:
+        return self._achat(messages, stream=stream, delta_stream=False, generate_cfg=generate_cfg)
+
 
 # DashScope Qwen-VL requires the following format for local files:
 #   Linux & Mac: file:///home/images/test.png
@@ -0,0 +1,162 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from qwen_agent.llm.schema import SYSTEM, USER, Message
+from qwen_agent.log import logger
+from qwen_agent.utils.embedding_cache import get_default_cache
+from qwen_agent.utils.utils import extract_text_from_message, hash_sha256, json_dumps_compact
+
+DEFAULT_SEMANTIC_CACHE_EMBEDDING_MODEL = 'text-embedding-v4'
+
+
+class SemanticResponseCache:
+    """Reuse the response to a previous request whose last user turn is semantically similar
+
+    The requests are first partitioned by a context key, which is the hash of the system messages
+    (where Assistant puts the retrieved knowledge), the functions and the extra generate cfg.
+    Within one context, the response of the most similar previous user turn is returned if the cosine
+    similarity of their embeddings reaches the threshold. The rest of the history is not compared.
+
+    Configured by the `semantic_cache` field of the LLM cfg, e.g.:
+        {'threshold': 0.95, 'max_size': 1000, 'ttl': 3600, 'embedding_model': 'text-embedding-v4'}
+    A LangChain-style `embeddings` object (with `embed_query`) can be given instead of the DashScope model.
+    """
+
+    def __init__(self, cfg: Optional[Dict] = None):
+        cfg = cfg or {}
+        self.threshold: float = cfg.get('threshold', 0.95)
+        self.max_size: int = cfg.get('max_size', 1000)
+        self.ttl: Optional[float] = cfg.get('ttl', 24 * 3600)
+        self.embeddings = cfg.get('embeddings')
+        default_model = DEFAULT_SEMANTIC_CACHE_EMBEDDING_MODEL if self.embeddings is None else type(
+            self.embeddings).__name__
+        self.embedding_model: str = cfg.get('embedding_model', default_model)
+        self._client = None
+
+        self._lock = threading.Lock()
+        # context key -> entry id -> (created time, normalized vector, response)
+        self._entries: Dict[str, OrderedDict] = {}
+        self._order: OrderedDict = OrderedDict()  # entry id -> context key, in the order of last use
+        self._next_id = 0
+        self.hits = self.misses = 0
+
+    def make_key(self, messages: List[Message], functions: Optional[List[Dict]],
+                 extra_generate_cfg: Optional[Dict]) -> Optional[Tuple[str, str]]:
+        """The (context key, query) of a request, or None if the request is not cacheable"""
+        if not messages or messages[-1].role != USER:
+            return None
+        query = extract_text_from_message(messages[-1], add_upload_info=True).strip()
+        if not query:
+            return None
+        context = dict(system=[m for m in messages if m.role == SYSTEM],
+                       functions=functions,
+                       extra_generate_cfg=extra_generate_cfg)
+        return hash_sha256(json_dumps_compact(context, sort_keys=True)), query
+
+    def get(self, key: Tuple[str, str]) -> Optional[List[dict]]:
+        context_key, query = key
+        with self._lock:
+            self._expire(context_key)
+            entries = self._entries.get(context_key)
+            if not entries:
+                self.misses += 1
+                return None
+        try:
+            vector = self._embed(query)
+        except Exception as e:
+            logger.warning(f'Semantic cache lookup skipped because embedding failed: {e}')
+            vector = None
+        with self._lock:
+            entries = self._entries.get(context_key)
+            if not entries or vector is None:
+                self.misses += 1
+                return None
+            entry_ids = list(entries.keys())
+            similarities = np.stack([entries[i][1] for i in entry_ids]) @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            entry_id = entry_ids[best]
+            self._order.move_to_end(entry_id)
+            self.hits += 1
+            logger.info(f'Semantic cache hit with similarity {similarities[best]:.4f}')
+            return entries[entry_id][2]
+
+    def put(self, key: Tuple[str, str], response: List[dict]):
+        context_key, query = key
+        try:
+            vector = self._embed(query)
+        except Exception as e:
+            logger.warning(f'Semantic cache update skipped because embedding failed: {e}')
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries.setdefault(context_key, OrderedDict())[entry_id] = (time.time(), vector, response)
+            self._order[entry_id] = context_key
+            while len(self._order) > self.max_size:
+                old_id, old_context_key = self._order.popitem(last=False)
+                self._remove(old_context_key, old_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._order),
+            }
+
+    def _embed(self, query: str) -> np.ndarray:
+        # The query embeddings are shared with the retrievers
+        vector = get_default_cache().get_or_compute(query, self._compute_embedding, namespace=self.embedding_model)
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _compute_embedding(self, query: str) -> List[float]:
+        if self.embeddings is not None:
+            return self.embeddings.embed_query(query)
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=os.getenv('DASHSCOPE_API_KEY'),
+                                  base_url='https://dashscope.aliyuncs.com/compatible-mode/v1')
+        response = self._client.embeddings.create(model=self.embedding_model, input=query, encoding_format='float')
+        return response.data[0].embedding
+
+    def _expire(self, context_key: str):
+        entries = self._entries.get(context_key)
+        if not entries or self.ttl is None:
+            return
+        deadline = time.time() - self.ttl
+        for entry_id in [i for i, entry in entries.items() if entry[0] < deadline]:
+            self._order.pop(entry_id, None)
+            self._remove(context_key, entry_id)
+
+    def _remove(self, context_key: str, entry_id: int):
+        entries = self._entries.get(context_key)
+        if entries is not None:
+            entries.pop(entry_id, None)
+            if not entries:
+                del self._entries[context_key]
@@ -1,16 +1,51 @@
 # qwen_agent/searcher/elasticsearch_searcher.py
 import os
-import json
 import hashlib
 import logging
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from elasticsearch import Elasticsearch, helpers
 from elasticsearch.exceptions import BadRequestError  # 导入特定的异常
 from qwen_agent.tools.doc_parser import DocParser
-from openai import OpenAI
+from qwen_agent.utils.embedding_cache import get_default_cache
+from openai import OpenAI, RateLimitError
 
 # 为此模块设置一个日志记录器
 logger = logging.getLogger(__name__)
 
+# 混合搜索的加权 RRF 预设：score = Σ weight / (k + rank)
+HYBRID_MODES = {
+    # 平衡模式：关键词和向量五五开，兼顾精确匹配和语义理解
+    'balanced': {'rrf_k': 60, 'bm25_weight': 0.5, 'knn_weight': 0.5},
+    # 偏向量模式：优先语义相似，适合模糊查询或找“相关内容”
+    'toward_vector': {'rrf_k': 20, 'bm25_weight': 0.3, 'knn_weight': 0.7},
+    # 偏关键词模式：优先精确匹配，适合搜人名、代码、专有名词
+    'toward_keyword': {'rrf_k': 100, 'bm25_weight': 0.7, 'knn_weight': 0.3},
+}
+
+
+def rrf_fuse(ranked_ids: list, weights: list, k: float, size: int) -> list:
+    """
+    加权 RRF 融合多路检索结果。
+    ranked_ids 中每一路是按相关性排好序的文档 ID 列表，返回 [(文档 ID, 融合得分), ...]，按得分降序取前 size 个；
+    得分相同时保持首次出现的顺序。
+    """
+    id_to_pos = {}
+    positions, contributions = [], []
+    for ids, weight in zip(ranked_ids, weights):
+        ranks = np.arange(1, len(ids) + 1, dtype=np.float64)
+        positions.extend(id_to_pos.setdefault(doc_id, len(id_to_pos)) for doc_id in ids)
+        contributions.append(weight / (k + ranks))
+    if not id_to_pos:
+        return []
+    scores = np.zeros(len(id_to_pos))
+    np.add.at(scores, positions, np.concatenate(contributions))
+    all_ids = list(id_to_pos)
+    return [(all_ids[i], float(scores[i])) for i in np.argsort(-scores, kind='stable')[:size]]
+
 class ElasticsearchSearcher:
     """一个使用 Elasticsearch 进行文档索引和搜索的搜索器。"""
 
@@ -23,9 +58,27 @@ class ElasticsearchSearcher:
         self.password = es_cfg.get('password')
         self.index_name = es_cfg.get('index_name', 'qwen_agent_rag_idx')
         self.search_type = es_cfg.get('search_type', 'keywords')
+
+        # embedding 配置：建索引时按批请求、多线程并发，遇到 429 限流时指数退避重试
+        self.embedding_model = es_cfg.get('embedding_model', 'text-embedding-v4')
+        self.embedding_dims = es_cfg.get('embedding_dims', 1024)
+        self.embedding_batch_size = es_cfg.get('embedding_batch_size', 10)  # text-embedding-v4 每次最多 10 条
+        self.embedding_max_workers = es_cfg.get('embedding_max_workers', 4)
+        self.embedding_max_retries = es_cfg.get('embedding_max_retries', 5)
+        self.embedding_initial_backoff = es_cfg.get('embedding_initial_backoff', 1.0)
+        self.embedding_max_backoff = es_cfg.get('embedding_max_backoff', 30.0)
+        self.bulk_chunk_size = es_cfg.get('bulk_chunk_size', 500)  # 每个 bulk 请求的文档数
+
+        # 混合搜索配置，search() 可按请求覆盖
+        self.hybrid_mode = es_cfg.get('hybrid_mode', 'toward_vector')  # 见 HYBRID_MODES
+        self.num_candidates = es_cfg.get('num_candidates', 1000)
+        self.search_size = es_cfg.get('search_size', 6)
+        self._search_executor = None
+        self.query_cache = get_default_cache()  # 查询向量缓存，重复的问题不再请求 embedding 服务
         self.embedding_client = OpenAI(
             api_key=os.getenv("DASHSCOPE_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
+            base_url=es_cfg.get('embedding_base_url', "https://dashscope.aliyuncs.com/compatible-mode/v1"),
+            max_retries=0,  # 由 _get_embeddings 统一重试
         )
 
         # DocParser 用于解析和分块文档
@@ -85,7 +138,7 @@ class ElasticsearchSearcher:
                             # 添加向量字段
                             "vector_content": {
                                 "type": "dense_vector",
-                                "dims": 1024,  # 根据你用的模型维度调整
+                                "dims": self.embedding_dims,  # 与 embedding 请求的 dimensions 一致
                                 "index": True,
                                 "similarity": "cosine"
                             }
@@ -113,7 +166,7 @@ class ElasticsearchSearcher:
                                     # 添加向量字段
                                     "vector_content": {
                                         "type": "dense_vector",
-                                        "dims": 1024,  # 根据你用的模型维度调整
+                                        "dims": self.embedding_dims,  # 与 embedding 请求的 dimensions 一致
                                         "index": True,
                                         "similarity": "cosine"
                                     }
@@ -132,29 +185,99 @@ class ElasticsearchSearcher:
             logger.error(f"创建或检查索引 '{self.index_name}' 时发生严重错误: {e}")
 
     def _get_embedding(self, text: str) -> list:
-        """使用 Dashscope 的 text-embedding-v4 模型为文本生成向量。"""
-        print('111111')
-        try:
-            # 确保文本不为空
-            if not text.strip():
-                return []
+        """使用 Dashscope 的 text-embedding-v4 模型为查询生成向量，重复的查询直接复用缓存的向量。"""
+        vector = self.query_cache.get_or_compute(text,
+                                                 lambda t: self._get_embeddings([t])[0],
+                                                 namespace=f'{self.embedding_model}:{self.embedding_dims}')
+        return vector.tolist() if len(vector) else []
 
-            response = self.embedding_client.embeddings.create(
-                model="text-embedding-v4",
-                input=text,
-                dimensions=1024,
-                encoding_format="float"
-            )
-            return response.data[0].embedding
-        except Exception as e:
-            print(f"  - 获取 embedding 时出错: {e}")
-            return []
+    def _get_embeddings(self, texts: list) -> list:
+        """
+        一次请求为一批文本生成向量，返回与 texts 等长的列表，空文本或失败时对应的向量为 []。
+        遇到 429 限流时按指数退避（带随机抖动，并参考 Retry-After）重试，最多 embedding_max_retries 次。
+        """
+        vectors = [[] for _ in texts]
+        # 确保文本不为空
+        indices = [i for i, text in enumerate(texts) if text.strip()]
+        if not indices:
+            return vectors
+
+        for attempt in range(self.embedding_max_retries + 1):
+            try:
+                response = self.embedding_client.embeddings.create(
+                    model=self.embedding_model,
+                    input=[texts[i] for i in indices],
+                    dimensions=self.embedding_dims,
+                    encoding_format="float"
+                )
+                for item in response.data:
+                    vectors[indices[item.index]] = item.embedding
+                return vectors
+            except RateLimitError as e:
+                if attempt == self.embedding_max_retries:
+                    logger.error(f"获取 embedding 时持续被限流，已重试 {attempt} 次: {e}")
+                    return vectors
+                delay = min(self.embedding_max_backoff, self.embedding_initial_backoff * 2**attempt)
+                delay *= random.uniform(0.5, 1.0)
+                retry_after = e.response.headers.get('retry-after') if e.response is not None else None
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                logger.warning(f"获取 embedding 时被限流 (429)，{delay:.1f} 秒后第 {attempt + 1} 次重试。")
+                time.sleep(delay)
+            except Exception as e:
+                logger.error(f"获取 embedding 时出错: {e}")
+                return vectors
+        return vectors
+
+    def _iter_embedded_chunks(self, chunks: list):
+        """
+        按 embedding_batch_size 分批、用线程池并发生成向量，按原顺序逐块产出带 'vector' 的块。
+        同时在途的批次数有上限，下游的 bulk 写入可以边生成边写，内存占用不随块数增长。
+        """
+        batch_size = max(1, self.embedding_batch_size)
+        max_in_flight = 2 * self.embedding_max_workers
+        pending = deque()
+
+        def _pop_batch():
+            batch, future = pending.popleft()
+            for chunk, vector in zip(batch, future.result()):
+                chunk['vector'] = vector
+                yield chunk
+
+        with ThreadPoolExecutor(max_workers=self.embedding_max_workers) as executor:
+            for start in range(0, len(chunks), batch_size):
+                batch = chunks[start:start + batch_size]
+                pending.append((batch, executor.submit(self._get_embeddings, [c['content'] for c in batch])))
+                if len(pending) >= max_in_flight:
+                    yield from _pop_batch()
+            while pending:
+                yield from _pop_batch()
+
+    def _iter_index_actions(self, chunks: list):
+        """为新块生成 bulk 请求的 action，向量生成失败的块只按关键词索引。"""
+        for chunk in self._iter_embedded_chunks(chunks):
+            source = {
+                "content": chunk['content'],
+                "source": chunk['metadata']['source'],
+                "token": chunk.get('token', 0),
+            }
+            if chunk['vector']:
+                source["vector_content"] = chunk['vector']  # 添加向量数据
+            yield {
+                "_op_type": "index",
+                "_index": self.index_name,
+                "_id": chunk['id'],
+                "_source": source,
+            }
 
     def index_files(self, files: list):
         """
         高效地索引文件列表。
         它首先获取所有文件的所有文本块，然后通过一次 mget 请求过滤掉已存在的块，
-        最后通过一次 bulk 请求批量索引所有新块。
+        最后分批并发生成向量，并通过 streaming_bulk 边生成边写入，全部写完后只刷新一次索引。
         """
         if not self.client:
             logger.error("Elasticsearch 客户端不可用，无法执行索引。")
@@ -168,63 +291,49 @@ class ElasticsearchSearcher:
             logger.warning("未能从文件中提取任何内容块，索引过程终止。")
             return
 
-        print(' hi啊师大',chunks)
-
         # 高效地筛选出需要索引的新块
         new_chunks = self._filter_existing_chunks_efficiently(chunks)
 
-        for chunk in new_chunks:
-            # TODO: 接入 embedding 模型生成向量
-            chunk['vector'] = self._get_embedding(chunk['content'])
-
         if new_chunks:
-            logger.info(f'发现 {len(new_chunks)} 个新的文档块，开始向 Elasticsearch 批量索引...')
-            actions = [{
-                "_op_type": "index",
-                "_index": self.index_name,
-                "_id": chunk['id'],
-                "_source": {
-                    "content": chunk['content'],
-                    "source": chunk['metadata']['source'],
-                    "token": chunk.get('token', 0),
-                    "vector_content": chunk['vector']  # 添加向量数据
-                },
-            } for chunk in new_chunks]
-
+            logger.info(f'发现 {len(new_chunks)} 个新的文档块，开始生成向量并向 Elasticsearch 批量索引...')
+            time1 = time.time()
+            successes, errors = 0, []
             try:
-                successes, errors = helpers.bulk(self.client, actions, refresh=True, raise_on_error=False)
-                logger.info(f"成功索引 {successes} 个新文档块。")
-                if errors:
-                    logger.error(f"批量索引过程中发生 {len(errors)} 个错误。第一个错误详情: {errors[0]}")
-            except helpers.BulkIndexError as e:
-                logger.error(f"批量索引时发生严重错误: {len(e.errors)} 个文档索引失败。")
+                # ES 返回 429 时，streaming_bulk 会对被拒绝的文档退避重试
+                for ok, info in helpers.streaming_bulk(self.client,
+                                                       self._iter_index_actions(new_chunks),
+                                                       chunk_size=self.bulk_chunk_size,
+                                                       max_retries=3,
+                                                       raise_on_error=False):
+                    if ok:
+                        successes += 1
+                    else:
+                        errors.append(info)
+                self.client.indices.refresh(index=self.index_name)
+            except Exception as e:
+                logger.error(f"批量索引时发生严重错误: {e}")
+            time2 = time.time()
+            logger.info(f"成功索引 {successes} 个新文档块，耗时 {time2 - time1:.1f} 秒 "
+                        f"({successes / max(time2 - time1, 1e-6):.1f} 块/秒)。")
+            if errors:
+                logger.error(f"批量索引过程中发生 {len(errors)} 个错误。第一个错误详情: {errors[0]}")
         else:
             logger.info("所有文件内容均已在 Elasticsearch 中建立索引，无需更新。")
 
     def _get_chunks(self, files: list) -> list:
         """从文件列表中提取并返回所有文本块。"""
         all_chunks = []
-        for file_path in files:
+        # 1. 多进程并行解析所有文件，已解析过的文件直接从缓存读取，结果与 files 顺序一致
+        records = self.parser.get_records(files)
+        for file_path, record in zip(files, records):
             try:
-                # 1. 准备 JSON 字符串参数
-                params_str = json.dumps({'url': file_path})
-
-                # 2. 调用 DocParser，它会返回一个 JSON 字符串
-                parsed_content_str = self.parser.call(
-                    params=params_str,
-                    use_cache=False  # 强制重新解析，忽略缓存
-                )
-
-                # 3. 解析返回的 JSON 字符串
-                parsed_record = parsed_content_str
-
-                # 检查解析后的记录是否出错
-                if 'error' in parsed_record:
-                    logger.error(f"解析文件 '{file_path}' 时返回错误: {parsed_record['error']}")
+                # 2. 单个文件解析失败不影响其他文件
+                if isinstance(record, Exception):
+                    logger.error(f"解析文件 '{file_path}' 时返回错误: {record}")
                     continue
 
-                # 从记录中提取 'raw' 块
-                chunks_data = parsed_record.get('raw', [])
+                # 3. 从记录中提取 'raw' 块
+                chunks_data = record.to_dict().get('raw', [])
 
                 # 为每个块添加源文件信息
                 for chunk in chunks_data:
@@ -269,6 +378,76 @@ class ElasticsearchSearcher:
         logger.info(f"筛选出 {len(new_chunks)} 个新块需要索引。")
         return new_chunks
 
+    def _hybrid_search(self, query: str, hybrid_mode: str = None, rrf_k: float = None, bm25_weight: float = None,
+                       knn_weight: float = None, num_candidates: int = None, size: int = None) -> list:
+        """
+        混合搜索：关键词子查询在后台线程中发出，与查询向量的生成重叠；向量生成后再发出 kNN 子查询，
+        最后在本地用加权 RRF 融合两路结果。耗时约为 max(BM25, embedding + kNN)，而不是三者之和。
+        """
+        params = dict(HYBRID_MODES[hybrid_mode or self.hybrid_mode])
+        for key, value in (('rrf_k', rrf_k), ('bm25_weight', bm25_weight), ('knn_weight', knn_weight)):
+            if value is not None:
+                params[key] = value
+        num_candidates = num_candidates or self.num_candidates
+        size = size or self.search_size
+        logger.info(f"🔀 使用【混合搜索（手动 RRF）】模式: K={params['rrf_k']}, BM25权重={params['bm25_weight']}, "
+                    f"KNN权重={params['knn_weight']}, num_candidates={num_candidates}")
+
+        bm25_body = {"query": {"match": {"content": query}}, "size": size}
+        bm25_future = self._get_search_executor().submit(self.client.search, index=self.index_name, body=bm25_body)
+
+        knn_hits = []
+        query_vector = self._get_embedding(query)
+        if query_vector:
+            knn_body = {
+                "knn": {
+                    "field": "vector_content",
+                    "query_vector": query_vector,
+                    "k": size,
+                    "num_candidates": max(num_candidates, size)
+                },
+                "size": size
+            }
+            try:
+                knn_hits = self.client.search(index=self.index_name, body=knn_body)['hits']['hits']
+            except Exception as e:
+                logger.error(f"❌ 向量子查询失败: {e}")
+        else:
+            logger.warning("⚠️ 无法生成查询向量，只使用关键词搜索的结果。")
+
+        try:
+            bm25_hits = bm25_future.result()['hits']['hits']
+        except Exception as e:
+            logger.error(f"❌ 关键词子查询失败: {e}")
+            bm25_hits = []
+
+        hit_map = {}
+        for hit in bm25_hits + knn_hits:
+            hit_map.setdefault(hit['_id'], hit)
+        fused = rrf_fuse([[hit['_id'] for hit in bm25_hits], [hit['_id'] for hit in knn_hits]],
+                         weights=[params['bm25_weight'], params['knn_weight']],
+                         k=params['rrf_k'],
+                         size=size)
+        hits = []
+        for doc_id, score in fused:
+            hit = hit_map[doc_id]
+            hit['_score'] = score  # 更新 _score 供后续使用
+            hits.append(hit)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            bm25_ranks = {hit['_id']: rank for rank, hit in enumerate(bm25_hits)}
+            knn_ranks = {hit['_id']: rank for rank, hit in enumerate(knn_hits)}
+            for i, hit in enumerate(hits):
+                logger.debug(f"  No.{i + 1} | ID:{hit['_id'][:6]}... | BM25 Rank: {bm25_ranks.get(hit['_id'])} | "
+                             f"KNN Rank: {knn_ranks.get(hit['_id'])} | 总分: {hit['_score']:.4f}")
+        logger.info(f"🧩 RRF 融合完成：BM25 {len(bm25_hits)} 条 + KNN {len(knn_hits)} 条 -> 最终 {len(hits)} 条")
+        return hits
+
+    def _get_search_executor(self) -> ThreadPoolExecutor:
+        if self._search_executor is None:
+            self._search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='es_search')
+        return self._search_executor
+
     def print_hits(self,query,hits):
         # ===== 🖨️ 打印所有检索结果 =====
         print("\n" + "=" * 80)
@@ -298,9 +477,11 @@ class ElasticsearchSearcher:
         print("=" * 80 + "\n")
         # ================================
 
-    def search(self, query: str, max_ref_token: int) -> list:
+    def search(self, query: str, max_ref_token: int, **kwargs) -> list:
         """
         在 Elasticsearch 中执行搜索，根据 search_type 选择不同的查询方式。
+        混合搜索可按请求传入 hybrid_mode / rrf_k / bm25_weight / knn_weight / num_candidates / size，
+        未传入的参数使用 es 配置中的默认值。
         """
         if not self.client:
             logger.error("❌ Elasticsearch 客户端不可用，无法执行搜索。")
@@ -379,124 +560,8 @@ class ElasticsearchSearcher:
 
 
         elif self.search_type == 'hybrid':
-
-            # ========== 模式3: 混合搜索（手动 RRF 版）带详细评分 ==========
-
-            logger.info(f"🔀 使用【混合搜索（手动 RRF）】模式...")
-
-            query_vector = self._get_embedding(query)
-
-            # 如果向量生成失败，纯回退
-            if not query_vector:
-                logger.warning("⚠️ 无法生成查询向量，回退到关键词搜索。")
-                search_body = {"query": {"match": {"content": query}}, "size": 6}
-                response = self.client.search(index=self.index_name, body=search_body)
-                hits = response['hits']['hits']
-            else:
-                # --- 第一步：单独跑关键词搜索 ---
-                bm25_search_body = {"query": {"match": {"content": query}}, "size": 6}
-                try:
-                    bm25_response = self.client.search(index=self.index_name, body=bm25_search_body)
-                    bm25_hits = bm25_response['hits']['hits']
-                except Exception as e:
-                    logger.error(f"❌ 关键词子查询失败: {e}")
-                    bm25_hits = []
-
-                # --- 第二步：单独跑向量搜索 ---
-                knn_search_body = {
-                    "knn": {
-                        "field": "vector_content",
-                        "query_vector": query_vector,
-                        "k": 6,
-                        "num_candidates": 1000
-                    },
-                    "size": 6
-                }
-                try:
-                    knn_response = self.client.search(index=self.index_name, body=knn_search_body)
-                    knn_hits = knn_response['hits']['hits']
-                except Exception as e:
-                    logger.error(f"❌ 向量子查询失败: {e}")
-                    knn_hits = []
-                # --- 第三步：手动执行加权 RRF (Reciprocal Rank Fusion) ---
-
-                # 1. 平衡模式 (推荐)：关键词和向量五五开，兼顾精确匹配和语义理解
-                MODE_BALANCED = {"k": 60, "bm25": 0.5, "knn": 0.5}
-
-                # 2. 偏向量模式：优先语义相似，适合模糊查询或找“相关内容”
-                MODE_TOWARD_VECTOR = {"k": 20, "bm25": 0.3, "knn": 0.7}
-
-                # 3. 偏关键词模式：优先精确匹配，适合搜人名、代码、专有名词
-                MODE_TOWARD_KEYWORD = {"k": 100, "bm25": 0.7, "knn": 0.3}
-
-                # 👇👇👇 【在这里选择模式】 👇👇👇
-                current_mode = MODE_TOWARD_VECTOR  # 修改这里切换模式：MODE_BALANCED / MODE_TOWARD_VECTOR / MODE_TOWARD_KEYWORD
-
-                # 提取参数
-                k_constant = current_mode["k"]
-                bm25_weight = current_mode["bm25"]
-                knn_weight = current_mode["knn"]
-
-                logger.info(f"⚙️  当前混合搜索模式配置: K={k_constant}, BM25权重={bm25_weight}, KNN权重={knn_weight}")
-
-                rrf_scores = {}
-
-                # 👇 打印并计算关键词评分
-                print("\n" + "=" * 30 + " 📊 关键词评分 (BM25) " + "=" * 30)
-                for rank, hit in enumerate(bm25_hits):
-                    doc_id = hit['_id']
-                    content_preview = hit['_source'].get('content', '')[:15].replace('\n', ' ')
-
-                    # ✅ 修改点1：应用权重系数 (weight / (k + rank))
-                    score = (bm25_weight / (k_constant + rank + 1))
-                    rrf_scores[doc_id] = {"score": score, "hit": hit}
-
-                    print(
-                        f"  Rank {rank}: ID:{doc_id[:6]}... | '{content_preview}...' | (+{score:.4f} 分) [权重:{bm25_weight}]")
-
-                # 👇 打印并计算向量评分
-                print("\n" + "=" * 30 + " 🧠 向量评分 (KNN) " + "=" * 30)
-                for rank, hit in enumerate(knn_hits):
-                    doc_id = hit['_id']
-                    content_preview = hit['_source'].get('content', '')[:15].replace('\n', ' ')
-
-                    # ✅ 修改点2：应用权重系数 (weight / (k + rank))
-                    score = (knn_weight / (k_constant + rank + 1))
-
-                    if doc_id in rrf_scores:
-                        # 双料冠军：分数累加
-                        rrf_scores[doc_id]["score"] += score
-                        print(
-                            f"  Rank {rank}: ID:{doc_id[:6]}... | '{content_preview}...' | (+{score:.4f} 分) ⭐ 双料冠军！总分: {rrf_scores[doc_id]['score']:.4f}")
-                    else:
-                        # 单打独斗
-                        rrf_scores[doc_id] = {"score": score, "hit": hit}
-                        print(
-                            f"  Rank {rank}: ID:{doc_id[:6]}... | '{content_preview}...' | (+{score:.4f} 分) [权重:{knn_weight}]")
-
-                # --- 第四步：按 RRF 得分排序并取前 6 ---
-                sorted_hits = sorted(
-                    rrf_scores.values(),
-                    key=lambda x: x["score"],
-                    reverse=True
-                )
-
-                # 👇 打印最终融合排行榜
-                print("\n" + "=" * 30 + " 🏆 最终融合榜单 (Top 6) " + "=" * 30)
-                hits = []
-                for i, item in enumerate(sorted_hits[:6]):
-                    hit = item["hit"]
-                    score = item["score"]
-                    hit['_score'] = score  # 更新 _score 供后续使用
-                    hits.append(hit)
-
-                    content_preview = hit['_source'].get('content', '')[:15].replace('\n', ' ')
-                    print(f"  No.{i + 1} | ID:{hit['_id'][:6]}... | '{content_preview}...' | 总分: {score:.4f}")
-
-                print("=" * 80 + "\n")
-
-                logger.info(f"🧩 RRF 融合完成：BM25 {len(bm25_hits)} 条 + KNN {len(knn_hits)} 条 -> 最终 {len(hits)} 条")
-
+            # ========== 模式3: 混合搜索（手动 RRF） ==========
+            hits = self._hybrid_search(query, **kwargs)
 
         else:
             # 未知的检索模式，回退到关键词搜索
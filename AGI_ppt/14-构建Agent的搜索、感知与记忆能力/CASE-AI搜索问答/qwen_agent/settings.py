@@ -26,14 +26,49 @@ MAX_LLM_CALL_PER_RUN: int = int(os.getenv('QWEN_AGENT_MAX_LLM_CALL_PER_RUN', 20)
 # Settings for tools
 DEFAULT_WORKSPACE: str = os.getenv('QWEN_AGENT_DEFAULT_WORKSPACE', 'workspace')
 
+# Settings for tokenizer
+DEFAULT_TOKEN_COUNTER: Literal['exact', 'approx'] = os.getenv(
+    'QWEN_AGENT_DEFAULT_TOKEN_COUNTER', 'exact')  # 'approx' estimates the tokens by characters, see tokenization_qwen
+DEFAULT_TOKENIZER_CACHE_DIR: str = os.getenv(
+    'QWEN_AGENT_TOKENIZER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache',
+                                                   'qwen_agent'))  # The decoded vocabulary is cached here
+
 # Settings for RAG
 DEFAULT_MAX_REF_TOKEN: int = int(os.getenv('QWEN_AGENT_DEFAULT_MAX_REF_TOKEN',
                                            20000))  # The window size reserved for RAG materials
 DEFAULT_PARSER_PAGE_SIZE: int = int(os.getenv('QWEN_AGENT_DEFAULT_PARSER_PAGE_SIZE',
                                               500))  # Max tokens per chunk when doing RAG
+DEFAULT_PARSER_MAX_WORKERS: int = int(os.getenv('QWEN_AGENT_DEFAULT_PARSER_MAX_WORKERS', min(
+    8, os.cpu_count() or 1)))  # Max processes for parsing multiple files
+DEFAULT_PARSER_TIMEOUT: int = int(os.getenv('QWEN_AGENT_DEFAULT_PARSER_TIMEOUT',
+                                            600))  # Max seconds for parsing one file in the process pool
+DEFAULT_TOKEN_CACHE_SIZE: int = int(os.getenv('QWEN_AGENT_DEFAULT_TOKEN_CACHE_SIZE',
+                                              20000))  # Max number of tokenized chunks kept in memory
+DEFAULT_TOKEN_CACHE_DIR: str = os.getenv('QWEN_AGENT_DEFAULT_TOKEN_CACHE_DIR',
+                                         '')  # A diskcache directory of the tokenized chunks, empty means memory only
+DEFAULT_QUERY_EMBEDDING_CACHE_SIZE: int = int(os.getenv('QWEN_AGENT_DEFAULT_QUERY_EMBEDDING_CACHE_SIZE',
+                                                        10000))  # Max number of query embeddings kept in memory
+DEFAULT_QUERY_EMBEDDING_CACHE_TTL: float = float(os.getenv('QWEN_AGENT_DEFAULT_QUERY_EMBEDDING_CACHE_TTL',
+                                                           24 * 3600))  # Seconds, 0 means never expire
+DEFAULT_QUERY_EMBEDDING_CACHE_PATH: str = os.getenv('QWEN_AGENT_DEFAULT_QUERY_EMBEDDING_CACHE_PATH',
+                                                    '')  # A sqlite file as the disk tier, empty means memory only
 DEFAULT_RAG_KEYGEN_STRATEGY: Literal['None', 'GenKeyword', 'SplitQueryThenGenKeyword', 'GenKeywordWithKnowledge',
                                      'SplitQueryThenGenKeywordWithKnowledge'] = os.getenv(
                                          'QWEN_AGENT_DEFAULT_RAG_KEYGEN_STRATEGY', 'GenKeyword')
 DEFAULT_RAG_SEARCHERS: List[str] = ast.literal_eval(
     os.getenv('QWEN_AGENT_DEFAULT_RAG_SEARCHERS',
               "['keyword_search', 'front_page_search']"))  # Sub-searchers for hybrid retrieval
+DEFAULT_RAG_RRF_K: int = int(os.getenv('QWEN_AGENT_DEFAULT_RAG_RRF_K',
+                                       60))  # The k constant of the reciprocal rank fusion in hybrid retrieval
+
+# Settings for code interpreter
+DEFAULT_CODE_INTERPRETER_POOL_SIZE: int = int(os.getenv(
+    'QWEN_AGENT_CODE_INTERPRETER_POOL_SIZE', 1))  # Warm kernels kept per work_dir, 0 starts a kernel for each session
+DEFAULT_CODE_INTERPRETER_IDLE_TIMEOUT: float = float(os.getenv(
+    'QWEN_AGENT_CODE_INTERPRETER_IDLE_TIMEOUT', 1800))  # Seconds before an unused session loses its kernel, 0 = never
+DEFAULT_CODE_INTERPRETER_KERNEL_RECYCLE: Literal['restart', 'reset'] = os.getenv(
+    'QWEN_AGENT_CODE_INTERPRETER_KERNEL_RECYCLE', 'restart')  # 'reset' reuses the process but keeps imported modules
+DEFAULT_CODE_INTERPRETER_MAX_MEMORY_MB: int = int(os.getenv('QWEN_AGENT_CODE_INTERPRETER_MAX_MEMORY_MB',
+                                                            0))  # The address space limit per kernel, 0 = no limit
+DEFAULT_CODE_INTERPRETER_MAX_CPU_SECONDS: int = int(os.getenv('QWEN_AGENT_CODE_INTERPRETER_MAX_CPU_SECONDS',
+                                                              0))  # The CPU time limit per kernel, 0 = no limit
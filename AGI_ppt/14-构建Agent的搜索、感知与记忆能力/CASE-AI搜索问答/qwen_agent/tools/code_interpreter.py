@@ -29,12 +29,16 @@ import sys
 import threading
 import time
 import uuid
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from typing import Callable, Dict, Iterator, List, Literal, Optional, Set, Tuple, Union
 
 import json5
 
 from qwen_agent.log import logger
+from qwen_agent.settings import (DEFAULT_CODE_INTERPRETER_IDLE_TIMEOUT, DEFAULT_CODE_INTERPRETER_KERNEL_RECYCLE,
+                                 DEFAULT_CODE_INTERPRETER_MAX_CPU_SECONDS, DEFAULT_CODE_INTERPRETER_MAX_MEMORY_MB,
+                                 DEFAULT_CODE_INTERPRETER_POOL_SIZE)
 from qwen_agent.tools.base import BaseToolWithFileAccess, register_tool
 from qwen_agent.utils.utils import append_signal_handler, extract_code, has_chinese_chars, print_traceback
 
@@ -46,20 +50,26 @@ app.launch_new_instance()
 INIT_CODE_FILE = str(Path(__file__).absolute().parent / 'resource' / 'code_interpreter_init_kernel.py')
 ALIB_FONT_FILE = str(Path(__file__).absolute().parent / 'resource' / 'AlibabaPuHuiTi-3-45-Light.ttf')
 
-_KERNEL_CLIENTS: dict = {}
-_MISC_SUBPROCESSES: Dict[str, subprocess.Popen] = {}
+KERNEL_POLL_INTERVAL = 1  # Seconds between the liveness checks of a kernel while waiting for its output
+KERNEL_DIED_MSG = ('The code interpreter kernel exited unexpectedly, possibly because it exceeded the memory or CPU '
+                   'limit. The variables defined before are lost.')
+
+_KERNEL_POOLS: Dict[Tuple[str, int], 'KernelPool'] = {}  # (work_dir, pid) -> pool
+_KERNEL_POOLS_LOCK = threading.Lock()
+_MISC_SUBPROCESSES: Dict[str, subprocess.Popen] = {}  # kernel_id -> process, including the kernels still starting
 
 
 def _kill_kernels_and_subprocesses(_sig_num=None, _frame=None):
-    for v in _KERNEL_CLIENTS.values():
-        v.shutdown()
-    for k in list(_KERNEL_CLIENTS.keys()):
-        del _KERNEL_CLIENTS[k]
+    # A forked child inherits the kernels of its parent, which are not its to kill
+    for (work_dir, pid), pool in list(_KERNEL_POOLS.items()):
+        if pid == os.getpid():
+            pool.shutdown()
+            del _KERNEL_POOLS[(work_dir, pid)]
 
-    for v in _MISC_SUBPROCESSES.values():
-        v.terminate()
-    for k in list(_MISC_SUBPROCESSES.keys()):
-        del _MISC_SUBPROCESSES[k]
+    for k, v in list(_MISC_SUBPROCESSES.items()):
+        if k.startswith(f'{os.getpid()}_'):
+            v.terminate()
+            _MISC_SUBPROCESSES.pop(k, None)
 
 
 # Make sure all subprocesses are terminated even if killed abnormally:
@@ -71,6 +81,289 @@ if threading.current_thread() is threading.main_thread():
     append_signal_handler(signal.SIGINT, _kill_kernels_and_subprocesses)
 
 
+class Kernel:
+    """A jupyter kernel subprocess and its client"""
+
+    def __init__(self, kernel_id: str, client, process: subprocess.Popen, files: List[str]):
+        self.kernel_id = kernel_id
+        self.client = client
+        self.process = process
+        self.files = files  # The connection file and the launch script
+        self.last_used = time.monotonic()
+        self.busy = False
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def shutdown(self, wait: bool = True):
+        if self.client is not None:
+            try:
+                if self.is_alive():
+                    self.client.shutdown()
+                self.client.stop_channels()
+            except Exception:
+                pass
+        self.process.terminate()
+        if wait:
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        _MISC_SUBPROCESSES.pop(self.kernel_id, None)
+        for f in self.files:
+            if os.path.exists(f):
+                os.remove(f)
+
+
+class KernelPool:
+    """The warm kernels of a work_dir in this process, with the init code already executed
+
+    A session (a CodeInterpreter instance) checks out a kernel on its first call and keeps it until it is released,
+    or until it has not been used for `idle_timeout` seconds. The returned kernels are restarted in the background,
+    or reset if `recycle` is 'reset', which is faster but keeps the modules imported by the session, and the pool
+    is refilled to `size` kernels.
+    """
+
+    def __init__(self,
+                 work_dir: str,
+                 size: int = DEFAULT_CODE_INTERPRETER_POOL_SIZE,
+                 idle_timeout: float = DEFAULT_CODE_INTERPRETER_IDLE_TIMEOUT,
+                 recycle: Literal['restart', 'reset'] = DEFAULT_CODE_INTERPRETER_KERNEL_RECYCLE,
+                 max_memory_mb: int = DEFAULT_CODE_INTERPRETER_MAX_MEMORY_MB,
+                 max_cpu_seconds: int = DEFAULT_CODE_INTERPRETER_MAX_CPU_SECONDS):
+        if recycle not in ('restart', 'reset'):
+            raise ValueError(f'Unknown kernel recycle policy: {recycle}')
+        self.work_dir = work_dir
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.recycle = recycle
+        self.max_memory_mb = max_memory_mb
+        self.max_cpu_seconds = max_cpu_seconds
+
+        self._idle: List[Kernel] = []
+        self._sessions: Dict[str, Kernel] = {}
+        self._checking_out: Set[str] = set()  # The sessions whose first call is checking out a kernel
+        self._starting = 0
+        self._waiting = 0
+        self._closed = False
+        # Reentrant, since the kernels are shut down by the signal handlers on the main thread
+        self._cond = threading.Condition(threading.RLock())
+        self._stats = {
+            'checkouts': 0,
+            'cold_starts': 0,
+            'checkout_wait_total': 0.0,
+            'checkout_wait_max': 0.0,
+            'recycled': 0,
+            'reclaimed': 0,
+            'dead': 0,
+            'start_failures': 0,
+        }
+
+        self._refill()
+        if idle_timeout > 0:
+            threading.Thread(target=self._reclaim_idle_sessions, daemon=True, name='kernel_pool_reclaim').start()
+
+    @contextmanager
+    def use(self, session_id: str) -> Iterator[Kernel]:
+        """The kernel of the session, checked out from the pool on the first call of the session"""
+        with self._cond:
+            # The concurrent calls of a session wait for the one checking out, instead of checking out another kernel
+            while session_id in self._checking_out:
+                self._cond.wait()
+            kernel = self._sessions.get(session_id)
+            if kernel is not None and not kernel.is_alive():
+                # Killed by the memory or CPU limit, the session continues on a new kernel
+                del self._sessions[session_id]
+                self._stats['dead'] += 1
+                self._discard(kernel)
+                kernel = None
+            if kernel is not None:
+                kernel.busy = True
+            else:
+                self._checking_out.add(session_id)
+        if kernel is None:
+            new_kernel = None
+            try:
+                new_kernel = self._checkout()
+            finally:
+                with self._cond:
+                    self._checking_out.discard(session_id)
+                    if new_kernel is not None:
+                        kernel = self._sessions.setdefault(session_id, new_kernel)
+                        kernel.busy = True
+                    self._cond.notify_all()
+            if kernel is not new_kernel:
+                # The session got a kernel meanwhile, which keeps its state, so the new one goes back to the pool
+                self._recycle(new_kernel)
+        try:
+            yield kernel
+        finally:
+            with self._cond:
+                kernel.busy = False
+                kernel.last_used = time.monotonic()
+
+    def release(self, session_id: str):
+        """Return the kernel of the session to be recycled"""
+        with self._cond:
+            kernel = self._sessions.pop(session_id, None)
+        if kernel is not None:
+            self._recycle(kernel)
+
+    def metrics(self) -> Dict[str, Union[int, float]]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats['checkout_wait_avg'] = stats['checkout_wait_total'] / max(1, stats['checkouts'])
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'starting': self._starting,
+                'in_use': len(self._sessions),
+                **stats,
+            }
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            kernels = self._idle + list(self._sessions.values())
+            self._idle, self._sessions = [], {}
+            self._cond.notify_all()
+        for kernel in kernels:
+            kernel.shutdown(wait=False)
+
+    def _checkout(self) -> Kernel:
+        time1 = time.monotonic()
+        kernel = None
+        with self._cond:
+            self._waiting += 1
+            try:
+                while kernel is None:
+                    while self._idle and kernel is None:
+                        kernel = self._idle.pop(0)
+                        if not kernel.is_alive():
+                            self._stats['dead'] += 1
+                            self._discard(kernel)
+                            kernel = None
+                    # Wait for a kernel that is warming up, unless it is promised to another session
+                    if kernel is None and (self._closed or self._starting < self._waiting):
+                        break
+                    if kernel is None:
+                        self._cond.wait()
+            finally:
+                self._waiting -= 1
+        cold = kernel is None
+        if cold:
+            kernel = self._start_kernel()
+        self._refill()
+
+        wait = time.monotonic() - time1
+        with self._cond:
+            self._stats['checkouts'] += 1
+            self._stats['cold_starts'] += cold
+            self._stats['checkout_wait_total'] += wait
+            self._stats['checkout_wait_max'] = max(self._stats['checkout_wait_max'], wait)
+        logger.info(f'Checked out a {"cold" if cold else "warm"} kernel in {wait:.2f} seconds.')
+        return kernel
+
+    def _start_kernel(self) -> Kernel:
+        kernel_id = f'{os.getpid()}_{uuid.uuid4().hex}'
+        return _start_kernel(self.work_dir,
+                             kernel_id,
+                             max_memory_mb=self.max_memory_mb,
+                             max_cpu_seconds=self.max_cpu_seconds)
+
+    def _refill(self):
+        with self._cond:
+            if self._closed:
+                return
+            missing = max(0, self.size - len(self._idle) - self._starting)
+            self._starting += missing
+        for _ in range(missing):
+            self._run_in_background(self._warm_up)
+
+    def _warm_up(self, kernel: Optional[Kernel] = None):
+        """Start a kernel, or reset a returned one, and put it into the pool"""
+        try:
+            if kernel is None:
+                kernel = self._start_kernel()
+            else:
+                _execute_code(kernel, '%reset -f\n' + f'import os\nos.chdir({os.path.abspath(self.work_dir)!r})\n' +
+                              _get_init_code())
+                if not kernel.is_alive():
+                    raise RuntimeError(f'Kernel {kernel.kernel_id} died while being reset')
+        except Exception:
+            print_traceback()
+            if kernel is not None:
+                kernel.shutdown()
+            kernel = None
+        with self._cond:
+            self._starting -= 1
+            if kernel is None:
+                self._stats['start_failures'] += 1
+            elif not self._closed:
+                self._idle.append(kernel)
+                kernel = None
+            self._cond.notify_all()
+        if kernel is not None:
+            kernel.shutdown()
+
+    def _recycle(self, kernel: Kernel):
+        with self._cond:
+            self._stats['recycled'] += 1
+            reset = (self.recycle == 'reset' and kernel.is_alive() and not self._closed and
+                     len(self._idle) + self._starting < self.size)
+            if reset:
+                self._starting += 1
+        if reset:
+            self._run_in_background(self._warm_up, kernel)
+        else:
+            self._discard(kernel)
+            self._refill()
+
+    def _discard(self, kernel: Kernel):
+        if not self._run_in_background(kernel.shutdown):
+            kernel.shutdown(wait=False)
+
+    def _reclaim_idle_sessions(self):
+        while True:
+            time.sleep(min(self.idle_timeout / 2, 60))
+            with self._cond:
+                if self._closed:
+                    return
+                now = time.monotonic()
+                expired = [
+                    session_id for session_id, kernel in self._sessions.items()
+                    if not kernel.busy and now - kernel.last_used > self.idle_timeout
+                ]
+                kernels = [self._sessions.pop(session_id) for session_id in expired]
+                self._stats['reclaimed'] += len(kernels)
+            for session_id, kernel in zip(expired, kernels):
+                logger.warning(f'Reclaimed the kernel of code interpreter session {session_id}, '
+                               f'which was not used for {self.idle_timeout} seconds.')
+                self._recycle(kernel)
+
+    @staticmethod
+    def _run_in_background(fn: Callable, *args) -> bool:
+        try:
+            threading.Thread(target=fn, args=args, daemon=True, name='kernel_pool').start()
+            return True
+        except RuntimeError:  # can't create new thread at interpreter shutdown
+            return False
+
+
+def get_kernel_pool(work_dir: str, **kwargs) -> KernelPool:
+    """The kernel pool of the work_dir in this process, configured by the first caller"""
+    key = (os.path.abspath(work_dir), os.getpid())
+    with _KERNEL_POOLS_LOCK:
+        if key not in _KERNEL_POOLS:
+            _KERNEL_POOLS[key] = KernelPool(work_dir, **kwargs)
+        return _KERNEL_POOLS[key]
+
+
+def get_kernel_pool_metrics() -> Dict[str, Dict[str, Union[int, float]]]:
+    """The metrics of the kernel pools in this process, by work_dir"""
+    return {work_dir: pool.metrics() for (work_dir, pid), pool in list(_KERNEL_POOLS.items()) if pid == os.getpid()}
+
+
 @register_tool('code_interpreter')
 class CodeInterpreter(BaseToolWithFileAccess):
     description = 'Python code sandbox, which can be used to execute Python code.'
@@ -91,6 +384,18 @@ class CodeInterpreter(BaseToolWithFileAccess):
         self.work_dir: str = self.cfg.get('work_dir', self.work_dir)
         self.instance_id: str = str(uuid.uuid4())
         _check_deps_for_code_interpreter()
+        self._get_kernel_pool()  # Start warming up the kernels before the first call
+
+    def _get_kernel_pool(self) -> KernelPool:
+        # Looked up on each call, since a forked process can not use the kernels of its parent
+        return get_kernel_pool(
+            self.work_dir,
+            size=self.cfg.get('kernel_pool_size', DEFAULT_CODE_INTERPRETER_POOL_SIZE),
+            idle_timeout=self.cfg.get('kernel_idle_timeout', DEFAULT_CODE_INTERPRETER_IDLE_TIMEOUT),
+            recycle=self.cfg.get('kernel_recycle', DEFAULT_CODE_INTERPRETER_KERNEL_RECYCLE),
+            max_memory_mb=self.cfg.get('kernel_max_memory_mb', DEFAULT_CODE_INTERPRETER_MAX_MEMORY_MB),
+            max_cpu_seconds=self.cfg.get('kernel_max_cpu_seconds', DEFAULT_CODE_INTERPRETER_MAX_CPU_SECONDS),
+        )
 
     @property
     def args_format(self) -> str:
@@ -114,21 +419,6 @@ class CodeInterpreter(BaseToolWithFileAccess):
         if not code.strip():
             return ''
 
-        kernel_id: str = f'{self.instance_id}_{os.getpid()}'
-        if kernel_id in _KERNEL_CLIENTS:
-            kc = _KERNEL_CLIENTS[kernel_id]
-        else:
-            _fix_matplotlib_cjk_font_issue()
-            self._fix_secure_write_for_code_interpreter()
-            kc, subproc = self._start_kernel(kernel_id)
-            with open(INIT_CODE_FILE) as fin:
-                start_code = fin.read()
-                start_code = start_code.replace('{{M6_FONT_PATH}}', repr(ALIB_FONT_FILE)[1:-1])
-                start_code += '\n%xmode Minimal'
-            logger.info(self._execute_code(kc, start_code))
-            _KERNEL_CLIENTS[kernel_id] = kc
-            _MISC_SUBPROCESSES[kernel_id] = subproc
-
         if timeout:
             code = f'_M6CountdownTimer.start({timeout})\n{code}'
 
@@ -139,64 +429,120 @@ class CodeInterpreter(BaseToolWithFileAccess):
                 fixed_code.append('plt.rcParams["font.family"] = _m6_font_prop.get_name()')
         fixed_code = '\n'.join(fixed_code)
         fixed_code += '\n\n'  # Prevent code not executing in notebook due to no line breaks at the end
-        result = self._execute_code(kc, fixed_code)
 
-        if timeout:
-            self._execute_code(kc, '_M6CountdownTimer.cancel()')
+        with self._get_kernel_pool().use(self.instance_id) as kernel:
+            result = self._execute_code(kernel, fixed_code)
+            if timeout:
+                self._execute_code(kernel, '_M6CountdownTimer.cancel()')
 
         return result if result.strip() else 'Finished execution.'
 
     def __del__(self):
-        # Recycle the jupyter subprocess:
-        k: str = f'{self.instance_id}_{os.getpid()}'
-        if k in _KERNEL_CLIENTS:
-            _KERNEL_CLIENTS[k].shutdown()
-            del _KERNEL_CLIENTS[k]
-        if k in _MISC_SUBPROCESSES:
-            _MISC_SUBPROCESSES[k].terminate()
-            del _MISC_SUBPROCESSES[k]
-
-    def _fix_secure_write_for_code_interpreter(self):
-        if 'linux' in sys.platform.lower():
-            os.makedirs(self.work_dir, exist_ok=True)
-            fname = os.path.join(self.work_dir, f'test_file_permission_{os.getpid()}.txt')
-            if os.path.exists(fname):
-                os.remove(fname)
-            with os.fdopen(os.open(fname, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o0600), 'w') as f:
-                f.write('test')
-            file_mode = stat.S_IMODE(os.stat(fname).st_mode) & 0o6677
-            if file_mode != 0o0600:
-                os.environ['JUPYTER_ALLOW_INSECURE_WRITES'] = '1'
-            if os.path.exists(fname):
-                os.remove(fname)
-
-    def _start_kernel(self, kernel_id: str):
-        connection_file = os.path.join(self.work_dir, f'kernel_connection_file_{kernel_id}.json')
-        launch_kernel_script = os.path.join(self.work_dir, f'launch_kernel_{kernel_id}.py')
-        for f in [connection_file, launch_kernel_script]:
-            if os.path.exists(f):
-                logger.info(f'WARNING: {f} already exists')
-                os.remove(f)
+        # Return the jupyter subprocess to the pool to be recycled:
+        pool = _KERNEL_POOLS.get((os.path.abspath(self.work_dir), os.getpid()))
+        if pool is not None:
+            pool.release(self.instance_id)
 
-        os.makedirs(self.work_dir, exist_ok=True)
-        with open(launch_kernel_script, 'w') as fout:
-            fout.write(LAUNCH_KERNEL_PY)
-
-        kernel_process = subprocess.Popen(
-            [
-                sys.executable,
-                os.path.abspath(launch_kernel_script),
-                '--IPKernelApp.connection_file',
-                os.path.abspath(connection_file),
-                '--matplotlib=inline',
-                '--quiet',
-            ],
-            cwd=os.path.abspath(self.work_dir),
-        )
-        logger.info(f"INFO: kernel process's PID = {kernel_process.pid}")
+    def _execute_code(self, kernel: Kernel, code: str) -> str:
+        return _execute_code(kernel, code, serve_image=self._serve_image)
+
+    def _serve_image(self, image_base64: str) -> str:
+        import PIL.Image
+
+        image_file = f'{uuid.uuid4()}.png'
+        local_image_file = os.path.join(self.work_dir, image_file)
 
+        png_bytes = base64.b64decode(image_base64)
+        assert isinstance(png_bytes, bytes)
+        bytes_io = io.BytesIO(png_bytes)
+        PIL.Image.open(bytes_io).save(local_image_file, 'png')
+
+        image_server_url = os.getenv('M6_CODE_INTERPRETER_STATIC_URL', '')
+        if image_server_url:
+            return f'{image_server_url}/{image_file}'
+        return local_image_file
+
+
+def _get_init_code() -> str:
+    with open(INIT_CODE_FILE) as fin:
+        start_code = fin.read()
+        start_code = start_code.replace('{{M6_FONT_PATH}}', repr(ALIB_FONT_FILE)[1:-1])
+        start_code += '\n%xmode Minimal'
+    return start_code
+
+
+def _fix_secure_write_for_code_interpreter(work_dir: str):
+    if 'linux' in sys.platform.lower():
+        os.makedirs(work_dir, exist_ok=True)
+        fname = os.path.join(work_dir, f'test_file_permission_{os.getpid()}_{threading.get_ident()}.txt')
+        if os.path.exists(fname):
+            os.remove(fname)
+        with os.fdopen(os.open(fname, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o0600), 'w') as f:
+            f.write('test')
+        file_mode = stat.S_IMODE(os.stat(fname).st_mode) & 0o6677
+        if file_mode != 0o0600:
+            os.environ['JUPYTER_ALLOW_INSECURE_WRITES'] = '1'
+        if os.path.exists(fname):
+            os.remove(fname)
+
+
+def _get_resource_limit_code(max_memory_mb: int, max_cpu_seconds: int) -> str:
+    """The code that sets the limits of a kernel subprocess, run by the subprocess itself before the kernel starts
+
+    It is not a preexec_fn, which may deadlock the forked child since the kernels are started from the pool threads.
+    """
+    if not (max_memory_mb or max_cpu_seconds):
+        return ''
+    try:
+        import resource  # noqa
+    except ImportError:  # windows
+        logger.warning('The memory and CPU limits of the code interpreter are not supported on this platform.')
+        return ''
+
+    code = 'import resource\n'
+    if max_memory_mb:
+        limit = max_memory_mb * 1024 * 1024
+        code += f'resource.setrlimit(resource.RLIMIT_AS, ({limit}, {limit}))\n'
+    if max_cpu_seconds:
+        code += f'resource.setrlimit(resource.RLIMIT_CPU, ({max_cpu_seconds}, {max_cpu_seconds}))\n'
+    return code
+
+
+def _start_kernel(work_dir: str, kernel_id: str, max_memory_mb: int = 0, max_cpu_seconds: int = 0) -> Kernel:
+    _fix_matplotlib_cjk_font_issue()
+    _fix_secure_write_for_code_interpreter(work_dir)
+
+    connection_file = os.path.join(work_dir, f'kernel_connection_file_{kernel_id}.json')
+    launch_kernel_script = os.path.join(work_dir, f'launch_kernel_{kernel_id}.py')
+    for f in [connection_file, launch_kernel_script]:
+        if os.path.exists(f):
+            logger.info(f'WARNING: {f} already exists')
+            os.remove(f)
+
+    os.makedirs(work_dir, exist_ok=True)
+    with open(launch_kernel_script, 'w') as fout:
+        fout.write(_get_resource_limit_code(max_memory_mb, max_cpu_seconds) + LAUNCH_KERNEL_PY)
+
+    kernel_process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.abspath(launch_kernel_script),
+            '--IPKernelApp.connection_file',
+            os.path.abspath(connection_file),
+            '--matplotlib=inline',
+            '--quiet',
+        ],
+        cwd=os.path.abspath(work_dir),
+    )
+    _MISC_SUBPROCESSES[kernel_id] = kernel_process
+    logger.info(f"INFO: kernel process's PID = {kernel_process.pid}")
+    kernel = Kernel(kernel_id, None, kernel_process, files=[connection_file, launch_kernel_script])
+
+    try:
         # Wait for kernel connection file to be written
         while True:
+            if not kernel.is_alive():
+                raise RuntimeError(f'The kernel process exited with code {kernel_process.returncode} before it started')
             if not os.path.isfile(connection_file):
                 time.sleep(0.1)
             else:
@@ -216,77 +562,74 @@ class CodeInterpreter(BaseToolWithFileAccess):
         kc.load_connection_file()
         kc.start_channels()
         kc.wait_for_ready()
-        return kc, kernel_process
-
-    def _execute_code(self, kc, code: str) -> str:
-        kc.wait_for_ready()
-        kc.execute(code)
-        result = ''
-        image_idx = 0
-        while True:
-            text = ''
-            image = ''
-            finished = False
-            msg_type = 'error'
-            try:
-                msg = kc.get_iopub_msg()
-                msg_type = msg['msg_type']
-                if msg_type == 'status':
-                    if msg['content'].get('execution_state') == 'idle':
-                        finished = True
-                elif msg_type == 'execute_result':
-                    text = msg['content']['data'].get('text/plain', '')
-                    if 'image/png' in msg['content']['data']:
-                        image_b64 = msg['content']['data']['image/png']
-                        image_url = self._serve_image(image_b64)
-                        image_idx += 1
-                        image = '![fig-%03d](%s)' % (image_idx, image_url)
-                elif msg_type == 'display_data':
-                    if 'image/png' in msg['content']['data']:
+        kernel.client = kc
+
+        logger.info(_execute_code(kernel, _get_init_code()))
+    except BaseException:
+        kernel.shutdown(wait=False)
+        raise
+    return kernel
+
+
+def _execute_code(kernel: Kernel, code: str, serve_image: Optional[Callable[[str], str]] = None) -> str:
+    if not kernel.is_alive():
+        return f'error:\n\n```\n{KERNEL_DIED_MSG}\n```'
+    kc = kernel.client
+    kc.wait_for_ready()
+    kc.execute(code)
+    result = ''
+    image_idx = 0
+    while True:
+        text = ''
+        image = ''
+        finished = False
+        msg_type = 'error'
+        try:
+            msg = kc.get_iopub_msg(timeout=KERNEL_POLL_INTERVAL)
+            msg_type = msg['msg_type']
+            if msg_type == 'status':
+                if msg['content'].get('execution_state') == 'idle':
+                    finished = True
+            elif msg_type == 'execute_result':
+                text = msg['content']['data'].get('text/plain', '')
+                if 'image/png' in msg['content']['data'] and serve_image:
+                    image_b64 = msg['content']['data']['image/png']
+                    image_url = serve_image(image_b64)
+                    image_idx += 1
+                    image = '![fig-%03d](%s)' % (image_idx, image_url)
+            elif msg_type == 'display_data':
+                if 'image/png' in msg['content']['data']:
+                    if serve_image:
                         image_b64 = msg['content']['data']['image/png']
-                        image_url = self._serve_image(image_b64)
+                        image_url = serve_image(image_b64)
                         image_idx += 1
                         image = '![fig-%03d](%s)' % (image_idx, image_url)
-                    else:
-                        text = msg['content']['data'].get('text/plain', '')
-                elif msg_type == 'stream':
-                    msg_type = msg['content']['name']  # stdout, stderr
-                    text = msg['content']['text']
-                elif msg_type == 'error':
-                    text = _escape_ansi('\n'.join(msg['content']['traceback']))
-                    if 'M6_CODE_INTERPRETER_TIMEOUT' in text:
-                        text = 'Timeout: Code execution exceeded the time limit.'
-            except queue.Empty:
-                text = 'Timeout: Code execution exceeded the time limit.'
-                finished = True
-            except Exception:
-                text = 'The code interpreter encountered an unexpected error.'
-                print_traceback()
-                finished = True
-            if text:
-                result += f'\n\n{msg_type}:\n\n```\n{text}\n```'
-            if image:
-                result += f'\n\n{image}'
-            if finished:
-                break
-        result = result.lstrip('\n')
-        return result
-
-    def _serve_image(self, image_base64: str) -> str:
-        import PIL.Image
-
-        image_file = f'{uuid.uuid4()}.png'
-        local_image_file = os.path.join(self.work_dir, image_file)
-
-        png_bytes = base64.b64decode(image_base64)
-        assert isinstance(png_bytes, bytes)
-        bytes_io = io.BytesIO(png_bytes)
-        PIL.Image.open(bytes_io).save(local_image_file, 'png')
-
-        image_server_url = os.getenv('M6_CODE_INTERPRETER_STATIC_URL', '')
-        if image_server_url:
-            return f'{image_server_url}/{image_file}'
-        return local_image_file
+                else:
+                    text = msg['content']['data'].get('text/plain', '')
+            elif msg_type == 'stream':
+                msg_type = msg['content']['name']  # stdout, stderr
+                text = msg['content']['text']
+            elif msg_type == 'error':
+                text = _escape_ansi('\n'.join(msg['content']['traceback']))
+                if 'M6_CODE_INTERPRETER_TIMEOUT' in text:
+                    text = 'Timeout: Code execution exceeded the time limit.'
+        except queue.Empty:
+            if kernel.is_alive():
+                continue
+            text = KERNEL_DIED_MSG
+            finished = True
+        except Exception:
+            text = 'The code interpreter encountered an unexpected error.'
+            print_traceback()
+            finished = True
+        if text:
+            result += f'\n\n{msg_type}:\n\n```\n{text}\n```'
+        if image:
+            result += f'\n\n{image}'
+        if finished:
+            break
+    result = result.lstrip('\n')
+    return result
 
 
 def _check_deps_for_code_interpreter():
@@ -12,20 +12,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import itertools
 import json
 import os
 import re
+import signal
 import time
-from typing import Dict, List, Optional, Union
+from collections.abc import Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Union
 
 from pydantic import BaseModel
 
 from qwen_agent.log import logger
-from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_PAGE_SIZE, DEFAULT_WORKSPACE
+from qwen_agent.settings import (DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_MAX_WORKERS, DEFAULT_PARSER_PAGE_SIZE,
+                                 DEFAULT_PARSER_TIMEOUT, DEFAULT_WORKSPACE)
 from qwen_agent.tools.base import BaseTool, register_tool
 from qwen_agent.tools.simple_doc_parser import PARAGRAPH_SPLIT_SYMBOL, SimpleDocParser, get_plain_doc
 from qwen_agent.tools.storage import KeyNotExistsError, Storage
-from qwen_agent.utils.tokenization_qwen import count_tokens, tokenizer
+from qwen_agent.utils.chunk_store import ChunkStore, ChunkStoreWriter, write_chunk_store
+from qwen_agent.utils.tokenization_qwen import TOKEN_COUNTER_CACHE_TAG, count_tokens, tokenizer
 from qwen_agent.utils.utils import get_basename_from_url, hash_sha256
 
 
@@ -41,6 +47,41 @@ class Chunk(BaseModel):
         return {'content': self.content, 'metadata': self.metadata, 'token': self.token}
 
 
+class LazyChunkList(Sequence):
+    """文档的分块列表，由内存映射的 ChunkStore 支持，只有被访问的块才会被构造为 Chunk"""
+
+    def __init__(self, store: ChunkStore):
+        self.store = store
+        self.url = store.meta['url']
+        self.title = store.meta['title']
+
+    @property
+    def tokens(self):
+        return self.store.tokens
+
+    @property
+    def signature(self) -> str:
+        return self.store.signature
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('chunk index out of range')
+        return Chunk(content=self.store.get_text(index),
+                     metadata={
+                         'source': self.url,
+                         'title': self.title,
+                         'chunk_id': index
+                     },
+                     token=int(self.store.tokens[index]))
+
+
 class Record(BaseModel):
     url: str
     raw: List[Chunk]
@@ -49,6 +90,29 @@ class Record(BaseModel):
     def __init__(self, url: str, raw: List[Chunk], title: str):
         super().__init__(url=url, raw=raw, title=title)
 
+    @classmethod
+    def from_chunk_store(cls, store: ChunkStore) -> 'Record':
+        # 跳过 pydantic 校验，raw 中的块在访问时才被构造
+        chunks = LazyChunkList(store)
+        return cls.model_construct(url=chunks.url, raw=chunks, title=chunks.title)
+
+    def get_total_token(self) -> int:
+        if isinstance(self.raw, LazyChunkList):
+            return int(self.raw.tokens.sum())
+        return sum(chk.token for chk in self.raw)
+
+    def get_chunk_token(self, chunk_id: int) -> int:
+        """第 chunk_id 个块的 token 数，LazyChunkList 不必解码块内容"""
+        if isinstance(self.raw, LazyChunkList):
+            return int(self.raw.tokens[chunk_id])
+        return self.raw[chunk_id].token
+
+    def get_signature(self) -> str:
+        """所有块内容的哈希，用于识别同一 url 被重新解析的文档"""
+        if isinstance(self.raw, LazyChunkList):
+            return self.raw.signature
+        return hash_sha256(''.join(chk.content for chk in self.raw))
+
     def to_dict(self) -> dict:
         return {'url': self.url, 'raw': [x.to_dict() for x in self.raw], 'title': self.title}
 
@@ -74,6 +138,10 @@ class DocParser(BaseTool):
 
         self.data_root = self.cfg.get('path', os.path.join(DEFAULT_WORKSPACE, 'tools', self.name))
         self.db = Storage({'storage_root_path': self.data_root})
+        self.chunk_store_root = os.path.join(self.data_root, 'chunks')
+        self._chunk_stores: Dict[str, ChunkStore] = {}
+        self.parser_max_workers: int = self.cfg.get('parser_max_workers', DEFAULT_PARSER_MAX_WORKERS)
+        self.parser_timeout: int = self.cfg.get('parser_timeout', DEFAULT_PARSER_TIMEOUT)
 
         self.doc_extractor = SimpleDocParser({'structured_doc': True})
 
@@ -97,65 +165,211 @@ class DocParser(BaseTool):
         """
 
         params = self._verify_json_format_args(params)
+        return self.get_record(params['url'], **kwargs).to_dict()
+
+    def get_record(self, url: str, **kwargs) -> Record:
+        """提取和分块文档，返回由内存映射的分块存储支持的 Record
+
+        打开已缓存的文档只需读取文件头，块内容在被访问时才会解码。
+        """
         # 兼容 qwen-agent 版本 <= 0.0.3 的参数传递方式
-        max_ref_token = kwargs.get('max_ref_token', self.max_ref_token)
         parser_page_size = kwargs.get('parser_page_size', self.parser_page_size)
 
-        url = params['url']
-
-        cached_name_chunking = f'{hash_sha256(url)}_{str(parser_page_size)}'
-        try:
-            # 直接加载已分块的文档
-            record = self.db.get(cached_name_chunking)
-            record = json.loads(record)
+        cached_name_chunking = _get_cached_name(url, parser_page_size)
+        record = self._load_cached_record(cached_name_chunking)
+        if record is not None:
             logger.info(f'从缓存中读取 {url} 的分块内容.')
             return record
+
+        self._parse_and_chunk(url, parser_page_size=parser_page_size, cached_name=cached_name_chunking)
+        return self._load_cached_record(cached_name_chunking)
+
+    def get_records(self, urls: List[str], **kwargs) -> List[Union[Record, Exception]]:
+        """并行提取和分块多个文档
+
+        已缓存的文档直接读取，其余文档在进程池中解析，每个文件的解析时间不超过 parser_timeout 秒。
+        只有一个文件或 parser_max_workers <= 1 时在当前进程中解析，与 call 相同，不限制解析时间：
+        线程中的解析无法被打断，超时后它仍会在后台占用 CPU、写入缓存。
+
+        返回:
+            与 urls 顺序一致的列表，解析失败的文件对应其异常，不影响其他文件。
+        """
+        parser_page_size = kwargs.get('parser_page_size', self.parser_page_size)
+        max_workers = kwargs.get('parser_max_workers', self.parser_max_workers)
+        timeout = kwargs.get('parser_timeout', self.parser_timeout)
+
+        cached_names = [_get_cached_name(url, parser_page_size) for url in urls]
+        results = {}
+        for url, cached_name in zip(urls, cached_names):
+            if url not in results:
+                results[url] = self._load_cached_record(cached_name)
+        todo = [url for url, record in results.items() if record is None]
+        if not todo:
+            return [results[url] for url in urls]
+
+        logger.info(f'开始解析 {len(todo)} 个文件 ({len(results) - len(todo)} 个已缓存)...')
+        time1 = time.time()
+        num_pages = 0
+        errors = {}
+        if len(todo) == 1 or max_workers <= 1:
+            for url in todo:
+                try:
+                    num_pages += self._parse_and_chunk(url,
+                                                       parser_page_size=parser_page_size,
+                                                       cached_name=_get_cached_name(url, parser_page_size))
+                except Exception as ex:
+                    errors[url] = ex
+        else:
+            num_pages += self._parse_in_process_pool(todo, parser_page_size, min(max_workers, len(todo)), timeout,
+                                                     errors)
+        for url in todo:
+            if url in errors:
+                logger.error(f'解析 {url} 失败: {errors[url]}')
+                results[url] = errors[url]
+            else:
+                results[url] = self._load_cached_record(_get_cached_name(url, parser_page_size))
+
+        time_spent = max(time.time() - time1, 1e-6)
+        num_files = len(todo) - len(errors)
+        logger.info(f'完成 {num_files}/{len(todo)} 个文件的解析. 耗时: {time_spent:.2f} 秒, '
+                    f'{num_files / time_spent:.2f} files/s, {num_pages / time_spent:.2f} pages/s.')
+        return [results[url] for url in urls]
+
+    def _parse_in_process_pool(self, todo: List[str], parser_page_size: int, max_workers: int, timeout: int,
+                               errors: Dict[str, Exception]) -> int:
+        """在进程池中解析 todo 中的文件，失败的文件记录在 errors 中，返回总页数
+
+        同时只提交 max_workers 个文件，所以每个文件的计时从提交时开始。子进程中的 SIGALRM 通常先到时；
+        若子进程卡在 C 代码中或不支持 SIGALRM（Windows），到时后记为 TimeoutError，
+        杀掉进程池并把其他正在解析的文件提交到新的进程池。
+        """
+        # 解析是 CPU 密集型的，使用多进程；子进程直接写入分块存储，只返回页数
+        num_pages = 0
+        queue = list(todo)
+        pending: Dict[Future, tuple] = {}  # future -> (url, deadline)
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        try:
+            while queue or pending:
+                while queue and len(pending) < max_workers:
+                    url = queue.pop(0)
+                    deadline = time.time() + timeout + PARSER_TIMEOUT_GRACE if timeout else None
+                    future = executor.submit(_parse_in_subprocess, self.cfg, url, parser_page_size, timeout)
+                    pending[future] = (url, deadline)
+
+                deadlines = [deadline for _, deadline in pending.values() if deadline is not None]
+                wait_timeout = max(0.0, min(deadlines) - time.time()) if deadlines else None
+                done, _ = wait(list(pending), timeout=wait_timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, _ = pending.pop(future)
+                    try:
+                        num_pages += future.result()
+                    except Exception as ex:
+                        errors[url] = ex
+
+                now = time.time()
+                expired = [f for f, (_, deadline) in pending.items() if deadline is not None and now >= deadline]
+                if expired:
+                    for future in expired:
+                        url, _ = pending.pop(future)
+                        errors[url] = TimeoutError(f'解析 {url} 超过 {timeout} 秒')
+                    # 卡住的子进程无法被打断，放弃整个进程池，其余正在解析的文件重新提交
+                    queue = [url for url, _ in pending.values()] + queue
+                    pending = {}
+                    _kill_process_pool(executor)
+                    executor = ProcessPoolExecutor(max_workers=max_workers)
+        finally:
+            executor.shutdown(wait=not pending, cancel_futures=True)
+        return num_pages
+
+    def _load_cached_record(self, cached_name: str) -> Optional[Record]:
+        store = self._open_chunk_store(cached_name)
+        if store is not None:
+            return Record.from_chunk_store(store)
+        try:
+            # 迁移旧版本保存的 JSON 缓存
+            record = Record(**json.loads(self.db.get(cached_name)))
         except KeyNotExistsError:
-            doc = self.doc_extractor.call({'url': url})
+            return None
+        self._save_record(cached_name, record)
+        return Record.from_chunk_store(self._open_chunk_store(cached_name))
+
+    def _save_record(self, cached_name: str, record: Record):
+        write_chunk_store(self._get_chunk_store_path(cached_name),
+                          meta={
+                              'url': record.url,
+                              'title': record.title
+                          },
+                          contents=[chk.content for chk in record.raw],
+                          tokens=[chk.token for chk in record.raw])
+
+    def _parse_and_chunk(self, url: str, parser_page_size: int, cached_name: str) -> int:
+        """解析并分块文档，将块逐个写入分块存储，返回页数
+
+        页面是逐页解析和分块的，内存占用与文档大小无关。
+        """
+        num_pages = 0
 
-        total_token = 0
-        for page in doc:
-            for para in page['content']:
-                total_token += para['token']
+        def _count_pages(pages):
+            nonlocal num_pages
+            for page in pages:
+                num_pages += 1
+                yield page
+
+        pages = _count_pages(self.doc_extractor.iter_pages(url))
 
-        if doc and 'title' in doc[0]:
-            title = doc[0]['title']
+        # 只预读足够判断是否需要分块的页面
+        head = []
+        total_token = 0
+        for page in pages:
+            head.append(page)
+            total_token += sum(para['token'] for para in page['content'])
+            if total_token > 10:
+                break
+
+        if head and 'title' in head[0]:
+            title = head[0]['title']
         else:
             title = get_basename_from_url(url)
 
         logger.info(f'开始对 {url} ({title}) 进行分块...')
         time1 = time.time()
-        # if total_token <= max_ref_token: # 原来的
-        if total_token <= 10:
-            # 整个文档作为一个块
-            content = [
-                Chunk(content=get_plain_doc(doc),
-                      metadata={
-                          'source': url,
-                          'title': title,
-                          'chunk_id': 0
-                      },
-                      token=total_token)
-            ]
-            cached_name_chunking = f'{hash_sha256(url)}_without_chunking'
-        else:
-            content = self.split_doc_to_chunk(doc, url, title=title, parser_page_size=parser_page_size)
+        with ChunkStoreWriter(self._get_chunk_store_path(cached_name), meta={'url': url, 'title': title}) as writer:
+            # if total_token <= max_ref_token: # 原来的
+            if total_token <= 10:
+                # 整个文档作为一个块
+                writer.add(get_plain_doc(head), total_token)
+            else:
+                for chk in self.split_doc_to_chunk(itertools.chain(head, pages),
+                                                   url,
+                                                   title=title,
+                                                   parser_page_size=parser_page_size):
+                    writer.add(chk.content, chk.token)
 
         time2 = time.time()
         logger.info(f'完成对 {url} ({title}) 的分块. 耗时: {time2 - time1} 秒.')
-
-        # 保存文档数据
-        new_record = Record(url=url, raw=content, title=title).to_dict()
-        new_record_str = json.dumps(new_record, ensure_ascii=False)
-        self.db.put(cached_name_chunking, new_record_str)
-        return new_record
-
-    def split_doc_to_chunk(self,
-                           doc: List[dict],
+        return num_pages
+
+    def _get_chunk_store_path(self, cached_name: str) -> str:
+        return os.path.join(self.chunk_store_root, f'{cached_name}.chunks')
+
+    def _open_chunk_store(self, cached_name: str) -> Optional[ChunkStore]:
+        store = self._chunk_stores.get(cached_name)
+        if store is None:
+            path = self._get_chunk_store_path(cached_name)
+            if not os.path.exists(path):
+                return None
+            store = ChunkStore(path)
+            self._chunk_stores[cached_name] = store
+        return store
+
+    @classmethod
+    def split_doc_to_chunk(cls,
+                           doc: Iterable[dict],
                            path: str,
                            title: str = '',
-                           parser_page_size: int = DEFAULT_PARSER_PAGE_SIZE) -> List[Chunk]:
-        res = []
+                           parser_page_size: int = DEFAULT_PARSER_PAGE_SIZE) -> Iterator[Chunk]:
+        """逐页消费文档，每当一个块完成时就产出该块，不依赖解析器的实例状态"""
+        num_chunks = 0
         chunk = []
         available_token = parser_page_size
         has_para = False
@@ -181,18 +395,18 @@ class DocParser(BaseTool):
                         # 记录一个块
                         if isinstance(chunk[-1], str) and re.fullmatch(r'^\[page: \d+\]$', chunk[-1]) is not None:
                             chunk.pop()  # 冗余的页面信息
-                        res.append(
-                            Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join(
-                                [x if isinstance(x, str) else x[0] for x in chunk]),
-                                  metadata={
-                                      'source': path,
-                                      'title': title,
-                                      'chunk_id': len(res)
-                                  },
-                                  token=parser_page_size - available_token))
+                        yield Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join(
+                            [x if isinstance(x, str) else x[0] for x in chunk]),
+                                    metadata={
+                                        'source': path,
+                                        'title': title,
+                                        'chunk_id': num_chunks
+                                    },
+                                    token=parser_page_size - available_token)
+                        num_chunks += 1
 
                         # 定义新块
-                        overlap_txt = self._get_last_part(chunk)
+                        overlap_txt = cls._get_last_part(chunk)
                         if overlap_txt.strip():
                             chunk = [f'[page: {str(chunk[-1][1])}]', overlap_txt]
                             has_para = False
@@ -207,14 +421,17 @@ class DocParser(BaseTool):
                         _sentences = re.split(r'\. |。', txt)
                         sentences = []
                         for s in _sentences:
-                            token = count_tokens(s)
-                            if not s.strip() or token == 0:
+                            if not s.strip():
+                                continue
+                            # 只分词一次，既用于计数也用于截断
+                            token_list = tokenizer.tokenize(s)
+                            token = len(token_list)
+                            if token == 0:
                                 continue
                             if token <= available_token:
                                 sentences.append([s, token])
                             else:
                                 # 限制句子长度为块大小
-                                token_list = tokenizer.tokenize(s)
                                 for si in range(0, len(token_list), available_token):
                                     ss = tokenizer.convert_tokens_to_string(
                                         token_list[si:min(len(token_list), si + available_token)])
@@ -238,17 +455,17 @@ class DocParser(BaseTool):
                                 if isinstance(chunk[-1], str) and re.fullmatch(r'^\[page: \d+\]$',
                                                                                chunk[-1]) is not None:
                                     chunk.pop()  # 冗余的页面信息
-                                res.append(
-                                    Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join(
-                                        [x if isinstance(x, str) else x[0] for x in chunk]),
-                                          metadata={
-                                              'source': path,
-                                              'title': title,
-                                              'chunk_id': len(res)
-                                          },
-                                          token=parser_page_size - available_token))
-
-                                overlap_txt = self._get_last_part(chunk)
+                                yield Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join(
+                                    [x if isinstance(x, str) else x[0] for x in chunk]),
+                                            metadata={
+                                                'source': path,
+                                                'title': title,
+                                                'chunk_id': num_chunks
+                                            },
+                                            token=parser_page_size - available_token)
+                                num_chunks += 1
+
+                                overlap_txt = cls._get_last_part(chunk)
                                 if overlap_txt.strip():
                                     chunk = [f'[page: {str(chunk[-1][1])}]', overlap_txt]
                                     has_para = False
@@ -262,18 +479,16 @@ class DocParser(BaseTool):
         if has_para:
             if isinstance(chunk[-1], str) and re.fullmatch(r'^\[page: \d+\]$', chunk[-1]) is not None:
                 chunk.pop()  # 冗余的页面信息
-            res.append(
-                Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join([x if isinstance(x, str) else x[0] for x in chunk]),
-                      metadata={
-                          'source': path,
-                          'title': title,
-                          'chunk_id': len(res)
-                      },
-                      token=parser_page_size - available_token))
-
-        return res
-
-    def _get_last_part(self, chunk: list) -> str:
+            yield Chunk(content=PARAGRAPH_SPLIT_SYMBOL.join([x if isinstance(x, str) else x[0] for x in chunk]),
+                        metadata={
+                            'source': path,
+                            'title': title,
+                            'chunk_id': num_chunks
+                        },
+                        token=parser_page_size - available_token)
+
+    @staticmethod
+    def _get_last_part(chunk: list) -> str:
         overlap = ''
         need_page = chunk[-1][1]  # 只需要此页面来前置
         available_len = 150
@@ -307,4 +522,39 @@ class DocParser(BaseTool):
                     available_len -= len(sent)
                 else:
                     return overlap
-        return overlap
\ No newline at end of file
+        return overlap
+
+
+def _get_cached_name(url: str, parser_page_size: int) -> str:
+    """分块缓存的名称，块的 token 数与 DEFAULT_TOKEN_COUNTER 有关，切换后重新分块"""
+    return f'{hash_sha256(url)}_{str(parser_page_size)}{TOKEN_COUNTER_CACHE_TAG}'
+
+
+PARSER_TIMEOUT_GRACE = 5  # 主进程比子进程的 SIGALRM 多等的秒数
+
+
+def _kill_process_pool(executor: ProcessPoolExecutor):
+    for process in list((executor._processes or {}).values()):
+        process.kill()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _parse_in_subprocess(cfg: dict, url: str, parser_page_size: int, timeout: int) -> int:
+    """在子进程中解析并分块一个文件，写入分块存储，返回页数"""
+
+    def _on_timeout(signum, frame):
+        raise TimeoutError(f'解析 {url} 超过 {timeout} 秒')
+
+    # 子进程的主线程中可以用 SIGALRM 打断卡住的解析（Windows 不支持）
+    use_alarm = bool(timeout) and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_timeout)
+        signal.alarm(timeout)
+    try:
+        parser = DocParser(cfg)
+        return parser._parse_and_chunk(url,
+                                       parser_page_size=parser_page_size,
+                                       cached_name=_get_cached_name(url, parser_page_size))
+    finally:
+        if use_alarm:
+            signal.alarm(0)
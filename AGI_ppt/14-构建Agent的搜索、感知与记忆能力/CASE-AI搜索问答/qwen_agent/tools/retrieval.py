@@ -18,7 +18,7 @@ import json5
 
 from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_PAGE_SIZE, DEFAULT_RAG_SEARCHERS
 from qwen_agent.tools.base import TOOL_REGISTRY, BaseTool, register_tool
-from qwen_agent.tools.doc_parser import DocParser, Record
+from qwen_agent.tools.doc_parser import DocParser
 from qwen_agent.tools.simple_doc_parser import PARSER_SUPPORTED_FILE_TYPES
 
 
@@ -28,7 +28,7 @@ def _check_deps_for_rag():
         import jieba  # noqa
         import pdfminer  # noqa
         import pdfplumber  # noqa
-        import rank_bm25  # noqa
+        import scipy  # noqa
         import snowballstemmer  # noqa
         from bs4 import BeautifulSoup  # noqa
         from docx import Document  # noqa
@@ -70,11 +70,12 @@ class Retrieval(BaseTool):
         self.doc_parse = DocParser({'max_ref_token': self.max_ref_token, 'parser_page_size': self.parser_page_size})
 
         self.rag_searchers = self.cfg.get('rag_searchers', DEFAULT_RAG_SEARCHERS)
+        search_cfg = {'max_ref_token': self.max_ref_token, 'parser_page_size': self.parser_page_size}
         if len(self.rag_searchers) == 1:
-            self.search = TOOL_REGISTRY[self.rag_searchers[0]]({'max_ref_token': self.max_ref_token})
+            self.search = TOOL_REGISTRY[self.rag_searchers[0]](search_cfg)
         else:
             from qwen_agent.tools.search_tools.hybrid_search import HybridSearch
-            self.search = HybridSearch({'max_ref_token': self.max_ref_token, 'rag_searchers': self.rag_searchers})
+            self.search = HybridSearch({**search_cfg, 'rag_searchers': self.rag_searchers})
 
     def call(self, params: Union[str, dict], **kwargs) -> list:
         """RAG tool.
@@ -95,13 +96,18 @@ class Retrieval(BaseTool):
         files = params.get('files', [])
         if isinstance(files, str):
             files = json5.loads(files)
-        records = []
-        for file in files:
-            _record = self.doc_parse.call(params={'url': file}, **kwargs)
-            records.append(_record)
+        # The files are parsed in parallel, and the chunks are memory-mapped so only the retrieved ones are loaded
+        records, errors = [], []
+        for rec in self.doc_parse.get_records(files, **kwargs):
+            if isinstance(rec, Exception):
+                errors.append(rec)
+            else:
+                records.append(rec)
+        if errors and not records:
+            raise errors[0]
 
         query = params.get('query', '')
         if records:
-            return self.search.call(params={'query': query}, docs=[Record(**rec) for rec in records], **kwargs)
+            return self.search.call(params={'query': query}, docs=records, **kwargs)
         else:
             return []
@@ -12,16 +12,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
+import re
 from abc import abstractmethod
-from typing import Dict, List, Optional, Tuple, Union
+from collections.abc import Sequence
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 
+import numpy as np
 from pydantic import BaseModel
 
 from qwen_agent.log import logger
 from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN
 from qwen_agent.tools.base import BaseTool
 from qwen_agent.tools.doc_parser import DocParser, Record
-from qwen_agent.utils.tokenization_qwen import count_tokens, tokenizer
+from qwen_agent.tools.simple_doc_parser import PARAGRAPH_SPLIT_SYMBOL
+from qwen_agent.utils.tokenization_qwen import count_tokens, refine_token_count, tokenizer
+
+# DocParser repeats at most this many characters of a chunk at the start of the next one
+MAX_CHUNK_OVERLAP = 400
+SENTENCE_END = '。. '
 
 
 class RefMaterialOutput(BaseModel):
@@ -36,6 +45,66 @@ class RefMaterialOutput(BaseModel):
         }
 
 
+class RankedChunks(Sequence):
+    """All chunks of the docs as (the doc url, the chunk id, the score) tuples sorted by relevance
+
+    The ranking is materialized from the top on demand, in blocks that double in size, so that a consumer
+    such as `get_topk` that stops once the reference window is full only pays for the head it reads.
+    It is a drop-in replacement for the fully sorted list returned by `sort_by_scores`.
+    """
+
+    MIN_BLOCK = 64
+
+    def __init__(self, docs: List[Record], top_n: Callable[[int], Tuple[np.ndarray, np.ndarray]]):
+        """
+        Args:
+            docs: The doc list, the chunks are numbered by concatenating them in this order.
+            top_n: Returns the positions and the scores of the n most relevant chunks, the most relevant first.
+        """
+        self._urls = [doc.url for doc in docs]
+        self._offsets = [0]
+        for doc in docs:
+            self._offsets.append(self._offsets[-1] + len(doc.raw))
+        self._top_n = top_n
+        self._ids = np.empty(0, dtype=np.int64)
+        self._scores = np.empty(0)
+
+    @classmethod
+    def from_scores(cls, docs: List[Record], scores: np.ndarray, descending: bool = True) -> 'RankedChunks':
+        """Rank by a score array aligned with the concatenated chunks. Ties keep the document order."""
+        keys = -np.asarray(scores) if descending else np.asarray(scores)
+
+        def top_n(n: int) -> Tuple[np.ndarray, np.ndarray]:
+            if n >= len(keys):
+                ids = np.argsort(keys, kind='stable')
+            else:
+                # Same as the head of a stable argsort: all keys below the n-th smallest one,
+                # then the ties with it in position order
+                kth = np.partition(keys, n - 1)[n - 1]
+                better = np.flatnonzero(keys < kth)
+                better = better[np.argsort(keys[better], kind='stable')]
+                ids = np.concatenate([better, np.flatnonzero(keys == kth)[:n - len(better)]])
+            return ids, np.asarray(scores)[ids]
+
+        return cls(docs, top_n)
+
+    def __len__(self) -> int:
+        return self._offsets[-1]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('chunk index out of range')
+        if index >= len(self._ids):
+            self._ids, self._scores = self._top_n(min(max(index + 1, 2 * len(self._ids), self.MIN_BLOCK), len(self)))
+        pos = int(self._ids[index])
+        doc_idx = bisect.bisect_right(self._offsets, pos) - 1
+        return self._urls[doc_idx], pos - self._offsets[doc_idx], float(self._scores[index])
+
+
 class BaseSearch(BaseTool):
     description = '从给定文档中检索和问题相关的部分'
     parameters = {
@@ -52,6 +121,8 @@ class BaseSearch(BaseTool):
     def __init__(self, cfg: Optional[Dict] = None):
         super().__init__(cfg)
         self.max_ref_token: int = self.cfg.get('max_ref_token', DEFAULT_MAX_REF_TOKEN)
+        # Emit the retrieved chunks that are adjacent in a doc as one contiguous passage
+        self.merge_adjacent_chunks: bool = self.cfg.get('merge_adjacent_chunks', True)
 
     def call(self, params: Union[str, dict], docs: List[Union[Record, str, List[str]]] = None, **kwargs) -> list:
         """The basic search algorithm
@@ -91,7 +162,7 @@ class BaseSearch(BaseTool):
         return self.get_topk(chunk_and_score=chunk_and_score, docs=docs, max_ref_token=max_ref_token)
 
     @abstractmethod
-    def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> List[Tuple[str, int, float]]:
+    def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> Sequence[Tuple[str, int, float]]:
         """The function of compute the correlation score
 
         Args:
@@ -99,52 +170,56 @@ class BaseSearch(BaseTool):
             docs: The doc list
 
         Returns:
-            A list of tuples, one tuple is (the doc url, the chunk id, the score).
+            A sequence of tuples, one tuple is (the doc url, the chunk id, the score).
             Need to sort by score, and the earlier chunk is more relevant to the query.
+            A `RankedChunks` can be returned instead of a list, so that only the head is sorted.
         """
         raise NotImplementedError
 
     def get_topk(self,
-                 chunk_and_score: List[Tuple[str, int, float]],
+                 chunk_and_score: Iterable[Tuple[str, int, float]],
                  docs: List[Record],
                  max_ref_token: int = DEFAULT_MAX_REF_TOKEN) -> list:
         available_token = max_ref_token
 
-        docs_retrieved = {}  # [{'url': 'doc id', 'text': ['', '', ...]}]
-        docs_map = {}
-        for doc in docs:
-            docs_map[doc.url] = doc
-            docs_retrieved[doc.url] = RefMaterialOutput(url=doc.url, text=[''] * len(doc.raw))
-
+        docs_map = {doc.url: doc for doc in docs}
+        docs_retrieved = {}  # doc id -> {chunk id: text}
         for doc_id, chunk_id, _ in chunk_and_score:
             if available_token <= 0:
                 break
-            page = docs_map[doc_id].raw[chunk_id]
-            if docs_retrieved[doc_id].text[chunk_id]:
+            retrieved = docs_retrieved.setdefault(doc_id, {})
+            if chunk_id in retrieved:
                 # Has retrieved
                 continue
-            if available_token < page.token:
-                docs_retrieved[doc_id].text[chunk_id] = tokenizer.truncate(page.content, max_token=available_token)
+            page = docs_map[doc_id].raw[chunk_id]
+            token = refine_token_count(page.content, page.token, available_token)
+            if available_token < token:
+                retrieved[chunk_id] = tokenizer.truncate(page.content, max_token=available_token)
                 break
-            docs_retrieved[doc_id].text[chunk_id] = page.content
-            available_token -= page.token
+            retrieved[chunk_id] = page.content
+            available_token -= token
 
         res = []
-        for x in docs_retrieved.values():
-            x.text = [chk for chk in x.text if chk]
-            if x.text:
-                res.append(x.to_dict())
+        for doc in docs_map.values():
+            retrieved = {chunk_id: text for chunk_id, text in docs_retrieved.get(doc.url, {}).items() if text}
+            if not retrieved:
+                continue
+            if self.merge_adjacent_chunks:
+                text = merge_adjacent_chunks(retrieved)
+            else:
+                text = [retrieved[chunk_id] for chunk_id in sorted(retrieved)]
+            res.append(RefMaterialOutput(url=doc.url, text=text).to_dict())
         return res
 
     def format_docs(self, docs: List[Union[Record, str, List[str]]]):
 
         def format_input_doc(doc: List[str], url: str = '') -> Record:
             new_doc = []
-            parser = DocParser()
             for i, x in enumerate(doc):
                 page = {'page_num': i, 'content': [{'text': x, 'token': count_tokens(x)}]}
                 new_doc.append(page)
-            content = parser.split_doc_to_chunk(new_doc, path=url)
+            # Chunking needs no parser instance, which would create its workspace on every call
+            content = list(DocParser.split_doc_to_chunk(new_doc, path=url))
             return Record(url=url, raw=content, title='')
 
         new_docs = []
@@ -157,7 +232,7 @@ class BaseSearch(BaseTool):
 
             if isinstance(doc, Record):
                 new_docs.append(doc)
-                all_tokens += sum([page.token for page in doc.raw])
+                all_tokens += doc.get_total_token()
             else:
                 raise TypeError
         return new_docs, all_tokens
@@ -172,9 +247,10 @@ class BaseSearch(BaseTool):
             for page in doc.raw:
                 if available_token <= 0:
                     break
-                if page.token <= available_token:
+                token = refine_token_count(page.content, page.token, available_token)
+                if token <= available_token:
                     text.append(page.content)
-                    available_token -= page.token
+                    available_token -= token
                 else:
                     text.append(tokenizer.truncate(page.content, max_token=available_token))
                     break
@@ -182,3 +258,43 @@ class BaseSearch(BaseTool):
             now_ref_list = RefMaterialOutput(url=doc.url, text=text).to_dict()
             _ref_list.append(now_ref_list)
         return _ref_list
+
+
+def merge_adjacent_chunks(chunks: Dict[int, str]) -> List[str]:
+    """Join the chunks with consecutive ids into one passage, in chunk order
+
+    The overlap that DocParser copies from the end of a chunk to the start of the next one
+    (after the page marker) is kept only once.
+    """
+    passages = []
+    last_id = None
+    for chunk_id in sorted(chunks):
+        text = chunks[chunk_id]
+        if last_id is not None and chunk_id == last_id + 1:
+            passages[-1] = _join_overlapping(passages[-1], text)
+        else:
+            passages.append(text)
+        last_id = chunk_id
+    return passages
+
+
+def _join_overlapping(prev: str, text: str) -> str:
+    head, sep, body = text.partition(PARAGRAPH_SPLIT_SYMBOL)
+    if not (sep and re.fullmatch(r'\[page: \d+\]', head)):
+        head, body = '', text
+    elif head in prev:
+        head = ''  # The passage already covers this page
+
+    # The overlap ends at a paragraph boundary of the chunk, and may have lost the final sentence symbol
+    ends = [m.start() for m in re.finditer(re.escape(PARAGRAPH_SPLIT_SYMBOL), body[:MAX_CHUNK_OVERLAP + 1])]
+    if len(body) <= MAX_CHUNK_OVERLAP:
+        ends.append(len(body))
+    stripped_prev = prev.rstrip(SENTENCE_END)
+    for end in reversed(ends):
+        overlap = body[:end].rstrip(SENTENCE_END)
+        if overlap and stripped_prev.endswith(overlap):
+            body = body[end + len(PARAGRAPH_SPLIT_SYMBOL):]
+            break
+    if not body:
+        return prev
+    return PARAGRAPH_SPLIT_SYMBOL.join(x for x in (prev, head, body) if x)
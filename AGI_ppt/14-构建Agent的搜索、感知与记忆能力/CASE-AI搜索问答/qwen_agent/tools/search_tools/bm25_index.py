@@ -0,0 +1,140 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from qwen_agent.log import logger
+from qwen_agent.settings import DEFAULT_PARSER_PAGE_SIZE
+from qwen_agent.tools.doc_parser import Record
+from qwen_agent.tools.search_tools.base_search import RankedChunks
+from qwen_agent.tools.storage import KeyNotExistsError, Storage
+from qwen_agent.utils.sparse_bm25 import SparseBM25
+from qwen_agent.utils.utils import hash_sha256
+
+
+class RecordIndex:
+    """The inverted index of all chunks in one parsed doc"""
+
+    def __init__(self, url: str, signature: str, doc_len: List[int], postings: Dict[str, List[List[int]]]):
+        self.url = url
+        self.signature = signature
+        self.doc_len = doc_len  # The number of keywords in each chunk
+        self.postings = postings  # keyword -> [[chunk_id, term frequency], ...]
+
+    @classmethod
+    def build(cls, doc: Record, signature: str, tokenizer: Callable[[str], List[str]]) -> 'RecordIndex':
+        doc_len = []
+        postings = {}
+        for chunk_id, chk in enumerate(doc.raw):
+            words = tokenizer(chk.content)
+            doc_len.append(len(words))
+            for word, freq in Counter(words).items():
+                postings.setdefault(word, []).append([chunk_id, freq])
+        return cls(url=doc.url, signature=signature, doc_len=doc_len, postings=postings)
+
+    def to_dict(self) -> dict:
+        return {'url': self.url, 'signature': self.signature, 'doc_len': self.doc_len, 'postings': self.postings}
+
+
+class BM25Index:
+    """A persistent and incremental BM25 index over parsed docs.
+
+    One inverted index is built for each doc and cached next to the chunking cache of DocParser,
+    keyed by the url and the parser_page_size. The per-doc indexes are merged into a SparseBM25 engine
+    when the set of docs changes, so a new doc only needs to tokenize its own chunks.
+    The scores are the same as `rank_bm25.BM25Okapi`.
+    """
+
+    def __init__(self,
+                 storage_root: str,
+                 tokenizer: Callable[[str], List[str]],
+                 parser_page_size: int = DEFAULT_PARSER_PAGE_SIZE,
+                 k1: float = 1.5,
+                 b: float = 0.75,
+                 epsilon: float = 0.25):
+        self.db = Storage({'storage_root_path': storage_root})
+        self.tokenizer = tokenizer
+        self.parser_page_size = parser_page_size
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+        self._record_indexes: Dict[str, RecordIndex] = {}
+        # The (corpus key, engine) of the last set of docs, swapped as a whole so that concurrent searches
+        # over different sets of docs each score against their own corpus
+        self._corpus: Optional[Tuple[tuple, SparseBM25]] = None
+
+    def get_scores(self, query: List[str], docs: List[Record]) -> RankedChunks:
+        """Score all chunks of the docs
+
+        Returns:
+            The tuples (the doc url, the chunk id, the score), sorted by the score as they are read.
+            The chunks that do not hit any keyword keep their original order at the end.
+        """
+        record_indexes = [self.get_record_index(doc) for doc in docs]
+        bm25 = self._get_corpus(record_indexes)
+
+        # The chunk ids are the positions in doc.raw, so the chunks need not be loaded here
+        return RankedChunks.from_scores(docs, bm25.get_scores(query))
+
+    def get_record_index(self, doc: Record) -> RecordIndex:
+        signature = doc.get_signature()
+        cached_name = f'{hash_sha256(doc.url)}_{str(self.parser_page_size)}_keyword_index'
+
+        rec_idx = self._record_indexes.get(cached_name)
+        if rec_idx is not None and rec_idx.signature == signature:
+            return rec_idx
+
+        try:
+            rec_idx = RecordIndex(**json.loads(self.db.get(cached_name)))
+            if rec_idx.signature != signature:
+                rec_idx = None
+        except KeyNotExistsError:
+            rec_idx = None
+
+        if rec_idx is None:
+            logger.info(f'Start building keyword index for {doc.url}...')
+            time1 = time.time()
+            rec_idx = RecordIndex.build(doc, signature=signature, tokenizer=self.tokenizer)
+            self.db.put(cached_name, json.dumps(rec_idx.to_dict(), ensure_ascii=False))
+            time2 = time.time()
+            logger.info(f'Finished building keyword index for {doc.url}. Time spent: {time2 - time1} seconds.')
+
+        self._record_indexes[cached_name] = rec_idx
+        return rec_idx
+
+    def _get_corpus(self, record_indexes: List[RecordIndex]) -> SparseBM25:
+        corpus_key = tuple((rec_idx.url, rec_idx.signature) for rec_idx in record_indexes)
+        corpus = self._corpus
+        if corpus is not None and corpus[0] == corpus_key:
+            return corpus[1]
+
+        # Concatenate the chunks of all docs, and merge the term frequencies into one term-doc matrix
+        vocab, rows, cols, data, doc_len = {}, [], [], [], []
+        for rec_idx in record_indexes:
+            offset = len(doc_len)
+            for word, posting in rec_idx.postings.items():
+                term_id = vocab.setdefault(word, len(vocab))
+                for chunk_id, freq in posting:
+                    rows.append(term_id)
+                    cols.append(offset + chunk_id)
+                    data.append(freq)
+            doc_len.extend(rec_idx.doc_len)
+
+        bm25 = SparseBM25.from_term_freqs(vocab, rows, cols, data, doc_len, k1=self.k1, b=self.b, epsilon=self.epsilon)
+        self._corpus = (corpus_key, bm25)
+        return bm25
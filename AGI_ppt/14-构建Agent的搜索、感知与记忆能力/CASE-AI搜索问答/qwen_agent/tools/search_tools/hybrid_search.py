@@ -12,14 +12,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Dict, List, Optional, Tuple
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
 
-from qwen_agent.settings import DEFAULT_RAG_SEARCHERS
+from qwen_agent.log import logger
+from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN, DEFAULT_RAG_RRF_K, DEFAULT_RAG_SEARCHERS
 from qwen_agent.tools.base import TOOL_REGISTRY, register_tool
 from qwen_agent.tools.doc_parser import Record
 from qwen_agent.tools.search_tools.base_search import BaseSearch
 from qwen_agent.tools.search_tools.front_page_search import POSITIVE_INFINITY
 
+# Each searcher contributes the head of its ranking that holds this many times max_ref_token,
+# the chunks below that can not make it into the reference window
+HEAD_TOKEN_FACTOR = 2
+
+# The sub-searchers of all HybridSearch instances run in one shared pool, created on first use
+MAX_SEARCHER_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_SEARCHER_WORKERS, thread_name_prefix='hybrid_search')
+        return _executor
+
 
 @register_tool('hybrid_search')
 class HybridSearch(BaseSearch):
@@ -32,30 +54,69 @@ class HybridSearch(BaseSearch):
             raise ValueError(f'{self.name} can not be in `rag_searchers` = {self.rag_searchers}')
         self.search_objs = [TOOL_REGISTRY[name](cfg) for name in self.rag_searchers]
 
+        # The RRF score of a chunk is sum(weight / (rank + rrf_k)) over the searchers
+        weights = self.cfg.get('rag_searcher_weights', {})
+        self.searcher_weights = [float(weights.get(name, 1.0)) for name in self.rag_searchers]
+        self.rrf_k = self.cfg.get('rrf_k', DEFAULT_RAG_RRF_K)
+
     def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> List[Tuple[str, int, float]]:
-        chunk_and_score_list = []
-        for s_obj in self.search_objs:
-            chunk_and_score_list.append(s_obj.sort_by_scores(query=query, docs=docs, **kwargs))
+        max_ref_token = kwargs.get('max_ref_token', DEFAULT_MAX_REF_TOKEN)
+        docs_map = {doc.url: doc for doc in docs}
+        heads = self._run_searchers(query=query,
+                                    docs=docs,
+                                    docs_map=docs_map,
+                                    head_token=max_ref_token * HEAD_TOKEN_FACTOR,
+                                    **kwargs)
 
         chunk_score_map = {}
-        for doc in docs:
-            chunk_score_map[doc.url] = [0] * len(doc.raw)
-
-        for chunk_and_score in chunk_and_score_list:
-            for i in range(len(chunk_and_score)):
-                doc_id = chunk_and_score[i][0]
-                chunk_id = chunk_and_score[i][1]
-                score = chunk_and_score[i][2]
+        for weight, head in zip(self.searcher_weights, heads):
+            for rank, (doc_id, chunk_id, score) in enumerate(head):
+                key = (doc_id, chunk_id)
                 if score == POSITIVE_INFINITY:
-                    chunk_score_map[doc_id][chunk_id] = POSITIVE_INFINITY
+                    chunk_score_map[key] = POSITIVE_INFINITY
                 else:
-                    # TODO: This needs to be adjusted for performance
-                    chunk_score_map[doc_id][chunk_id] += 1 / (i + 1 + 60)
+                    chunk_score_map[key] = chunk_score_map.get(key, 0) + weight / (rank + 1 + self.rrf_k)
 
-        all_chunk_and_score = []
-        for k, v in chunk_score_map.items():
-            for i, x in enumerate(v):
-                all_chunk_and_score.append((k, i, x))
+        all_chunk_and_score = [(doc_id, chunk_id, score) for (doc_id, chunk_id), score in chunk_score_map.items()]
         all_chunk_and_score.sort(key=lambda item: item[2], reverse=True)
 
+        # Only when the heads can not fill the window, e.g., all searchers return nothing,
+        # the rest chunks are appended in document order with score 0
+        fused_tokens = sum(docs_map[doc_id].get_chunk_token(chunk_id) for doc_id, chunk_id, _ in all_chunk_and_score)
+        if fused_tokens < max_ref_token:
+            for doc in docs:
+                for chunk_id in range(len(doc.raw)):
+                    if (doc.url, chunk_id) not in chunk_score_map:
+                        all_chunk_and_score.append((doc.url, chunk_id, 0))
         return all_chunk_and_score
+
+    def _run_searchers(self, query: str, docs: List[Record], docs_map: Dict[str, Record], head_token: int,
+                       **kwargs) -> List[List[Tuple[str, int, float]]]:
+        """Run the sub-searchers concurrently, so the latency is that of the slowest one instead of the sum
+
+        Each one returns the head of its ranking that holds head_token tokens, the lazy rankings
+        (`RankedChunks`) are only sorted that far, inside the worker thread.
+        """
+
+        def _run(s_obj: BaseSearch):
+            t0 = time.time()
+            chunk_and_score = s_obj.sort_by_scores(query=query, docs=docs, **kwargs)
+            head = chunk_and_score[:self._get_head_size(chunk_and_score, docs_map, head_token)]
+            logger.debug(f'{s_obj.name} took {time.time() - t0:.3f}s')
+            return head
+
+        if len(self.search_objs) <= 1:
+            return [_run(s_obj) for s_obj in self.search_objs]
+        futures = [_get_executor().submit(_run, s_obj) for s_obj in self.search_objs]
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def _get_head_size(chunk_and_score: Sequence[Tuple[str, int, float]], docs_map: Dict[str, Record],
+                       head_token: int) -> int:
+        """The number of leading chunks that hold head_token tokens"""
+        total = 0
+        for i, (doc_id, chunk_id, _) in enumerate(chunk_and_score):
+            total += docs_map[doc_id].get_chunk_token(chunk_id)
+            if total >= head_token:
+                return i + 1
+        return len(chunk_and_score)
@@ -12,23 +12,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import re
 import string
-from typing import List, Tuple
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 
 import json5
 
 from qwen_agent.log import logger
-from qwen_agent.settings import DEFAULT_MAX_REF_TOKEN
+from qwen_agent.settings import (DEFAULT_MAX_REF_TOKEN, DEFAULT_PARSER_PAGE_SIZE, DEFAULT_TOKEN_CACHE_DIR,
+                                 DEFAULT_TOKEN_CACHE_SIZE, DEFAULT_WORKSPACE)
 from qwen_agent.tools.base import register_tool
 from qwen_agent.tools.doc_parser import Record
 from qwen_agent.tools.search_tools.base_search import BaseSearch
-from qwen_agent.utils.utils import has_chinese_chars
+from qwen_agent.tools.search_tools.bm25_index import BM25Index
+from qwen_agent.utils.utils import has_chinese_chars, hash_sha256, print_traceback
 
 
 @register_tool('keyword_search')
 class KeywordSearch(BaseSearch):
 
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        # The keyword index is saved next to the chunking cache of DocParser
+        self.data_root = self.cfg.get('path', os.path.join(DEFAULT_WORKSPACE, 'tools', 'doc_parser'))
+        self.bm25_index = BM25Index(storage_root=self.data_root,
+                                    tokenizer=split_text_into_keywords,
+                                    parser_page_size=self.cfg.get('parser_page_size', DEFAULT_PARSER_PAGE_SIZE))
+
     def search(self, query: str, docs: List[Record], max_ref_token: int = DEFAULT_MAX_REF_TOKEN) -> list:
         chunk_and_score = self.sort_by_scores(query=query, docs=docs)
         if not chunk_and_score:
@@ -41,27 +54,17 @@ class KeywordSearch(BaseSearch):
         else:
             return self._get_the_front_part(docs, max_ref_token)
 
-    def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> List[Tuple[str, int, float]]:
+    def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> Sequence[Tuple[str, int, float]]:
         wordlist = parse_keyword(query)
         logger.debug('wordlist: ' + ','.join(wordlist))
         if not wordlist:
             # This represents the queries that do not use retrieval: summarize, etc.
             return []
 
-        # Plain all chunks from all docs
-        all_chunks = []
-        for doc in docs:
-            all_chunks.extend(doc.raw)
-
-        # Using bm25 retrieval
-        from rank_bm25 import BM25Okapi
-        bm25 = BM25Okapi([split_text_into_keywords(x.content) for x in all_chunks])
-        doc_scores = bm25.get_scores(wordlist)
-        chunk_and_score = [
-            (chk.metadata['source'], chk.metadata['chunk_id'], score) for chk, score in zip(all_chunks, doc_scores)
-        ]
-        chunk_and_score.sort(key=lambda item: item[2], reverse=True)
+        # Using bm25 retrieval, the index of each doc is only built once
+        chunk_and_score = self.bm25_index.get_scores(wordlist, docs)
         assert len(chunk_and_score) > 0
+        logger.debug(f'Token cache stats: {TOKEN_CACHE.stats()}')
 
         return chunk_and_score
 
@@ -129,10 +132,102 @@ def tokenize_and_filter(input_text: str) -> str:
     return filtered_tokens
 
 
+class TokenCache:
+    """The content-hash keyed cache of the tokenized texts
+
+    It is an in-memory LRU, plus an optional disk tier (diskcache) that survives restarts.
+    The cache is shared by the whole process, so the disk tier is configured by DEFAULT_TOKEN_CACHE_DIR.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_TOKEN_CACHE_SIZE, cache_dir: Optional[str] = None):
+        self.max_size = max_size
+        self._lru: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            self.set_cache_dir(cache_dir)
+
+    def set_cache_dir(self, cache_dir: str):
+        if self._disk is not None and self._disk.directory == os.path.abspath(cache_dir):
+            return
+        try:
+            import diskcache
+        except ImportError:
+            print_traceback(is_error=False)
+            logger.warning('Token caching on disk disabled because diskcache is not installed. '
+                           'Please `pip install diskcache`.')
+            return
+        os.makedirs(cache_dir, exist_ok=True)
+        self._disk = diskcache.Cache(directory=os.path.abspath(cache_dir))
+
+    def get_or_compute(self, text: str, tokenize: Callable[[str], List[str]]) -> List[str]:
+        key = hash_sha256(text)
+        with self._lock:
+            tokens = self._lru.get(key)
+            if tokens is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return list(tokens)
+
+        tokens = self._disk.get(key) if self._disk is not None else None
+        if tokens is not None:
+            with self._lock:
+                self.disk_hits += 1
+        else:
+            tokens = tuple(tokenize(text))
+            with self._lock:
+                self.misses += 1
+            if self._disk is not None:
+                self._disk.set(key, tokens)
+
+        with self._lock:
+            self._lru[key] = tokens
+            if len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+        return list(tokens)
+
+    def stats(self) -> dict:
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            'size': len(self._lru),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / total if total else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            self.hits = self.disk_hits = self.misses = 0
+
+
+TOKEN_CACHE = TokenCache(cache_dir=DEFAULT_TOKEN_CACHE_DIR or None)
+
+_thread_local = threading.local()
+
+
+def get_stemmer():
+    # Stemmer objects are stateful, so keep one per thread instead of creating one per call
+    stemmer = getattr(_thread_local, 'stemmer', None)
+    if stemmer is None:
+        import snowballstemmer
+        stemmer = snowballstemmer.stemmer('english')
+        _thread_local.stemmer = stemmer
+    return stemmer
+
+
 def string_tokenizer(text: str) -> List[str]:
+    return TOKEN_CACHE.get_or_compute(text, _string_tokenizer)
+
+
+def _string_tokenizer(text: str) -> List[str]:
     text = text.lower().strip()
     if has_chinese_chars(text):
-        import jieba
+        import jieba  # The dictionary is loaded only once by the default jieba tokenizer
         _wordlist_tmp = list(jieba.lcut(text))
         _wordlist = []
         for word in _wordlist_tmp:
@@ -151,9 +246,7 @@ def string_tokenizer(text: str) -> List[str]:
         else:
             _wordlist_res.append(word)
 
-    import snowballstemmer
-    stemmer = snowballstemmer.stemmer('english')
-    return stemmer.stemWords(_wordlist_res)
+    return get_stemmer().stemWords(_wordlist_res)
 
 
 def split_text_into_keywords(text: str) -> List[str]:
@@ -172,8 +265,7 @@ def parse_keyword(text):
     except Exception:
         return split_text_into_keywords(text)
 
-    import snowballstemmer
-    stemmer = snowballstemmer.stemmer('english')
+    stemmer = get_stemmer()
 
     # json format
     _wordlist = []
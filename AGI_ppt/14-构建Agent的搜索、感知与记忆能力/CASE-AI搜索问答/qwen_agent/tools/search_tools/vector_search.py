@@ -12,32 +12,112 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import glob
 import json
 import os
-from typing import List, Tuple
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
 
+import numpy as np
+
+from qwen_agent.log import logger
+from qwen_agent.settings import DEFAULT_WORKSPACE
 from qwen_agent.tools.base import register_tool
 from qwen_agent.tools.doc_parser import Record
-from qwen_agent.tools.search_tools.base_search import BaseSearch
+from qwen_agent.tools.search_tools.base_search import BaseSearch, RankedChunks
+from qwen_agent.utils.utils import hash_sha256, print_traceback
+
+DEFAULT_EMBEDDING_MODEL = 'text-embedding-v1'
+MAX_CACHED_INDEXES = 8
+MAX_PERSISTED_INDEXES = 32  # The least recently used {key}.faiss files beyond this are deleted
+MAX_CACHED_EMBEDDINGS = 20000  # The chunk vectors kept in memory, in front of the disk tier
+
+
+class EmbeddingStore:
+    """The content-addressed store of chunk embeddings
+
+    The key is sha256(model name + chunk text) and the value is a float32 vector.
+    The recently used vectors are kept in an in-memory LRU, and all of them are persisted by diskcache
+    if it is installed.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int = MAX_CACHED_EMBEDDINGS):
+        self.max_size = max_size
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        try:
+            import diskcache
+        except ImportError:
+            print_traceback(is_error=False)
+            logger.warning('Embedding caching on disk disabled because diskcache is not installed. '
+                           'Please `pip install diskcache`.')
+            self._disk = None
+        else:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk = diskcache.Cache(directory=cache_dir)
+
+    def get_or_embed(self, keys: List[str], texts: List[str],
+                     embed: Callable[[List[str]], List[List[float]]]) -> np.ndarray:
+        vectors = [self._get(key) for key in keys]
+        missing = [i for i, vec in enumerate(vectors) if vec is None]
+        if missing:
+            logger.info(f'Embedding {len(missing)} new chunks, {len(keys) - len(missing)} chunks are cached.')
+            new_vectors = embed([texts[i] for i in missing])
+            for i, vec in zip(missing, new_vectors):
+                vectors[i] = np.asarray(vec, dtype=np.float32)
+                self._set(keys[i], vectors[i])
+        return np.vstack(vectors)
+
+    def _get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vec = self._memory.get(key)
+            if vec is not None:
+                self._memory.move_to_end(key)
+                return vec
+        if self._disk is not None:
+            value = self._disk.get(key)
+            if value is not None:
+                vec = np.frombuffer(value, dtype=np.float32)
+                self._remember(key, vec)
+        return vec
+
+    def _set(self, key: str, vec: np.ndarray):
+        self._remember(key, vec)
+        if self._disk is not None:
+            self._disk.set(key, vec.tobytes())
+
+    def _remember(self, key: str, vec: np.ndarray):
+        with self._lock:
+            self._memory[key] = vec
+            self._memory.move_to_end(key)
+            if len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
 
 
 @register_tool('vector_search')
 class VectorSearch(BaseSearch):
     # TODO: Optimize the accuracy of the embedding retriever.
 
-    def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> List[Tuple[str, int, float]]:
-        # TODO: More types of embedding can be configured
-        try:
-            from langchain.schema import Document
-        except ModuleNotFoundError:
-            raise ModuleNotFoundError('Please install langchain by: `pip install langchain`')
+    def __init__(self, cfg: Optional[Dict] = None):
+        super().__init__(cfg)
+        # Any LangChain-style embeddings (with `embed_documents` and `embed_query`) can be configured,
+        # e.g., a local deterministic one for testing. DashScope embeddings are used by default.
+        self.embeddings = self.cfg.get('embeddings')
+        default_model = DEFAULT_EMBEDDING_MODEL if self.embeddings is None else type(self.embeddings).__name__
+        self.embedding_model = self.cfg.get('embedding_model', default_model)
+
+        self.data_root = self.cfg.get('path', os.path.join(DEFAULT_WORKSPACE, 'tools', self.name))
+        os.makedirs(self.data_root, exist_ok=True)
+        self.embedding_store = EmbeddingStore(os.path.join(self.data_root, 'embeddings'))
+        self._indexes: OrderedDict = OrderedDict()
+
+    def sort_by_scores(self, query: str, docs: List[Record], **kwargs) -> RankedChunks:
         try:
-            from langchain_community.embeddings import DashScopeEmbeddings
-            from langchain_community.vectorstores import FAISS
+            import faiss
         except ModuleNotFoundError:
             raise ModuleNotFoundError(
-                'Please install langchain_community by: `pip install langchain_community`, '
-                'and install faiss by: `pip install faiss-cpu` or `pip install faiss-gpu` (for CUDA supported GPU)')
+                'Please install faiss by: `pip install faiss-cpu` or `pip install faiss-gpu` (for CUDA supported GPU)')
         # Extract raw query
         try:
             query_json = json.loads(query)
@@ -47,15 +127,57 @@ class VectorSearch(BaseSearch):
         except json.decoder.JSONDecodeError:
             pass
 
-        # Plain all chunks from all docs
-        all_chunks = []
-        for doc in docs:
-            for chk in doc.raw:
-                all_chunks.append(Document(page_content=chk.content[:2000], metadata=chk.metadata))
+        # Only the query is embedded here, the chunks are embedded once and indexed once for each doc set
+        index = self._get_index(docs, faiss)
+        query_vec = np.asarray([self._get_embeddings().embed_query(query)], dtype=np.float32)
+
+        def top_n(n: int) -> Tuple[np.ndarray, np.ndarray]:
+            distances, indices = index.search(query_vec, n)
+            return indices[0], distances[0]
+
+        # The chunk ids are the positions in doc.raw, so the chunks need not be loaded here,
+        # and faiss only sorts the nearest chunks that are actually read
+        return RankedChunks(docs, top_n)
+
+    def _get_index(self, docs: List[Record], faiss):
+        index_key = hash_sha256(self.embedding_model + ''.join(doc.get_signature() for doc in docs))
+        if index_key in self._indexes:
+            self._indexes.move_to_end(index_key)
+            return self._indexes[index_key]
+
+        index_path = os.path.join(self.data_root, f'{index_key}.faiss')
+        if os.path.exists(index_path):
+            index = faiss.read_index(index_path)
+            os.utime(index_path)  # The mtime orders the index files for eviction
+        else:
+            texts = [chk.content[:2000] for doc in docs for chk in doc.raw]
+            chunk_keys = [hash_sha256(f'{self.embedding_model}:{text}') for text in texts]
+            vectors = self.embedding_store.get_or_embed(chunk_keys, texts, self._get_embeddings().embed_documents)
+            index = faiss.IndexFlatL2(vectors.shape[1])
+            index.add(vectors)
+            faiss.write_index(index, index_path)
+            self._evict_index_files()
+
+        self._indexes[index_key] = index
+        if len(self._indexes) > MAX_CACHED_INDEXES:
+            self._indexes.popitem(last=False)
+        return index
 
-        embeddings = DashScopeEmbeddings(model='text-embedding-v1',
-                                         dashscope_api_key=os.getenv('DASHSCOPE_API_KEY', ''))
-        db = FAISS.from_documents(all_chunks, embeddings)
-        chunk_and_score = db.similarity_search_with_score(query, k=len(all_chunks))
+    def _evict_index_files(self):
+        index_files = sorted(glob.glob(os.path.join(self.data_root, '*.faiss')), key=os.path.getmtime, reverse=True)
+        for index_file in index_files[MAX_PERSISTED_INDEXES:]:
+            try:
+                os.remove(index_file)
+            except OSError:
+                pass
 
-        return [(chk.metadata['source'], chk.metadata['chunk_id'], score) for chk, score in chunk_and_score]
+    def _get_embeddings(self):
+        if self.embeddings is None:
+            # TODO: More types of embedding can be configured
+            try:
+                from langchain_community.embeddings import DashScopeEmbeddings
+            except ModuleNotFoundError:
+                raise ModuleNotFoundError('Please install langchain_community by: `pip install langchain_community`')
+            self.embeddings = DashScopeEmbeddings(model=self.embedding_model,
+                                                  dashscope_api_key=os.getenv('DASHSCOPE_API_KEY', ''))
+        return self.embeddings
@@ -12,19 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import codecs
 import json
 import os
 import re
+import tempfile
 import time
 from collections import Counter
-from typing import Dict, List, Optional, Union
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Union
 
 from qwen_agent.log import logger
 from qwen_agent.settings import DEFAULT_WORKSPACE
 from qwen_agent.tools.base import BaseTool, register_tool
 from qwen_agent.tools.storage import KeyNotExistsError, Storage
 from qwen_agent.utils.str_processing import rm_cid, rm_continuous_placeholders, rm_hexadecimal
-from qwen_agent.utils.tokenization_qwen import count_tokens
+from qwen_agent.utils.tokenization_qwen import TOKEN_COUNTER_CACHE_TAG, count_tokens
 from qwen_agent.utils.utils import (get_file_type, hash_sha256, is_http_url, read_text_from_file,
                                     sanitize_chrome_file_path, save_url_to_local_work_dir)
 
@@ -124,6 +127,44 @@ def parse_txt(path: str):
     return [{'page_num': 1, 'content': content}]
 
 
+def detect_txt_encoding(path: str) -> str:
+    """The encoding to read a txt file with: 'utf-8' if the entire file is valid UTF-8,
+    otherwise the one detected by charset_normalizer, the same as `read_text_from_file`"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                decoder.decode(block)
+        decoder.decode(b'', final=True)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        from charset_normalizer import from_path
+        best = from_path(path).best()
+        return best.encoding if best is not None else 'utf-8'
+
+
+def iter_txt_pages(path: str, paras_per_page: int = 1000) -> Iterator[dict]:
+    """Read a txt file lazily, without loading the entire file into memory
+
+    The paragraphs are the same as `parse_txt`. They are yielded in batches that all have page_num 1,
+    and the batches are chunked the same as one page. The encoding is detected before any batch is yielded,
+    so a non UTF-8 byte late in the file does not fail the parsing.
+    """
+    content = []
+    with open(path, 'r', encoding=detect_txt_encoding(path), errors='replace') as file:
+        last_line = ''
+        for line in file:
+            if not line.endswith(PARAGRAPH_SPLIT_SYMBOL):
+                last_line = line  # The last line without a line break
+                break
+            content.append({'text': line[:-1]})
+            if len(content) >= paras_per_page:
+                yield {'page_num': 1, 'content': content}
+                content = []
+        content.append({'text': last_line})
+    yield {'page_num': 1, 'content': content}
+
+
 def df_to_md(df) -> str:
 
     def replace_long_dashes(text):
@@ -237,56 +278,102 @@ def parse_html_bs(path: str, extract_image: bool = False):
     return [{'page_num': 1, 'content': content, 'title': title}]
 
 
-def parse_pdf(pdf_path: str, extract_image: bool = False) -> List[dict]:
-    # Todo: header and footer
-    from pdfminer.high_level import extract_pages
-    from pdfminer.layout import LTImage, LTRect, LTTextContainer
+PDF_MIN_PAGES_PER_WORKER = 20  # Parallel parsing is only used for pdfs with at least twice this many pages
 
-    doc = []
+
+def parse_pdf(pdf_path: str, extract_image: bool = False, max_workers: int = 1) -> List[dict]:
+    if max_workers > 1:
+        import pdfplumber
+        with pdfplumber.open(pdf_path) as pdf:
+            num_pages = len(pdf.pages)
+        if num_pages >= 2 * PDF_MIN_PAGES_PER_WORKER:
+            # Split the pages into contiguous ranges, and parse each range in a separate process
+            num_ranges = min(max_workers, num_pages // PDF_MIN_PAGES_PER_WORKER)
+            bounds = [round(num_pages * i / num_ranges) for i in range(num_ranges + 1)]
+            page_ranges = [list(range(bounds[i] + 1, bounds[i + 1] + 1)) for i in range(num_ranges)]
+            with ProcessPoolExecutor(max_workers=num_ranges) as executor:
+                futures = [executor.submit(_parse_pdf_pages, pdf_path, extract_image, x) for x in page_ranges]
+                doc = []
+                for future in futures:
+                    doc.extend(future.result())
+            return doc
+    return list(iter_pdf_pages(pdf_path, extract_image))
+
+
+def _parse_pdf_pages(pdf_path: str, extract_image: bool, page_numbers: List[int]) -> List[dict]:
+    return list(iter_pdf_pages(pdf_path, extract_image, page_numbers=page_numbers))
+
+
+def iter_pdf_pages(pdf_path: str,
+                   extract_image: bool = False,
+                   page_numbers: Optional[List[int]] = None) -> Iterator[dict]:
+    """Parse a pdf page by page
+
+    The layout analysis of pdfminer runs once per page, and is shared by the text, font and table extraction.
+    Each page is yielded as soon as it is parsed, and its layout is released afterwards.
+
+    Args:
+        page_numbers: The 1-based page numbers to parse. All pages are parsed by default.
+    """
+    # Todo: header and footer
     import pdfplumber
-    pdf = pdfplumber.open(pdf_path)
-    for i, page_layout in enumerate(extract_pages(pdf_path)):
-        page = {'page_num': page_layout.pageid, 'content': []}
-
-        elements = []
-        for element in page_layout:
-            elements.append(element)
-
-        # Init params for table
-        table_num = 0
-        tables = []
-
-        for element in elements:
-            if isinstance(element, LTRect):
-                if not tables:
-                    tables = extract_tables(pdf, i)
-                if table_num < len(tables):
-                    table_string = table_converter(tables[table_num])
-                    table_num += 1
-                    if table_string:
-                        page['content'].append({'table': table_string, 'obj': element})
-            elif isinstance(element, LTTextContainer):
-                # Delete line breaks in the same paragraph
-                text = element.get_text()
-                # Todo: Further analysis using font
-                font = get_font(element)
-                if text.strip():
-                    new_content_item = {'text': text, 'obj': element}
-                    if font:
-                        new_content_item['font-size'] = round(font[1])
-                        # new_content_item['font-name'] = font[0]
-                    page['content'].append(new_content_item)
-            elif extract_image and isinstance(element, LTImage):
-                # Todo: ocr
-                raise ValueError('Currently, extracting images is not supported!')
-            else:
-                pass
+    from pdfminer.converter import PDFPageAggregator
+    from pdfminer.pdfinterp import PDFPageInterpreter
 
-        # merge elements
-        page['content'] = postprocess_page_content(page['content'])
-        doc.append(page)
+    # laparams={} enables the same layout analysis as `pdfminer.high_level.extract_pages`
+    with pdfplumber.open(pdf_path, pages=page_numbers, laparams={}) as pdf:
+        for plumber_page in pdf.pages:
+            # Same as `plumber_page.layout`, but without tagging the marked content id of every char
+            device = PDFPageAggregator(pdf.rsrcmgr, pageno=plumber_page.page_number, laparams=pdf.laparams)
+            PDFPageInterpreter(pdf.rsrcmgr, device).process_page(plumber_page.page_obj)
+            # pdfplumber caches the layout here, and builds the objects for table extraction from it
+            plumber_page._layout = device.get_result()
+
+            page = parse_pdf_page(plumber_page, extract_image)
+            plumber_page.close()  # Release the cached layout and objects
+            yield page
 
-    return doc
+
+def parse_pdf_page(plumber_page, extract_image: bool = False) -> dict:
+    from pdfminer.layout import LTImage, LTRect, LTTextContainer
+
+    page_layout = plumber_page.layout
+    page = {'page_num': page_layout.pageid, 'content': []}
+
+    # Init params for table
+    table_num = 0
+    tables = None
+
+    for element in page_layout:
+        if isinstance(element, LTRect):
+            if tables is None:
+                # The tables are found from the objects of the same layout
+                tables = plumber_page.extract_tables()
+            if table_num < len(tables):
+                table_string = table_converter(tables[table_num])
+                table_num += 1
+                if table_string:
+                    page['content'].append({'table': table_string, 'obj': element})
+        elif isinstance(element, LTTextContainer):
+            # Delete line breaks in the same paragraph
+            text = element.get_text()
+            # Todo: Further analysis using font
+            font = get_font(element)
+            if text.strip():
+                new_content_item = {'text': text, 'obj': element}
+                if font:
+                    new_content_item['font-size'] = round(font[1])
+                    # new_content_item['font-name'] = font[0]
+                page['content'].append(new_content_item)
+        elif extract_image and isinstance(element, LTImage):
+            # Todo: ocr
+            raise ValueError('Currently, extracting images is not supported!')
+        else:
+            pass
+
+    # merge elements
+    page['content'] = postprocess_page_content(page['content'])
+    return page
 
 
 def postprocess_page_content(page_content: list) -> list:
@@ -397,6 +484,8 @@ class SimpleDocParser(BaseTool):
         self.data_root = self.cfg.get('path', os.path.join(DEFAULT_WORKSPACE, 'tools', self.name))
         self.extract_image = self.cfg.get('extract_image', False)
         self.structured_doc = self.cfg.get('structured_doc', False)
+        # Parse the page ranges of a large pdf in parallel processes
+        self.pdf_max_workers = self.cfg.get('pdf_max_workers', 1)
 
         self.db = Storage({'storage_root_path': self.data_root})
 
@@ -421,67 +510,93 @@ class SimpleDocParser(BaseTool):
         """
 
         params = self._verify_json_format_args(params)
-        path = params['url']
-        cached_name_ori = f'{hash_sha256(path)}_ori'
-        try:
-            # Directly load the parsed doc
-            parsed_file = self.db.get(cached_name_ori)
-            parsed_file = json.loads(parsed_file)
-            logger.info(f'Read parsed {path} from cache.')
-        except KeyNotExistsError:
-            logger.info(f'Start parsing {path}...')
-            time1 = time.time()
-
-            f_type = get_file_type(path)
-            if f_type in PARSER_SUPPORTED_FILE_TYPES:
-                if path.startswith('https://') or path.startswith('http://') or re.match(
-                        r'^[A-Za-z]:\\', path) or re.match(r'^[A-Za-z]:/', path):
-                    path = path
-                else:
-                    path = sanitize_chrome_file_path(path)
-
-            os.makedirs(self.data_root, exist_ok=True)
-            if is_http_url(path):
-                # download online url
-                tmp_file_root = os.path.join(self.data_root, hash_sha256(path))
-                os.makedirs(tmp_file_root, exist_ok=True)
-                path = save_url_to_local_work_dir(path, tmp_file_root)
-            try:
-                if f_type == 'pdf':
-                    parsed_file = parse_pdf(path, self.extract_image)
-                elif f_type == 'docx':
-                    parsed_file = parse_word(path, self.extract_image)
-                elif f_type == 'pptx':
-                    parsed_file = parse_ppt(path, self.extract_image)
-                elif f_type == 'txt':
-                    parsed_file = parse_txt(path)
-                elif f_type == 'html':
-                    parsed_file = parse_html_bs(path, self.extract_image)
-                elif f_type == 'csv':
-                    parsed_file = parse_csv(path, self.extract_image)
-                elif f_type == 'tsv':
-                    parsed_file = parse_tsv(path, self.extract_image)
-                elif f_type in ['xlsx', 'xls']:
-                    parsed_file = parse_excel(path, self.extract_image)
-                else:
-                    _t = '/'.join(PARSER_SUPPORTED_FILE_TYPES)
-                    raise ValueError(
-                        f'Failed: The current parser does not support this file type! Supported types: {_t}')
-            except Exception as ex:
-                exception_type = type(ex).__name__
-                exception_message = str(ex)
-                raise DocParserError(code=exception_type, message=exception_message)
-
-            for page in parsed_file:
-                for para in page['content']:
-                    # Todo: More attribute types
-                    para['token'] = count_tokens(para.get('text', para.get('table')))
-            time2 = time.time()
-            logger.info(f'Finished parsing {path}. Time spent: {time2 - time1} seconds.')
-            # Cache the parsing doc
-            self.db.put(cached_name_ori, json.dumps(parsed_file, ensure_ascii=False, indent=2))
+        parsed_file = list(self.iter_pages(params['url']))
 
         if not self.structured_doc:
             return get_plain_doc(parsed_file)
         else:
             return parsed_file
+
+    def iter_pages(self, path: str) -> Iterator[dict]:
+        """Parse the doc lazily, and yield the pages in the structured format of `call` one by one.
+
+        The parsed doc is cached after all pages have been yielded.
+        """
+        cached_name_ori = f'{hash_sha256(path)}_ori{TOKEN_COUNTER_CACHE_TAG}'
+        try:
+            # Directly load the parsed doc
+            parsed_file = json.loads(self.db.get(cached_name_ori))
+        except KeyNotExistsError:
+            parsed_file = None
+        if parsed_file is not None:
+            logger.info(f'Read parsed {path} from cache.')
+            yield from parsed_file
+            return
+
+        logger.info(f'Start parsing {path}...')
+        time1 = time.time()
+
+        f_type = get_file_type(path)
+        if f_type in PARSER_SUPPORTED_FILE_TYPES:
+            if path.startswith('https://') or path.startswith('http://') or re.match(
+                    r'^[A-Za-z]:\\', path) or re.match(r'^[A-Za-z]:/', path):
+                path = path
+            else:
+                path = sanitize_chrome_file_path(path)
+
+        os.makedirs(self.data_root, exist_ok=True)
+        if is_http_url(path):
+            # download online url
+            tmp_file_root = os.path.join(self.data_root, hash_sha256(path))
+            os.makedirs(tmp_file_root, exist_ok=True)
+            path = save_url_to_local_work_dir(path, tmp_file_root)
+
+        # Cache the parsing doc, which is written as a json list page by page
+        cache_path = os.path.join(self.data_root, cached_name_ori)
+        # Each parse writes its own temporary file, the concurrent parses of the same url do not clash
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', prefix=f'{cached_name_ori}.', dir=self.data_root)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write('[')
+                for i, page in enumerate(self._iter_parsed_pages(path, f_type)):
+                    for para in page['content']:
+                        # Todo: More attribute types
+                        para['token'] = count_tokens(para.get('text', para.get('table')))
+                    f.write((',\n' if i else '\n') + json.dumps(page, ensure_ascii=False))
+                    yield page
+                f.write('\n]')
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        time2 = time.time()
+        logger.info(f'Finished parsing {path}. Time spent: {time2 - time1} seconds.')
+
+    def _iter_parsed_pages(self, path: str, f_type: str) -> Iterator[dict]:
+        try:
+            if f_type == 'pdf':
+                if self.pdf_max_workers > 1:
+                    yield from parse_pdf(path, self.extract_image, max_workers=self.pdf_max_workers)
+                else:
+                    yield from iter_pdf_pages(path, self.extract_image)
+            elif f_type == 'docx':
+                yield from parse_word(path, self.extract_image)
+            elif f_type == 'pptx':
+                yield from parse_ppt(path, self.extract_image)
+            elif f_type == 'txt':
+                yield from iter_txt_pages(path)
+            elif f_type == 'html':
+                yield from parse_html_bs(path, self.extract_image)
+            elif f_type == 'csv':
+                yield from parse_csv(path, self.extract_image)
+            elif f_type == 'tsv':
+                yield from parse_tsv(path, self.extract_image)
+            elif f_type in ['xlsx', 'xls']:
+                yield from parse_excel(path, self.extract_image)
+            else:
+                _t = '/'.join(PARSER_SUPPORTED_FILE_TYPES)
+                raise ValueError(f'Failed: The current parser does not support this file type! Supported types: {_t}')
+        except Exception as ex:
+            exception_type = type(ex).__name__
+            exception_message = str(ex)
+            raise DocParserError(code=exception_type, message=exception_message)
@@ -0,0 +1,160 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+from typing import List, Sequence
+
+import numpy as np
+
+MAGIC = b'QWCHUNK1'
+_ALIGN = 8
+
+
+def _pad(n: int) -> int:
+    return (_ALIGN - n % _ALIGN) % _ALIGN
+
+
+class ChunkStoreWriter:
+    """Write the chunks of one doc into a columnar binary file, one chunk at a time
+
+    Layout:
+        MAGIC | header length (uint64) | json header | int64 offsets (n + 1) | int64 tokens (n) | utf-8 text blob
+
+    The text blob is spooled to a temporary file, so the memory usage does not grow with the doc size.
+    The signature in the header is the sha256 of the text blob, which is the same as `hash_sha256(''.join(contents))`.
+    """
+
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self.meta = meta
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Each writer has its own temporary files, the concurrent writers of the same path do not clash
+        fd, self._blob_path = self._mkstemp('.blob.tmp')
+        self._blob = os.fdopen(fd, 'wb')
+        self._offsets = array('q', [0])
+        self._tokens = array('q')
+        self._sha256 = hashlib.sha256()
+
+    def add(self, content: str, token: int):
+        data = content.encode('utf-8')
+        self._blob.write(data)
+        self._sha256.update(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+        self._tokens.append(token)
+
+    def close(self):
+        self._blob.close()
+        header = dict(self.meta)
+        header['num_chunks'] = len(self._tokens)
+        header['signature'] = self._sha256.hexdigest()
+        header = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        header += b' ' * _pad(len(MAGIC) + 8 + len(header))
+
+        fd, tmp_path = self._mkstemp('.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(MAGIC)
+                f.write(struct.pack('<Q', len(header)))
+                f.write(header)
+                f.write(np.frombuffer(self._offsets, dtype=np.int64).astype('<i8').tobytes())
+                f.write(np.frombuffer(self._tokens, dtype=np.int64).astype('<i8').tobytes())
+                with open(self._blob_path, 'rb') as blob:
+                    shutil.copyfileobj(blob, f)
+            # Readers never see a half-written file
+            os.replace(tmp_path, self.path)
+        finally:
+            for path in (tmp_path, self._blob_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _mkstemp(self, suffix: str):
+        return tempfile.mkstemp(suffix=suffix,
+                                prefix=f'{os.path.basename(self.path)}.',
+                                dir=os.path.dirname(os.path.abspath(self.path)))
+
+    def abort(self):
+        self._blob.close()
+        if os.path.exists(self._blob_path):
+            os.remove(self._blob_path)
+
+    def __enter__(self) -> 'ChunkStoreWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_chunk_store(path: str, meta: dict, contents: Sequence[str], tokens: Sequence[int]):
+    assert len(contents) == len(tokens)
+    with ChunkStoreWriter(path, meta) as writer:
+        for content, token in zip(contents, tokens):
+            writer.add(content, token)
+
+
+class ChunkStore:
+    """A read-only, memory-mapped view of a file written by `write_chunk_store`
+
+    Opening a store only reads the header. The texts are decoded one chunk at a time on access.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self._mm.close()
+            raise ValueError(f'Not a chunk store: {path}')
+
+        pos = len(MAGIC)
+        header_len = struct.unpack('<Q', self._mm[pos:pos + 8])[0]
+        pos += 8
+        self.meta: dict = json.loads(self._mm[pos:pos + header_len].decode('utf-8'))
+        pos += header_len
+
+        n = self.meta['num_chunks']
+        self.offsets = np.frombuffer(self._mm, dtype='<i8', count=n + 1, offset=pos)
+        pos += (n + 1) * 8
+        self.tokens = np.frombuffer(self._mm, dtype='<i8', count=n, offset=pos)
+        pos += n * 8
+        self._blob_start = pos
+
+    @property
+    def signature(self) -> str:
+        return self.meta['signature']
+
+    def __len__(self) -> int:
+        return self.meta['num_chunks']
+
+    def get_text(self, i: int) -> str:
+        start = self._blob_start + int(self.offsets[i])
+        end = self._blob_start + int(self.offsets[i + 1])
+        return self._mm[start:end].decode('utf-8')
+
+    def get_texts(self) -> List[str]:
+        return [self.get_text(i) for i in range(len(self))]
+
+    def close(self):
+        # The numpy views must be released before the mmap can be closed
+        self.offsets = self.tokens = None
+        self._mm.close()
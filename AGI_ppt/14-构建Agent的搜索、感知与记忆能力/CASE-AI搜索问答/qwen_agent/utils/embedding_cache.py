@@ -0,0 +1,162 @@
+# Copyright 2023 The Qwen team, Alibaba Group. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+from qwen_agent.settings import (DEFAULT_QUERY_EMBEDDING_CACHE_PATH, DEFAULT_QUERY_EMBEDDING_CACHE_SIZE,
+                                 DEFAULT_QUERY_EMBEDDING_CACHE_TTL)
+
+_TRAILING_PUNCTS = ' ?!.,;:~。，、；：？！…'
+
+
+def normalize_query(text: str) -> str:
+    """NFKC, collapse the whitespaces, lowercase, and strip the trailing punctuations"""
+    text = unicodedata.normalize('NFKC', text)
+    text = ' '.join(text.split()).lower()
+    return text.rstrip(_TRAILING_PUNCTS)
+
+
+class EmbeddingCache:
+    """An LRU + TTL cache of query embeddings, with an optional sqlite disk tier
+
+    The key is the namespace (the embedding model, whose vectors must not be mixed) and the normalized query,
+    so the repeated questions that only differ in whitespaces, cases, full/half width forms or trailing
+    punctuations share one embedding. The vectors are returned as read-only float32 numpy arrays.
+    The failed embeddings (None or empty) are not cached.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: Optional[float] = 24 * 3600, disk_path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expiry time, vector)
+        self._db = None
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._db.execute('CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, created REAL)')
+        self.reset_stats()
+
+    @staticmethod
+    def make_key(text: str, namespace: str = '') -> str:
+        return hashlib.sha256(f'{namespace}\0{normalize_query(text)}'.encode('utf-8')).hexdigest()
+
+    def get(self, text: str, namespace: str = '') -> Optional[np.ndarray]:
+        key = self.make_key(text, namespace)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
+
+            if self._db is not None:
+                row = self._db.execute('SELECT vector, created FROM embeddings WHERE key = ?', (key, )).fetchone()
+                if row is not None:
+                    expires_at = self._expires_at(row[1])
+                    if expires_at > now:
+                        vector = np.frombuffer(row[0], dtype=np.float32)
+                        self._put_memory(key, vector, expires_at)
+                        self.disk_hits += 1
+                        return vector
+                    self._db.execute('DELETE FROM embeddings WHERE key = ?', (key, ))
+                    self.expirations += 1
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vector, namespace: str = '') -> np.ndarray:
+        key = self.make_key(text, namespace)
+        vector = np.array(vector, dtype=np.float32)
+        vector.flags.writeable = False
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, vector, self._expires_at(now))
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO embeddings (key, vector, created) VALUES (?, ?, ?)',
+                                 (key, vector.tobytes(), now))
+        return vector
+
+    def get_or_compute(self, text: str, compute: Callable[[str], object], namespace: str = ''):
+        """Return the cached vector, or compute and cache it on a miss"""
+        vector = self.get(text, namespace)
+        if vector is not None:
+            return vector
+        vector = compute(text)
+        if vector is None or len(vector) == 0:
+            return vector
+        return self.put(text, vector, namespace)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / total if total else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'size': len(self._entries),
+            }
+
+    def reset_stats(self):
+        self.hits = self.disk_hits = self.misses = self.evictions = self.expirations = 0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM embeddings')
+
+    def _expires_at(self, created: float) -> float:
+        return created + self.ttl if self.ttl is not None else float('inf')
+
+    def _put_memory(self, key: str, vector: np.ndarray, expires_at: float):
+        self._entries[key] = (expires_at, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> EmbeddingCache:
+    """The process-wide query embedding cache shared by the retrievers"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                ttl = DEFAULT_QUERY_EMBEDDING_CACHE_TTL
+                _default_cache = EmbeddingCache(max_size=DEFAULT_QUERY_EMBEDDING_CACHE_SIZE,
+                                                ttl=ttl if ttl > 0 else None,
+                                                disk_path=DEFAULT_QUERY_EMBEDDING_CACHE_PATH or None)
+    return _default_cache
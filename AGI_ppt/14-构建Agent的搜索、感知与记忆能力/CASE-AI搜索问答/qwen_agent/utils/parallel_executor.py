@@ -12,10 +12,175 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import random
+import asyncio
+import inspect
+import os
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Any, Callable, List, Optional
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class TaskTimeoutError(TimeoutError):
+    """The task did not finish within the per-task timeout"""
+
+    def __init__(self, index: int, timeout: float):
+        super().__init__(f'Task {index} did not finish in {timeout} seconds')
+        self.index = index
+        self.timeout = timeout
+
+
+class TokenBucket:
+    """A token bucket that limits the rate of calls, e.g., the QPS of an LLM service
+
+    One bucket can be shared by all the executors (and both backends) calling the same service.
+    A caller reserves its token immediately and then waits until the token is due, so the callers are served
+    in arrival order and nobody waits longer than necessary.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate: The tokens added per second, i.e., the sustained calls per second.
+            capacity: The size of the bucket, i.e., the calls allowed in a burst. Defaults to max(1, rate).
+        """
+        if rate <= 0:
+            raise ValueError(f'The rate of a token bucket must be positive, but got {rate}')
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float) -> float:
+        """Take the tokens, which may be owed, and return the seconds until they are due"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self, tokens: float = 1):
+        delay = self._reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def aacquire(self, tokens: float = 1):
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def iter_parallel_exec(
+    fn: Callable,
+    list_of_kwargs: Iterable[dict],
+    max_workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    timeout: Optional[float] = None,
+    stop_when: Optional[Callable[[int, Any], bool]] = None,
+    return_exceptions: bool = False,
+) -> Iterator[Tuple[int, Any]]:
+    """
+    Executes `fn` on threads and yields (the index in `list_of_kwargs`, the result) as soon as each task completes.
+
+    `list_of_kwargs` is consumed lazily: a task is only taken and submitted when fewer than `max_in_flight` tasks
+    are pending, so it can be a generator that decides which task comes next based on the results so far.
+
+    Args:
+    - fn (Callable): The function to execute in parallel.
+    - list_of_kwargs (Iterable): The dicts of arguments, one for each call to `fn`.
+    - max_workers (int, optional): The number of threads. Defaults to that of `ThreadPoolExecutor`.
+    - max_in_flight (int, optional): The maximum number of submitted but unfinished tasks. Defaults to `max_workers`.
+    - rate_limiter (TokenBucket, optional): Each task takes a token before calling `fn`.
+    - timeout (float, optional): The per-task timeout in seconds, counted from when `fn` is called. A timed out task
+      is reported as `TaskTimeoutError` at once. Threads can not be interrupted, so it keeps its thread (and its
+      in-flight slot) until `fn` returns, and the result is discarded.
+    - stop_when (Callable, optional): Called with (index, result) for each successful task. Once it returns True,
+      no more tasks are started, the queued ones are cancelled, and the running ones are no longer waited for.
+    - return_exceptions (bool): If True, the exception of a failed task is yielded as its result. Otherwise it is
+      raised, and the rest of the tasks are cancelled like `stop_when`.
+
+    Yields:
+    - (index, result) in the order the tasks complete.
+    """
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+    max_in_flight = max_in_flight or max_workers
+    stop_event = threading.Event()
+    started_at: Dict[int, float] = {}
+
+    def _run(index: int, kwargs: dict):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        if stop_event.is_set():
+            return None
+        started_at[index] = time.monotonic()
+        return fn(**kwargs)
+
+    tasks = enumerate(list_of_kwargs)
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='parallel_exec')
+    pending: Dict[Future, int] = {}
+    timed_out = set()
+    exhausted = False
+    try:
+        while not stop_event.is_set():
+            # The timed out tasks give back their in-flight slots when they actually finish
+            for future in [f for f, index in pending.items() if index in timed_out and f.done()]:
+                del pending[future]
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    index, kwargs = next(tasks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(_run, index, kwargs)] = index
+
+            waiting = [future for future, index in pending.items() if index not in timed_out]
+            if not waiting:
+                if exhausted:
+                    break
+                # All the slots are held by timed out tasks
+                wait(list(pending), return_when=FIRST_COMPLETED)
+                continue
+
+            wait_timeout = None
+            if timeout is not None:
+                now = time.monotonic()
+                deadlines = [started_at[pending[f]] + timeout for f in waiting if pending[f] in started_at]
+                # The tasks that have not started yet are checked again at least every `timeout` seconds
+                wait_timeout = max(0.0, min(deadlines, default=now + timeout) - now)
+            done, _ = wait(waiting, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    yield index, e
+                    continue
+                yield index, result
+                if stop_when is not None and stop_when(index, result):
+                    stop_event.set()
+                    break
+
+            if timeout is not None and not stop_event.is_set():
+                now = time.monotonic()
+                for future, index in list(pending.items()):
+                    if index in timed_out or index not in started_at or future.done():
+                        continue
+                    if now - started_at[index] >= timeout:
+                        timed_out.add(index)
+                        error = TaskTimeoutError(index, timeout)
+                        if not return_exceptions:
+                            raise error
+                        yield index, error
+    finally:
+        # Also reached when the consumer stops iterating early
+        stop_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 def parallel_exec(
@@ -23,34 +188,123 @@ def parallel_exec(
     list_of_kwargs: List[dict],
     max_workers: Optional[int] = None,
     jitter: float = 0.0,
+    max_in_flight: Optional[int] = None,
+    rate_limiter: Optional[TokenBucket] = None,
+    timeout: Optional[float] = None,
 ) -> list:
     """
-    Executes a given function `fn` in parallel, using multiple threads, on a list of argument tuples.
-    The function limits the number of concurrent executions to `max_workers` and processes tasks in chunks,
-    pausing between each chunk to avoid hitting rate limits or quotas.
+    Executes a given function `fn` in parallel, using multiple threads, on a list of argument dicts.
+    See `iter_parallel_exec` for the arguments, and for consuming the results as they complete.
 
     Args:
-    - fn (Callable): The function to execute in parallel.
-    - list_of_kwargs (list): A list of dicts, where each dict contains arguments for a single call to `fn`.
-    - max_workers (int, optional): The maximum number of threads that can be used to execute the tasks
-      concurrently.
-    - jitter (float, optional): Wait for jitter * random.random() before submitting the next job.
+    - jitter (float, optional): Kept for compatibility. The tasks used to be submitted `jitter * random.random()`
+      seconds apart, which is now a token bucket of the same average rate (2 / jitter per second), so that
+      no thread sleeps between submissions. Ignored if `rate_limiter` is given.
 
     Returns:
-    - A list containing the results of the function calls. The order of the results corresponds to the order
-      the tasks were completed, which may not necessarily be the same as the order of `list_of_kwargs`.
+    - A list containing the results of the function calls, in the order of `list_of_kwargs`.
+      A task that fails or times out raises its exception.
+    """
+    if rate_limiter is None and jitter > 0.0:
+        rate_limiter = TokenBucket(rate=2 / jitter, capacity=1)
+    results: List[Any] = [None] * len(list_of_kwargs)
+    for index, result in iter_parallel_exec(fn,
+                                            list_of_kwargs,
+                                            max_workers=max_workers,
+                                            max_in_flight=max_in_flight,
+                                            rate_limiter=rate_limiter,
+                                            timeout=timeout):
+        results[index] = result
+    return results
+
 
+async def aiter_parallel_exec(
+    fn: Callable,
+    list_of_kwargs: Iterable[dict],
+    max_in_flight: int = 32,
+    rate_limiter: Optional[TokenBucket] = None,
+    timeout: Optional[float] = None,
+    stop_when: Optional[Callable[[int, Any], bool]] = None,
+    return_exceptions: bool = False,
+) -> AsyncIterator[Tuple[int, Any]]:
     """
-    results = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Get the tasks for the current chunk
-        futures = []
-        for kwargs in list_of_kwargs:
-            futures.append(executor.submit(fn, **kwargs))
-            if jitter > 0.0:
-                time.sleep(jitter * random.random())
-        for future in as_completed(futures):
-            results.append(future.result())
+    The asyncio backend of `iter_parallel_exec`, for I/O bound tasks such as `BaseChatModel.achat`.
+
+    `fn` is either a coroutine function, or a plain function that is run by `asyncio.to_thread`.
+    A timed out task frees its in-flight slot at once, and the pending tasks are cancelled once `stop_when`
+    is met. Unlike threads, a coroutine `fn` is really interrupted in both cases.
+
+    Yields:
+    - (index, result) in the order the tasks complete.
+    """
+    is_coroutine = inspect.iscoroutinefunction(fn)
+
+    async def _run(kwargs: dict):
+        if rate_limiter is not None:
+            await rate_limiter.aacquire()
+        call = fn(**kwargs) if is_coroutine else asyncio.to_thread(fn, **kwargs)
+        if timeout is None:
+            return await call
+        return await asyncio.wait_for(call, timeout)
+
+    tasks = enumerate(list_of_kwargs)
+    pending: Dict[asyncio.Task, int] = {}
+    try:
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    index, kwargs = next(tasks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[asyncio.ensure_future(_run(kwargs))] = index
+            if not pending:
+                break
+
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            stop = False
+            for task in done:
+                index = pending.pop(task)
+                try:
+                    result = task.result()
+                except asyncio.TimeoutError:
+                    result = TaskTimeoutError(index, timeout)
+                    if not return_exceptions:
+                        raise result
+                    yield index, result
+                    continue
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    yield index, e
+                    continue
+                yield index, result
+                if stop_when is not None and stop_when(index, result):
+                    stop = True
+                    break
+            if stop:
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def aparallel_exec(
+    fn: Callable,
+    list_of_kwargs: List[dict],
+    max_in_flight: int = 32,
+    rate_limiter: Optional[TokenBucket] = None,
+    timeout: Optional[float] = None,
+) -> list:
+    """The asyncio backend of `parallel_exec`, the results are in the order of `list_of_kwargs`"""
+    results: List[Any] = [None] * len(list_of_kwargs)
+    async for index, result in aiter_parallel_exec(fn,
+                                                   list_of_kwargs,
+                                                   max_in_flight=max_in_flight,
+                                                   rate_limiter=rate_limiter,
+                                                   timeout=timeout):
+        results[index] = result
     return results
 
 
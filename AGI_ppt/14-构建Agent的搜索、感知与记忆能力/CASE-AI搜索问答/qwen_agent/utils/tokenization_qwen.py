@@ -15,13 +15,16 @@
 """Tokenization classes for QWen."""
 
 import base64
+import hashlib
+import os
+import pickle
+import threading
 import unicodedata
 from pathlib import Path
-from typing import Collection, Dict, List, Set, Union
-
-import tiktoken
+from typing import Collection, Dict, List, Optional, Set, Union
 
 from qwen_agent.log import logger
+from qwen_agent.settings import DEFAULT_TOKEN_COUNTER, DEFAULT_TOKENIZER_CACHE_DIR
 
 VOCAB_FILES_NAMES = {'vocab_file': 'qwen.tiktoken'}
 
@@ -46,13 +49,45 @@ SPECIAL_TOKENS = tuple(enumerate(
 SPECIAL_TOKENS_SET = set(t for i, t in SPECIAL_TOKENS)
 
 
+_BPE_CACHE_VERSION = 1
+
+
+def _get_bpe_cache_file(tiktoken_bpe_file: str) -> str:
+    path = os.path.abspath(tiktoken_bpe_file)
+    key = hashlib.sha256(path.encode()).hexdigest()[:16]
+    return os.path.join(DEFAULT_TOKENIZER_CACHE_DIR, f'{os.path.basename(path)}.{key}.pkl')
+
+
 def _load_tiktoken_bpe(tiktoken_bpe_file: str) -> Dict[bytes, int]:
+    # Base64-decoding the whole vocabulary is slow, so the decoded ranks are cached as a pickle,
+    # which is rebuilt when the vocabulary file changes
+    stat = os.stat(tiktoken_bpe_file)
+    source = (_BPE_CACHE_VERSION, stat.st_size, stat.st_mtime_ns)
+    cache_file = _get_bpe_cache_file(tiktoken_bpe_file)
+    try:
+        with open(cache_file, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['source'] == source:
+            return cached['mergeable_ranks']
+    except Exception:
+        pass
+
     with open(tiktoken_bpe_file, 'rb') as f:
         contents = f.read()
-    return {
+    mergeable_ranks = {
         base64.b64decode(token): int(rank) for token, rank in (line.split() for line in contents.splitlines() if line)
     }
 
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump({'source': source, 'mergeable_ranks': mergeable_ranks}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as ex:
+        logger.debug(f'Failed to cache the vocabulary of {tiktoken_bpe_file}: {ex}')
+    return mergeable_ranks
+
 
 class QWenTokenizer:
     """QWen tokenizer."""
@@ -90,6 +125,7 @@ class QWenTokenizer:
                 self.mergeable_ranks[token] = index
             # the index may be sparse after this, but don't worry tiktoken.Encoding will handle this
 
+        import tiktoken
         enc = tiktoken.Encoding(
             'Qwen',
             pat_str=PAT_STR,
@@ -117,6 +153,7 @@ class QWenTokenizer:
 
     def __setstate__(self, state):
         # tokenizer is not python native; don't pass it; rebuild it
+        import tiktoken
         self.__dict__.update(state)
         enc = tiktoken.Encoding(
             'Qwen',
@@ -216,7 +253,9 @@ class QWenTokenizer:
         return self.convert_tokens_to_ids(self.tokenize(text))
 
     def count_tokens(self, text: str) -> int:
-        return len(self.tokenize(text))
+        # Same as len(self.tokenize(text)), without mapping the ids to the surface forms
+        text = unicodedata.normalize('NFC', text)
+        return len(self.tokenizer.encode(text, allowed_special='all', disallowed_special=()))
 
     def truncate(self, text: str, max_token: int, start_token: int = 0, keep_both_sides: bool = False) -> str:
         token_list = self.tokenize(text)[start_token:]
@@ -239,8 +278,93 @@ class QWenTokenizer:
         return self.convert_tokens_to_string(token_list)
 
 
-tokenizer = QWenTokenizer(Path(__file__).resolve().parent / 'qwen.tiktoken')
+class LazyQWenTokenizer:
+    """Build the QWenTokenizer on first use, so importing qwen_agent does not pay for loading the vocabulary"""
+
+    def __init__(self, vocab_file=None, **kwargs):
+        self._vocab_file = vocab_file
+        self._kwargs = kwargs
+        self._tokenizer: Optional[QWenTokenizer] = None
+        self._lock = threading.Lock()
+
+    def get_tokenizer(self) -> QWenTokenizer:
+        if self._tokenizer is None:
+            with self._lock:
+                if self._tokenizer is None:
+                    self._tokenizer = QWenTokenizer(self._vocab_file, **self._kwargs)
+        return self._tokenizer
+
+    def __getattr__(self, name: str):
+        if name in ('_vocab_file', '_kwargs', '_tokenizer', '_lock'):
+            # Not initialized, e.g., when being copied
+            raise AttributeError(name)
+        return getattr(self.get_tokenizer(), name)
+
+    def __len__(self) -> int:
+        return len(self.get_tokenizer())
+
+
+tokenizer = LazyQWenTokenizer(Path(__file__).resolve().parent / 'qwen.tiktoken')
+
+
+# The approximate token counter estimates the tokens by the number of characters of each kind.
+# The coefficients are fitted on our mixed Chinese/English docs and code by `benchmark_token_counter.py --fit`.
+# On the held-out data, 99% of the estimates are within APPROX_TOKEN_ERROR_RATE * estimate + APPROX_TOKEN_ERROR_SLACK
+# of the exact count, and the error of the total over many texts is below 1%. The bound is statistical, not
+# guaranteed: the rare text it misses may be kept or cut by its estimate where the exact count decides otherwise.
+APPROX_TOKENS_PER_CHAR = {
+    'wide': 0.64,  # CJK and other multi-byte characters
+    'letter': 0.194,  # ASCII letters and the other ASCII characters not listed below
+    'newline': 0.84,
+    'digit': 1.365,
+    'punct': 0.676,
+}
+APPROX_TOKEN_ERROR_RATE = 0.25
+APPROX_TOKEN_ERROR_SLACK = 8
+
+# Appended to the names of the caches that store token counts, so that switching DEFAULT_TOKEN_COUNTER re-chunks the
+# docs instead of serving the counts of one counter as those of the other. Empty for the exact counts of older caches.
+TOKEN_COUNTER_CACHE_TAG = '_approx' if DEFAULT_TOKEN_COUNTER == 'approx' else ''
+
+_DIGITS = b'0123456789'
+_PUNCTS = b'.,:;!?()[]{}<>"\'`=+-*/\\|_#@$%^&~'
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens without running BPE, which is over 10 times faster than counting exactly"""
+    data = text.encode('utf-8')
+    num_bytes = len(data)
+    num_wide = (num_bytes - len(text)) / 2  # The CJK characters take 3 bytes in utf-8
+    num_newline = data.count(b'\n')
+    num_digit = num_bytes - len(data.translate(None, _DIGITS))
+    num_punct = num_bytes - len(data.translate(None, _PUNCTS))
+    num_letter = len(text) - num_wide - data.count(b' ') - num_newline - num_digit - num_punct
+    estimate = (APPROX_TOKENS_PER_CHAR['wide'] * num_wide + APPROX_TOKENS_PER_CHAR['letter'] * num_letter +
+                APPROX_TOKENS_PER_CHAR['newline'] * num_newline + APPROX_TOKENS_PER_CHAR['digit'] * num_digit +
+                APPROX_TOKENS_PER_CHAR['punct'] * num_punct)
+    return int(estimate + 0.5)
+
+
+def approx_token_margin(token: int) -> float:
+    """The error bound of a token count from `count_tokens` for about 99% of texts, which is 0 when counting exactly"""
+    if DEFAULT_TOKEN_COUNTER == 'approx':
+        return APPROX_TOKEN_ERROR_RATE * token + APPROX_TOKEN_ERROR_SLACK
+    return 0
 
 
 def count_tokens(text: str) -> int:
+    """Count the tokens by the counter configured by DEFAULT_TOKEN_COUNTER"""
+    if DEFAULT_TOKEN_COUNTER == 'approx':
+        return estimate_tokens(text)
     return tokenizer.count_tokens(text)
+
+
+def refine_token_count(text: str, token: int, budget: int) -> int:
+    """Replace the token count from `count_tokens` by the exact one, if it is within the error bound of the budget
+
+    The counts outside the bound are kept as estimated, so they decide the same as the exact ones for nearly all texts.
+    """
+    margin = approx_token_margin(token)
+    if margin and token - margin <= budget < token + margin:
+        return tokenizer.count_tokens(text)
+    return token
@@ -211,15 +211,17 @@ def save_text_to_file(path: str, text: str) -> None:
         fp.write(text)
 
 
-def read_text_from_file(path: str) -> str:
+def read_text_from_file(path: str, max_chars: Optional[int] = None) -> str:
     try:
         with open(path, 'r', encoding='utf-8') as file:
-            file_content = file.read()
+            file_content = file.read() if max_chars is None else file.read(max_chars)
     except UnicodeDecodeError:
         print_traceback(is_error=False)
         from charset_normalizer import from_path
         results = from_path(path)
         file_content = str(results.best())
+        if max_chars is not None:
+            file_content = file_content[:max_chars]
     return file_content
 
 
@@ -256,9 +258,9 @@ def get_file_type(path: str) -> Literal['pdf', 'docx', 'pptx', 'txt', 'html', 'c
         # because the file downloaded by the request may contain html tags
         return 'html'
     else:
-        # Determine by reading local HTML file
+        # Determine by reading the beginning of local HTML file
         try:
-            content = read_text_from_file(path)
+            content = read_text_from_file(path, max_chars=1024 * 1024)
         except Exception:
             print_traceback()
             return 'unk'
@@ -11,6 +11,7 @@ import faiss
 import dashscope
 from http import HTTPStatus
 from openai import OpenAI
+from embedding_cache import get_default_cache
 
 # 配置
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
@@ -44,7 +45,11 @@ def load_index():
 
 
 def get_text_embedding(text):
-    """文本embedding"""
+    """文本embedding，重复的查询直接复用缓存的向量"""
+    return get_default_cache().get_or_compute(text, _compute_text_embedding, namespace=MULTIMODAL_EMBEDDING_MODEL)
+
+
+def _compute_text_embedding(text):
     resp = dashscope.MultiModalEmbedding.call(
         model=MULTIMODAL_EMBEDDING_MODEL,
         input=[{'text': text}]
@@ -189,6 +194,8 @@ if __name__ == "__main__":
     # print("\n" + "="*60)
     # print("测试3: 视频查询 - 汽车剐蹭")
     rag_ask("我的汽车被剐蹭了，你能看到视频么？", index, metadata, k=3)
+
+    print(f"\n查询向量缓存: {get_default_cache().stats()}")
     #
     # print("\n" + "="*60)
     # print("测试4: 图片查询 - 聚在一起")
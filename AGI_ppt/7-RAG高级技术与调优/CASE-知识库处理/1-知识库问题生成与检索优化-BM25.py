@@ -2,11 +2,10 @@
 # 导入依赖库
 import os
 import json
-import numpy as np
 from openai import OpenAI
 import pandas as pd
 from datetime import datetime
-from rank_bm25 import BM25Okapi
+from sparse_bm25 import SparseBM25, top_k_indices
 import jieba
 import re
 
@@ -175,13 +174,13 @@ class KnowledgeBaseOptimizer:
         
         # 创建BM25索引
         if content_documents:
-            self.content_bm25 = BM25Okapi(content_documents)
+            self.content_bm25 = SparseBM25(content_documents)
             self.content_documents = content_documents
             self.content_metadata = content_metadata
             print(f"原文索引构建完成，共索引 {len(content_documents)} 个知识切片")
         
         if question_documents:
-            self.question_bm25 = BM25Okapi(question_documents)
+            self.question_bm25 = SparseBM25(question_documents)
             self.question_documents = question_documents
             self.question_metadata = question_metadata
             print(f"问题索引构建完成，共索引 {len(question_documents)} 个问题")
@@ -215,7 +214,7 @@ class KnowledgeBaseOptimizer:
             scores = bm25.get_scores(query_words)
             
             # 获取top-k结果
-            top_indices = np.argsort(scores)[::-1][:k]
+            top_indices = top_k_indices(scores, k)
             
             results = []
             for idx in top_indices:
@@ -245,11 +244,11 @@ class KnowledgeBaseOptimizer:
                 return 0.0
             
             # 创建临时BM25索引
-            temp_bm25 = BM25Okapi([chunk_words])
+            temp_bm25 = SparseBM25([chunk_words])
             scores = temp_bm25.get_scores(query_words)
             
             # 返回最高分数并归一化
-            max_score = max(scores) if scores else 0.0
+            max_score = scores.max() if len(scores) else 0.0
             return min(1.0, max_score / 10.0)
             
         except Exception as e:
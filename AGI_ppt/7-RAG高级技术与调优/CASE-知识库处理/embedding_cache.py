@@ -0,0 +1,153 @@
+"""
+embedding_cache - 查询向量缓存
+
+重复的问题，以及只差空白、大小写、全/半角和句末标点的问题，直接复用之前的查询向量，不再请求 embedding 服务：
+    cache = EmbeddingCache(max_size=10000, ttl=24 * 3600, disk_path='cache/query_embeddings.sqlite')
+    vec = cache.get_or_compute(question, get_text_embedding, namespace='text-embedding-v4')
+    cache.stats()  # {'hits': 12, 'disk_hits': 3, 'misses': 5, 'hit_rate': 0.75, ...}
+
+- 键: namespace（模型名，不同模型的向量不能混用）+ 归一化后的文本
+- 内存层: LRU，超过 max_size 时淘汰最久未使用的条目，每个条目写入 ttl 秒后过期（ttl=None 不过期）
+- 磁盘层（可选）: sqlite，进程重启后仍可命中，同样按写入时间过期
+- 返回只读的 float32 numpy 数组；embedding 失败（返回 None 或空）时不缓存
+get_default_cache() 返回进程内共享的缓存，由环境变量 EMBEDDING_CACHE_SIZE / EMBEDDING_CACHE_TTL /
+EMBEDDING_CACHE_PATH 配置容量、过期秒数和磁盘路径（不设置 EMBEDDING_CACHE_PATH 时只用内存）。
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+_TRAILING_PUNCTS = ' ?!.,;:~。，、；：？！…'
+
+
+def normalize_query(text: str) -> str:
+    """NFKC（全角转半角）、合并连续空白、英文转小写、去掉句末标点"""
+    text = unicodedata.normalize('NFKC', text)
+    text = ' '.join(text.split()).lower()
+    return text.rstrip(_TRAILING_PUNCTS)
+
+
+class EmbeddingCache:
+
+    def __init__(self, max_size: int = 10000, ttl: Optional[float] = 24 * 3600, disk_path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (过期时间, 向量)
+        self._db = None
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._db.execute('CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, created REAL)')
+        self.reset_stats()
+
+    @staticmethod
+    def make_key(text: str, namespace: str = '') -> str:
+        return hashlib.sha256(f'{namespace}\0{normalize_query(text)}'.encode('utf-8')).hexdigest()
+
+    def get(self, text: str, namespace: str = '') -> Optional[np.ndarray]:
+        key = self.make_key(text, namespace)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
+
+            if self._db is not None:
+                row = self._db.execute('SELECT vector, created FROM embeddings WHERE key = ?', (key, )).fetchone()
+                if row is not None:
+                    expires_at = self._expires_at(row[1])
+                    if expires_at > now:
+                        vector = np.frombuffer(row[0], dtype=np.float32)
+                        self._put_memory(key, vector, expires_at)
+                        self.disk_hits += 1
+                        return vector
+                    self._db.execute('DELETE FROM embeddings WHERE key = ?', (key, ))
+                    self.expirations += 1
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vector, namespace: str = '') -> np.ndarray:
+        key = self.make_key(text, namespace)
+        vector = np.array(vector, dtype=np.float32)
+        vector.flags.writeable = False
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, vector, self._expires_at(now))
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO embeddings (key, vector, created) VALUES (?, ?, ?)',
+                                 (key, vector.tobytes(), now))
+        return vector
+
+    def get_or_compute(self, text: str, compute: Callable[[str], object], namespace: str = ''):
+        """命中时返回缓存的向量，否则调用 compute(text) 生成并写入缓存"""
+        vector = self.get(text, namespace)
+        if vector is not None:
+            return vector
+        vector = compute(text)
+        if vector is None or len(vector) == 0:
+            return vector
+        return self.put(text, vector, namespace)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / total if total else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'size': len(self._entries),
+            }
+
+    def reset_stats(self):
+        self.hits = self.disk_hits = self.misses = self.evictions = self.expirations = 0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM embeddings')
+
+    def _expires_at(self, created: float) -> float:
+        return created + self.ttl if self.ttl is not None else float('inf')
+
+    def _put_memory(self, key: str, vector: np.ndarray, expires_at: float):
+        self._entries[key] = (expires_at, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> EmbeddingCache:
+    """进程内共享的查询向量缓存，所有检索器默认使用它"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                ttl = float(os.getenv('EMBEDDING_CACHE_TTL', 24 * 3600))
+                _default_cache = EmbeddingCache(max_size=int(os.getenv('EMBEDDING_CACHE_SIZE', 10000)),
+                                                ttl=ttl if ttl > 0 else None,
+                                                disk_path=os.getenv('EMBEDDING_CACHE_PATH') or None)
+    return _default_cache
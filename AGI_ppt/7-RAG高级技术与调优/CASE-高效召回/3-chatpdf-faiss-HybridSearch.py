@@ -4,9 +4,8 @@ from langchain_community.embeddings import DashScopeEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_community.llms import Tongyi
 from langchain_core.documents import Document
-from rank_bm25 import BM25Okapi
+from hybrid_search import HybridRetriever
 from typing import List, Tuple, Set
-import jieba
 import os
 import pickle
 
@@ -29,80 +28,6 @@ def extract_text_with_page_numbers(pdf) -> Tuple[str, List[int]]:
 
     return text, page_numbers
 
-def tokenize_chinese(text: str) -> List[str]:
-    """中文分词"""
-    return list(jieba.cut(text))
-
-class HybridRetriever:
-    """混合检索器: BM25 + Vector"""
-
-    def __init__(self, chunks: List[str], vectorstore: FAISS, alpha: float = 0.5):
-        """
-        初始化混合检索器
-
-        参数:
-            chunks: 文本块列表
-            vectorstore: FAISS向量存储
-            alpha: 向量检索权重 (0-1), BM25权重为 1-alpha
-        """
-        self.chunks = chunks
-        self.vectorstore = vectorstore
-        self.alpha = alpha
-
-        # 构建BM25索引
-        tokenized_chunks = [tokenize_chinese(chunk) for chunk in chunks]
-        self.bm25 = BM25Okapi(tokenized_chunks)
-
-        # 构建chunk到索引的映射
-        self.chunk_to_idx = {chunk: idx for idx, chunk in enumerate(chunks)}
-
-    def search(self, query: str, k: int = 4) -> List[Document]:
-        """
-        执行混合检索
-
-        参数:
-            query: 查询文本
-            k: 返回结果数量
-        """
-        # BM25检索
-        tokenized_query = tokenize_chinese(query)
-        bm25_scores = self.bm25.get_scores(tokenized_query)
-
-        # 归一化BM25分数
-        max_bm25 = max(bm25_scores) if max(bm25_scores) > 0 else 1
-        bm25_scores_normalized = [s / max_bm25 for s in bm25_scores]
-
-        # 向量检索 (获取更多结果用于融合)
-        vector_results = self.vectorstore.similarity_search_with_score(query, k=len(self.chunks))
-
-        # 构建向量分数字典 (距离越小越好，转换为分数)
-        vector_scores = {}
-        max_distance = max(score for _, score in vector_results) if vector_results else 1
-        for doc, distance in vector_results:
-            idx = self.chunk_to_idx.get(doc.page_content)
-            if idx is not None:
-                # 距离转分数: 1 - (distance / max_distance)
-                vector_scores[idx] = 1 - (distance / max_distance) if max_distance > 0 else 0
-
-        # 融合分数
-        hybrid_scores = []
-        for idx in range(len(self.chunks)):
-            bm25_score = bm25_scores_normalized[idx]
-            vector_score = vector_scores.get(idx, 0)
-            combined = self.alpha * vector_score + (1 - self.alpha) * bm25_score
-            hybrid_scores.append((idx, combined))
-
-        # 排序并返回top-k
-        hybrid_scores.sort(key=lambda x: x[1], reverse=True)
-        top_k = hybrid_scores[:k]
-
-        results = []
-        for idx, score in top_k:
-            doc = Document(page_content=self.chunks[idx], metadata={"hybrid_score": score})
-            results.append(doc)
-
-        return results
-
 def process_text_with_splitter(text: str, page_numbers: List[int], save_path: str = None) -> Tuple[FAISS, List[str]]:
     """处理文本并创建向量存储，同时返回chunks用于BM25"""
     text_splitter = RecursiveCharacterTextSplitter(
@@ -4,11 +4,9 @@ from langchain_community.embeddings import DashScopeEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_community.llms import Tongyi
 from langchain_core.documents import Document
-from rank_bm25 import BM25Okapi
-from modelscope import AutoModelForSequenceClassification, AutoTokenizer, snapshot_download
+from hybrid_search import HybridRetriever
+from cross_encoder_reranker import CrossEncoderReranker, get_reranker
 from typing import List, Tuple, Set
-import jieba
-import torch
 import os
 import pickle
 
@@ -35,132 +33,6 @@ def extract_text_with_page_numbers(pdf) -> Tuple[str, List[int]]:
 
     return text, page_numbers
 
-def tokenize_chinese(text: str) -> List[str]:
-    """中文分词"""
-    return list(jieba.cut(text))
-
-class Reranker:
-    """基于ModelScope的Rerank模型"""
-
-    def __init__(self, model_name: str = "BAAI/bge-reranker-base", cache_dir: str = "./models"):
-        """
-        初始化Reranker
-
-        参数:
-            model_name: ModelScope上的模型名称
-                - BAAI/bge-reranker-base (轻量级，推荐)
-                - BAAI/bge-reranker-large (效果更好，但更慢)
-            cache_dir: 模型缓存目录，默认为当前目录下的 ./models
-        """
-        print(f"正在加载Rerank模型: {model_name}")
-        print(f"模型缓存目录: {cache_dir}")
-        os.makedirs(cache_dir, exist_ok=True)
-
-        # 先下载模型到指定目录
-        model_dir = snapshot_download(model_name, cache_dir=cache_dir)
-        print(f"模型已下载到: {model_dir}")
-
-        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
-        self.model = AutoModelForSequenceClassification.from_pretrained(model_dir)
-        self.model.eval()
-
-        # 使用GPU如果可用
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model.to(self.device)
-        print(f"Rerank模型已加载，使用设备: {self.device}")
-
-    def rerank(self, query: str, documents: List[Document], top_k: int = None) -> List[Document]:
-        """
-        对文档进行重排序
-
-        参数:
-            query: 查询文本
-            documents: 待排序的文档列表
-            top_k: 返回前k个结果，None表示返回全部
-        """
-        if not documents:
-            return []
-
-        # 构建query-document对
-        pairs = [[query, doc.page_content] for doc in documents]
-
-        # 批量计算分数
-        with torch.no_grad():
-            inputs = self.tokenizer(
-                pairs,
-                padding=True,
-                truncation=True,
-                max_length=512,
-                return_tensors="pt"
-            ).to(self.device)
-
-            scores = self.model(**inputs).logits.squeeze(-1).cpu().tolist()
-
-        # 如果只有一个文档，scores可能是float而不是list
-        if isinstance(scores, float):
-            scores = [scores]
-
-        # 为每个文档添加rerank分数
-        scored_docs = list(zip(documents, scores))
-        scored_docs.sort(key=lambda x: x[1], reverse=True)
-
-        # 更新metadata中的分数
-        results = []
-        for doc, score in scored_docs:
-            doc.metadata["rerank_score"] = score
-            results.append(doc)
-
-        if top_k:
-            results = results[:top_k]
-
-        return results
-
-class HybridRetriever:
-    """混合检索器: BM25 + Vector"""
-
-    def __init__(self, chunks: List[str], vectorstore: FAISS, alpha: float = 0.5):
-        self.chunks = chunks
-        self.vectorstore = vectorstore
-        self.alpha = alpha
-
-        tokenized_chunks = [tokenize_chinese(chunk) for chunk in chunks]
-        self.bm25 = BM25Okapi(tokenized_chunks)
-        self.chunk_to_idx = {chunk: idx for idx, chunk in enumerate(chunks)}
-
-    def search(self, query: str, k: int = 4) -> List[Document]:
-        """执行混合检索"""
-        tokenized_query = tokenize_chinese(query)
-        bm25_scores = self.bm25.get_scores(tokenized_query)
-
-        max_bm25 = max(bm25_scores) if max(bm25_scores) > 0 else 1
-        bm25_scores_normalized = [s / max_bm25 for s in bm25_scores]
-
-        vector_results = self.vectorstore.similarity_search_with_score(query, k=len(self.chunks))
-
-        vector_scores = {}
-        max_distance = max(score for _, score in vector_results) if vector_results else 1
-        for doc, distance in vector_results:
-            idx = self.chunk_to_idx.get(doc.page_content)
-            if idx is not None:
-                vector_scores[idx] = 1 - (distance / max_distance) if max_distance > 0 else 0
-
-        hybrid_scores = []
-        for idx in range(len(self.chunks)):
-            bm25_score = bm25_scores_normalized[idx]
-            vector_score = vector_scores.get(idx, 0)
-            combined = self.alpha * vector_score + (1 - self.alpha) * bm25_score
-            hybrid_scores.append((idx, combined))
-
-        hybrid_scores.sort(key=lambda x: x[1], reverse=True)
-        top_k = hybrid_scores[:k]
-
-        results = []
-        for idx, score in top_k:
-            doc = Document(page_content=self.chunks[idx], metadata={"hybrid_score": score})
-            results.append(doc)
-
-        return results
-
 def process_text_with_splitter(text: str, page_numbers: List[int], save_path: str = None) -> Tuple[FAISS, List[str]]:
     """处理文本并创建向量存储"""
     text_splitter = RecursiveCharacterTextSplitter(
@@ -259,7 +131,7 @@ def generate_multi_queries(query: str, llm, num_queries: int = 3) -> List[str]:
 def hybrid_multi_query_search_with_rerank(
     query: str,
     hybrid_retriever: HybridRetriever,
-    reranker: Reranker,
+    reranker: CrossEncoderReranker,
     llm,
     initial_k: int = 10,
     final_k: int = 4
@@ -290,7 +162,7 @@ def hybrid_multi_query_search_with_rerank(
 def process_query(
     query: str,
     hybrid_retriever: HybridRetriever,
-    reranker: Reranker,
+    reranker: CrossEncoderReranker,
     vectorstore: FAISS,
     llm
 ) -> Tuple[str, Set]:
@@ -336,8 +208,8 @@ def main():
     hybrid_retriever = HybridRetriever(chunks, knowledgeBase, alpha=0.5)
     print("混合检索器已创建 (BM25 + Vector)")
 
-    # 创建Reranker (使用ModelScope上的轻量级模型)
-    reranker = Reranker(model_name="BAAI/bge-reranker-base")
+    # 创建Reranker (使用ModelScope上的轻量级模型，加载后常驻内存，多次查询共用)
+    reranker = get_reranker(model_name="BAAI/bge-reranker-base")
 
     llm = Tongyi(model_name="deepseek-v3", dashscope_api_key=DASHSCOPE_API_KEY)
 
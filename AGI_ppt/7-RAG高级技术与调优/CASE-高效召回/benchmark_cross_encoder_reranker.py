@@ -0,0 +1,151 @@
+"""
+benchmark_cross_encoder_reranker - 本地交叉编码器重排在 CPU 上的吞吐（pairs/s）
+
+对同一批查询（每个查询 --candidates 个长度不一的候选块，长度分布与 chunk_size=1000 的切分结果相近）对比：
+  1. baseline:   原 Reranker.rerank 的做法，每个查询的所有 (查询, 文档) 对一起 padding 到批内最长、max_length=512，PyTorch fp32
+  2. torch fp32: CrossEncoderReranker，按长度分桶的动态批处理，--callers 个线程同时提交查询
+  3. torch int8: 同 2，Linear 层 int8 动态量化
+  4. onnx fp32 / onnx int8: 同 2 / 3，使用 ONNX Runtime
+每种方式关闭分数缓存单独计时，并与 baseline 的分数比较（top-k 重合数、最大误差）；最后检查缓存命中时的延迟。
+
+--model-dir 指向本地的 bge-reranker-base 模型目录时使用真实权重。未指定时（例如无法访问 ModelScope）
+使用与 bge-reranker-base 相同结构（XLM-RoBERTa base，12 层，hidden 768）的随机权重模型和按字切分的分词器，
+词表缩小到所用的字（embedding 查表的开销可以忽略，只是省内存），吞吐与真实模型一致，
+但分数没有意义，int8 的精度对比只能在真实权重上看。
+
+用法: python benchmark_cross_encoder_reranker.py --queries 6 --candidates 24 --callers 4 --backends torch,onnx
+"""
+import argparse
+import gc
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from cross_encoder_reranker import CrossEncoderReranker
+
+CHARS = '客户经理考核办法投诉扣分评聘申报时间标准银行分行个金业务存款贷款理财产品营销服务质量管理规定年度季度月份指标完成情况'
+
+
+def random_text(rng: random.Random, length: int) -> str:
+    return ''.join(rng.choice(CHARS) for _ in range(length))
+
+
+def make_queries(num_queries: int, num_candidates: int, seed: int = 0):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        query = random_text(rng, rng.randint(10, 30))
+        # 切分后的块大多接近 chunk_size，少数是段落末尾的短块
+        docs = [random_text(rng, rng.choice([rng.randint(50, 300), rng.randint(600, 1000)]))
+                for _ in range(num_candidates)]
+        queries.append((query, docs))
+    return queries
+
+
+def load_random_model():
+    """与 bge-reranker-base 同结构的随机权重模型 + 按字切分的分词器"""
+    from tokenizers import Regex, Tokenizer, decoders, models, pre_tokenizers, processors
+    from transformers import PreTrainedTokenizerFast, XLMRobertaConfig, XLMRobertaForSequenceClassification
+
+    vocab = {'<s>': 0, '<pad>': 1, '</s>': 2, '<unk>': 3}
+    for ch in CHARS:
+        vocab.setdefault(ch, len(vocab))
+    tok = Tokenizer(models.WordLevel(vocab, unk_token='<unk>'))
+    tok.pre_tokenizer = pre_tokenizers.Split(Regex('.'), behavior='isolated')
+    tok.decoder = decoders.Fuse()
+    tok.post_processor = processors.TemplateProcessing(
+        single='<s> $A </s>', pair='<s> $A </s> </s> $B </s>', special_tokens=[('<s>', 0), ('</s>', 2)])
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tok, bos_token='<s>', eos_token='</s>', pad_token='<pad>',
+                                        unk_token='<unk>', model_input_names=['input_ids', 'attention_mask'])
+
+    torch.manual_seed(0)
+    config = XLMRobertaConfig(vocab_size=len(vocab), hidden_size=768, num_hidden_layers=12, num_attention_heads=12,
+                              intermediate_size=3072, max_position_embeddings=514, type_vocab_size=1,
+                              pad_token_id=1, bos_token_id=0, eos_token_id=2, num_labels=1)
+    return XLMRobertaForSequenceClassification(config).eval(), tokenizer
+
+
+def baseline_scores(model, tokenizer, queries) -> list:
+    all_scores = []
+    with torch.no_grad():
+        for query, docs in queries:
+            inputs = tokenizer([[query, doc] for doc in docs], padding=True, truncation=True, max_length=512,
+                               return_tensors='pt')
+            all_scores.append(model(**inputs).logits.squeeze(-1).tolist())
+    return all_scores
+
+
+def service_scores(reranker: CrossEncoderReranker, queries, callers: int) -> list:
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        return list(executor.map(lambda q: reranker.score(*q), queries))
+
+
+def compare(scores: list, expected: list, top_k: int):
+    overlap, max_diff = [], 0.0
+    for s, e in zip(scores, expected):
+        s, e = np.array(s), np.array(e)
+        overlap.append(len(set(np.argsort(-s)[:top_k]) & set(np.argsort(-e)[:top_k])))
+        max_diff = max(max_diff, float(np.abs(s - e).max()))
+    return np.mean(overlap), max_diff
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-dir', default=None, help='本地 bge-reranker-base 模型目录，不指定时使用随机权重')
+    parser.add_argument('--queries', type=int, default=6)
+    parser.add_argument('--candidates', type=int, default=24)
+    parser.add_argument('--callers', type=int, default=4, help='同时提交查询的线程数')
+    parser.add_argument('--backends', default='torch,onnx')
+    parser.add_argument('--top-k', type=int, default=4)
+    args = parser.parse_args()
+
+    if args.model_dir:
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.model_dir)
+        model = AutoModelForSequenceClassification.from_pretrained(args.model_dir).eval()
+    else:
+        model, tokenizer = load_random_model()
+    queries = make_queries(args.queries, args.candidates)
+    num_pairs = args.queries * args.candidates
+    print(f'{args.queries} 个查询 x {args.candidates} 个候选，{torch.get_num_threads()} 个 CPU 线程，'
+          f'{"模型: " + args.model_dir if args.model_dir else "随机权重（bge-reranker-base 结构）"}')
+
+    t0 = time.perf_counter()
+    expected = baseline_scores(model, tokenizer, queries)
+    t_baseline = time.perf_counter() - t0
+    print(f'baseline:   {num_pairs / t_baseline:6.1f} pairs/s')
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for backend in args.backends.split(','):
+            for quantize in (False, True):
+                reranker = CrossEncoderReranker(args.model_dir or 'bge-reranker-base-random', cache_dir=cache_dir,
+                                                backend=backend, quantize=quantize, cache_size=0, device='cpu',
+                                                model=model, tokenizer=tokenizer)
+                t0 = time.perf_counter()
+                scores = service_scores(reranker, queries, args.callers)
+                elapsed = time.perf_counter() - t0
+                overlap, max_diff = compare(scores, expected, args.top_k)
+                stats = reranker.stats()
+                print(f'{backend} {"int8" if quantize else "fp32"}: {num_pairs / elapsed:6.1f} pairs/s '
+                      f'({t_baseline / elapsed:.1f}x)，{stats["batches"]} 批，padding {stats["padding_ratio"]:.0%}，'
+                      f'top-{args.top_k} 重合 {overlap:.1f}，最大误差 {max_diff:.3f}')
+                reranker.close()
+                del reranker
+                gc.collect()
+
+        reranker = CrossEncoderReranker('bge-reranker-base-random', cache_dir=cache_dir, device='cpu', model=model,
+                                        tokenizer=tokenizer)
+        query, docs = queries[0]
+        reranker.score(query, docs)
+        t0 = time.perf_counter()
+        reranker.score(query, docs)
+        print(f'缓存命中: {(time.perf_counter() - t0) * 1000:.2f} ms，命中 {reranker.stats()["cache_hits"]} 对')
+        reranker.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+benchmark_hybrid_search - 混合检索的单次查询延迟
+
+1. 与原 HybridRetriever.search 对比（--chunks 个块，langchain FAISS + 由词向量相加得到的假向量）：
+   原实现 similarity_search_with_score(k=全部块) 后按块文本反查下标；新实现两路各取 top-k' 后按下标融合。
+   输出 p50 / p95，以及 weighted 模式下两者 top-k 的重合数
+2. 内容重复的块：原实现中前一个重复块拿不到向量分数，新实现中每个重复块的得分相同
+3. 百万级：HybridSearchEngine 直接使用合成的 BM25 索引和 IndexFlatL2（--large 个块，--dims 维），
+   输出 weighted / rrf 两种模式的 p50 / p95
+
+用法: python benchmark_hybrid_search.py --chunks 20000 --large 1000000 --dims 128 --queries 50
+"""
+import argparse
+import hashlib
+import random
+import time
+from typing import List
+
+import faiss
+import jieba
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from hybrid_search import HybridRetriever, HybridSearchEngine
+from sparse_bm25 import SparseBM25
+
+WORDS = ['客户经理', '考核', '投诉', '扣分', '评聘', '申报', '时间', '标准', '银行', '分行', '个金', '业务', '存款',
+         '贷款', '理财', '产品', '营销', '服务', '质量', '管理', '规定', '年度', '季度', '指标', '完成', '情况']
+
+
+class HashEmbeddings(Embeddings):
+    """假向量：各个词的随机向量（由词的哈希生成）之和，词重合越多的文本向量越接近"""
+
+    def __init__(self, dims: int):
+        self.dims = dims
+
+    def _word_vector(self, word: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(word.encode('utf-8')).digest()[:4], 'little')
+        return np.random.default_rng(seed).standard_normal(self.dims)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = sum(self._word_vector(w) for w in jieba.lcut(text))
+        return (vector / np.linalg.norm(vector)).astype(np.float32).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(t) for t in texts]
+
+
+class OldHybridRetriever:
+    """改动前的 HybridRetriever.search"""
+
+    def __init__(self, chunks: List[str], vectorstore: FAISS, alpha: float = 0.5):
+        self.chunks = chunks
+        self.vectorstore = vectorstore
+        self.alpha = alpha
+        self.bm25 = SparseBM25([list(jieba.cut(chunk)) for chunk in chunks])
+        self.chunk_to_idx = {chunk: idx for idx, chunk in enumerate(chunks)}
+
+    def search_ids(self, query: str, k: int = 4):
+        bm25_scores = self.bm25.get_scores(list(jieba.cut(query)))
+        max_bm25 = bm25_scores.max() if len(bm25_scores) and bm25_scores.max() > 0 else 1
+        bm25_scores_normalized = bm25_scores / max_bm25
+        vector_results = self.vectorstore.similarity_search_with_score(query, k=len(self.chunks))
+        vector_scores = {}
+        max_distance = max(score for _, score in vector_results) if vector_results else 1
+        for doc, distance in vector_results:
+            idx = self.chunk_to_idx.get(doc.page_content)
+            if idx is not None:
+                vector_scores[idx] = 1 - (distance / max_distance) if max_distance > 0 else 0
+        hybrid_scores = []
+        for idx in range(len(self.chunks)):
+            combined = self.alpha * vector_scores.get(idx, 0) + (1 - self.alpha) * bm25_scores_normalized[idx]
+            hybrid_scores.append((idx, combined))
+        hybrid_scores.sort(key=lambda x: x[1], reverse=True)
+        return hybrid_scores[:k]
+
+
+def make_chunks(n: int, rng: random.Random) -> List[str]:
+    return [f'第{i}条' + ''.join(rng.choice(WORDS) for _ in range(rng.randint(20, 60))) for i in range(n)]
+
+
+def timed(fn, queries: list) -> np.ndarray:
+    latencies = []
+    for q in queries:
+        t0 = time.perf_counter()
+        fn(q)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return np.array(latencies)
+
+
+def fmt(latencies: np.ndarray) -> str:
+    return f'p50 {np.percentile(latencies, 50):.1f} ms, p95 {np.percentile(latencies, 95):.1f} ms'
+
+
+def compare_with_old(args, rng: random.Random):
+    chunks = make_chunks(args.chunks, rng)
+    embeddings = HashEmbeddings(args.dims)
+    vectorstore = FAISS.from_embeddings(list(zip(chunks, embeddings.embed_documents(chunks))), embeddings)
+    old = OldHybridRetriever(chunks, vectorstore)
+    new = HybridRetriever(chunks, vectorstore, tokenizer=jieba.lcut)
+    queries = [''.join(rng.choice(WORDS) for _ in range(4)) for _ in range(args.queries)]
+
+    t_old = timed(lambda q: old.search_ids(q, k=args.k), queries[:max(5, args.queries // 10)])
+    t_new = timed(lambda q: new.search(q, k=args.k), queries)
+    overlap = np.mean([len({i for i, _ in old.search_ids(q, k=args.k)} &
+                           set(new.engine.search(jieba.lcut(q), embeddings.embed_query(q), k=args.k)[0].tolist()))
+                       for q in queries[:10]])
+    print(f'{args.chunks} 个块: 原实现 {fmt(t_old)}；新实现 {fmt(t_new)} '
+          f'({np.percentile(t_old, 50) / np.percentile(t_new, 50):.0f}x)，top-{args.k} 重合 {overlap:.1f}')
+
+
+def check_duplicates(args):
+    chunks = ['投诉一次扣2分', '客户经理每年申报一次', '投诉一次扣2分', '存款指标按季度考核']
+    embeddings = HashEmbeddings(args.dims)
+    vectorstore = FAISS.from_embeddings(list(zip(chunks, embeddings.embed_documents(chunks))), embeddings)
+    query = '投诉一次扣2分'  # 与重复块的向量相同
+    old_scores = dict(OldHybridRetriever(chunks, vectorstore).search_ids(query, k=len(chunks)))
+    engine = HybridRetriever(chunks, vectorstore, dedupe=False, tokenizer=jieba.lcut).engine
+    ids, scores = engine.search(jieba.lcut(query), embeddings.embed_query(query), k=len(chunks))
+    new_scores = dict(zip(ids.tolist(), scores.tolist()))
+    assert abs(new_scores[0] - new_scores[2]) < 1e-9 and set(ids[:2].tolist()) == {0, 2}, new_scores
+    deduped = HybridRetriever(chunks, vectorstore, tokenizer=jieba.lcut).search(query, k=2)
+    assert [d.page_content for d in deduped][0] == query and len({d.page_content for d in deduped}) == 2
+    print(f'内容重复的块: 原实现得分 {old_scores[0]:.2f} / {old_scores[2]:.2f}，'
+          f'新实现 {new_scores[0]:.2f} / {new_scores[2]:.2f}，去重后不再重复返回')
+
+
+def build_large(n: int, dims: int, vocab_size: int = 50000, doc_len: int = 30, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # 词频服从 Zipf 分布，和真实语料一样少数常用词出现在大量文档中
+    terms = np.minimum(rng.zipf(1.2, size=n * doc_len), vocab_size) - 1
+    docs = np.repeat(np.arange(n, dtype=np.int64), doc_len)
+    keys, freqs = np.unique(terms * n + docs, return_counts=True)
+    rows, cols = keys // n, keys % n
+    vocab = {f'w{i}': i for i in range(vocab_size)}
+    bm25 = SparseBM25.from_term_freqs(vocab, rows, cols, freqs, np.full(n, doc_len))
+
+    index = faiss.IndexFlatL2(dims)
+    for start in range(0, n, 100000):
+        index.add(rng.standard_normal((min(100000, n - start), dims)).astype(np.float32))
+    return bm25, index
+
+
+def large_scale(args):
+    t0 = time.perf_counter()
+    bm25, index = build_large(args.large, args.dims)
+    print(f'{args.large} 个块（{args.dims} 维）建索引 {time.perf_counter() - t0:.1f} s')
+    rng = np.random.default_rng(1)
+    queries = [([f'w{t}' for t in np.minimum(rng.zipf(1.2, size=6), 50000) - 1],
+                rng.standard_normal(args.dims).astype(np.float32)) for _ in range(args.queries)]
+    for mode in ('weighted', 'rrf'):
+        engine = HybridSearchEngine(bm25, index, mode=mode)
+        engine.search(*queries[0], k=args.k)  # 预热
+        latencies = timed(lambda q: engine.search(q[0], q[1], k=args.k), queries)
+        print(f'  {mode}: {fmt(latencies)}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=20000, help='与原实现对比时的块数')
+    parser.add_argument('--large', type=int, default=1000000, help='百万级测试的块数，0 表示跳过')
+    parser.add_argument('--dims', type=int, default=128)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--k', type=int, default=4)
+    args = parser.parse_args()
+    jieba.setLogLevel(60)
+    print(f'FAISS 线程数: {faiss.omp_get_max_threads()}')
+
+    rng = random.Random(0)
+    compare_with_old(args, rng)
+    check_duplicates(args)
+    if args.large:
+        large_scale(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+"""
+cross_encoder_reranker - 本地交叉编码器重排服务（bge-reranker 等 SequenceClassification 模型）
+
+模型加载一次后常驻内存，多次查询、多个线程共用：
+    reranker = get_reranker('BAAI/bge-reranker-base', backend='onnx', quantize=True)
+    docs = reranker.rerank(query, documents, top_k=4)  # 与原 Reranker.rerank 相同，分数写入 metadata['rerank_score']
+    scores = reranker.score(query, texts)
+    reranker.stats()  # {'pairs': 120, 'cache_hits': 40, 'batches': 9, 'padding_ratio': 0.08, ...}
+
+- 截断: 查询最多保留 max_query_length 个 token，文档按 max_length 减去查询长度后剩余的长度截断，查询本身不会被截掉
+- 动态批处理: 调用方在各自线程里分词，把 (查询, 文档) 对放进队列；后台线程等待最多 max_wait_ms 收集
+  同时到达的请求，按长度排序后分桶，每批 padding 到批内最长的长度，批大小受 max_batch_size、
+  max_batch_tokens（批大小 x 批内长度）和 padding 占比（不超过 20%）限制，短文本不再被 padding 到整批最长的长度
+- 推理后端: backend='torch'（PyTorch，有 GPU 时默认用 cuda）或 'onnx'（ONNX Runtime CPU，首次使用时导出到模型目录下的 onnx/）；
+  quantize=True 时对 Linear 层做 int8 动态量化（torch.ao.quantization.quantize_dynamic /
+  onnxruntime.quantization.quantize_dynamic）
+- 分数缓存: (查询, 文档) -> 分数的 LRU，同一查询的多查询召回、重复提问不再重复推理
+get_reranker() 按模型和参数返回进程内共享的实例。
+"""
+import hashlib
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional
+
+import numpy as np
+
+# 加入下一项后批内 padding 占比超过该值时另起一批
+_MAX_PADDING_RATIO = 0.2
+
+
+class CrossEncoderReranker:
+
+    def __init__(self,
+                 model_name: str = 'BAAI/bge-reranker-base',
+                 cache_dir: str = './models',
+                 backend: str = 'torch',
+                 quantize: bool = False,
+                 max_length: int = 512,
+                 max_query_length: int = 64,
+                 max_batch_size: int = 32,
+                 max_batch_tokens: int = 8192,
+                 max_wait_ms: float = 5,
+                 cache_size: int = 20000,
+                 num_threads: Optional[int] = None,
+                 device: Optional[str] = None,
+                 model=None,
+                 tokenizer=None):
+        """
+        参数:
+            model_name: ModelScope 上的模型名称或本地模型目录
+                - BAAI/bge-reranker-base (轻量级，推荐)
+                - BAAI/bge-reranker-large (效果更好，但更慢)
+            cache_dir: 模型缓存目录，ONNX 模型也导出到这里
+            backend: 'torch' 或 'onnx'
+            quantize: 是否使用 int8 动态量化
+            max_length: 查询 + 文档的最大 token 数
+            max_query_length: 查询的最大 token 数
+            max_batch_size / max_batch_tokens: 每批的最大样本数 / 最大 token 数（批大小 x 批内长度）
+            max_wait_ms: 后台线程收集同时到达的请求的最长等待时间
+            cache_size: 分数缓存的条目数，0 表示不缓存
+            num_threads: CPU 推理的线程数，默认由框架决定
+            device: torch 后端的推理设备，默认有 GPU 时用 'cuda'，否则用 'cpu'；int8 动态量化只能在 CPU 上运行
+            model / tokenizer: 直接传入已加载的 transformers 模型和分词器，不再下载
+        """
+        if backend not in ('torch', 'onnx'):
+            raise ValueError(f'不支持的 backend: {backend}')
+        self.model_name = model_name
+        self.backend = backend
+        self.quantize = quantize
+        self.max_length = max_length
+        self.max_query_length = max_query_length
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+        if model is None or tokenizer is None:
+            model_dir = self._download(model_name, cache_dir)
+            from transformers import AutoModelForSequenceClassification, AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(model_dir)
+            model = AutoModelForSequenceClassification.from_pretrained(model_dir)
+        else:
+            model_dir = os.path.join(cache_dir, model_name.replace('/', '__'))
+        self.tokenizer = tokenizer
+        self.input_names = [name for name in tokenizer.model_input_names if name in ('input_ids', 'attention_mask',
+                                                                                      'token_type_ids')]
+        model.eval()
+        if backend == 'torch':
+            self._init_torch(model, num_threads, device)
+        else:
+            self._init_onnx(model, model_dir, num_threads)
+
+        # 预热一次，首个查询不再承担初始化的开销
+        self._infer([self._encode('预热', ['预热'])[0]])
+
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='cross-encoder-reranker', daemon=True)
+        self._worker.start()
+        device = f', device={self.device}' if backend == 'torch' else ''
+        print(f'Rerank模型已加载: {model_name} (backend={backend}, quantize={quantize}{device})')
+
+    @staticmethod
+    def _download(model_name: str, cache_dir: str) -> str:
+        if os.path.isdir(model_name):
+            return model_name
+        from modelscope import snapshot_download
+        os.makedirs(cache_dir, exist_ok=True)
+        return snapshot_download(model_name, cache_dir=cache_dir)
+
+    def _init_torch(self, model, num_threads: Optional[int], device: Optional[str]):
+        import torch
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() and not self.quantize else 'cpu'
+        if self.quantize:
+            if device != 'cpu':
+                raise ValueError(f'int8 动态量化只支持 CPU，不能在 {device} 上运行')
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self._torch = torch
+        self.device = device
+        self.model = model.to(device)
+
+    def _init_onnx(self, model, model_dir: str, num_threads: Optional[int]):
+        import onnxruntime as ort
+        onnx_dir = os.path.join(model_dir, 'onnx')
+        fp32_path = os.path.join(onnx_dir, 'model.onnx')
+        if not os.path.exists(fp32_path):
+            self._export_onnx(model, fp32_path)
+        path = fp32_path
+        if self.quantize:
+            path = os.path.join(onnx_dir, 'model.int8.onnx')
+            if not os.path.exists(path):
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def _export_onnx(self, model, path: str):
+        import torch
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        dummy = self.tokenizer(['查询'], ['文档'], return_tensors='pt')
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in self.input_names}
+        dynamic_axes['logits'] = {0: 'batch'}
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with torch.no_grad():
+            torch.onnx.export(model, tuple(dummy[name] for name in self.input_names), tmp_path,
+                              input_names=self.input_names, output_names=['logits'],
+                              dynamic_axes=dynamic_axes, opset_version=17, dynamo=False)
+        os.replace(tmp_path, path)
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {'pairs': 0, 'cache_hits': 0, 'batches': 0, 'tokens': 0, 'padded_tokens': 0}
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['padding_ratio'] = 1 - stats['tokens'] / stats['padded_tokens'] if stats['padded_tokens'] else 0.0
+        return stats
+
+    def _add_stats(self, **counts):
+        with self._stats_lock:
+            for key, value in counts.items():
+                self._stats[key] += value
+
+    def _cache_key(self, query: str, text: str) -> str:
+        return hashlib.sha256(f'{query}\0{text}'.encode('utf-8')).hexdigest()
+
+    def _encode(self, query: str, texts: List[str]) -> List[dict]:
+        """分词并截断：查询超过 max_query_length 时先截断查询，文档使用剩下的长度"""
+        query_ids = self.tokenizer(query, add_special_tokens=False)['input_ids']
+        if len(query_ids) > self.max_query_length:
+            query = self.tokenizer.decode(query_ids[:self.max_query_length])
+        encoded = self.tokenizer([query] * len(texts), texts, truncation='only_second', max_length=self.max_length)
+        return [{name: encoded[name][i] for name in self.input_names} for i in range(len(texts))]
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        """计算查询与每个文本的相关性分数（模型输出的 logit）"""
+        if not texts:
+            return []
+        scores = [None] * len(texts)
+        keys = [self._cache_key(query, text) for text in texts]
+        if self.cache_size:
+            with self._cache_lock:
+                for i, key in enumerate(keys):
+                    if key in self._cache:
+                        self._cache.move_to_end(key)
+                        scores[i] = self._cache[key]
+        missing = [i for i, s in enumerate(scores) if s is None]
+        self._add_stats(pairs=len(texts), cache_hits=len(texts) - len(missing))
+        if missing:
+            features = self._encode(query, [texts[i] for i in missing])
+            futures = []
+            for feature in features:
+                future = Future()
+                self._queue.put((feature, future))
+                futures.append(future)
+            for i, future in zip(missing, futures):
+                scores[i] = future.result()
+            if self.cache_size:
+                with self._cache_lock:
+                    for i in missing:
+                        self._cache[keys[i]] = scores[i]
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+        return scores
+
+    def rerank(self, query: str, documents: list, top_k: int = None) -> list:
+        """
+        对文档进行重排序
+
+        参数:
+            query: 查询文本
+            documents: 待排序的文档列表（langchain Document）
+            top_k: 返回前k个结果，None表示返回全部
+        """
+        if not documents:
+            return []
+
+        scores = self.score(query, [doc.page_content for doc in documents])
+        scored_docs = sorted(zip(documents, scores), key=lambda x: x[1], reverse=True)
+
+        # 更新metadata中的分数
+        results = []
+        for doc, score in scored_docs:
+            doc.metadata["rerank_score"] = score
+            results.append(doc)
+
+        if top_k:
+            results = results[:top_k]
+
+        return results
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            if pending[0] is None:
+                return
+            # 收集同时到达的请求，凑够几批或等待超时后一起处理
+            deadline = time.monotonic() + self.max_wait
+            while len(pending) < self.max_batch_size * 4:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                pending.append(item)
+            for batch in self._make_batches(pending):
+                try:
+                    scores = self._infer([feature for feature, _ in batch])
+                except Exception as e:
+                    for _, future in batch:
+                        future.set_exception(e)
+                    continue
+                for (_, future), score in zip(batch, scores):
+                    future.set_result(score)
+
+    def _make_batches(self, pending: list) -> List[list]:
+        """按长度排序后切分，长度相近的放在同一批"""
+        pending.sort(key=lambda item: len(item[0]['input_ids']))
+        batches, batch, batch_tokens = [], [], 0
+        for item in pending:
+            length = len(item[0]['input_ids'])  # 已排序，当前项就是批内最长的
+            padded = (len(batch) + 1) * length
+            if batch and (len(batch) >= self.max_batch_size or padded > self.max_batch_tokens
+                          or padded - batch_tokens - length > _MAX_PADDING_RATIO * padded):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(item)
+            batch_tokens += length
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _infer(self, features: List[dict]) -> List[float]:
+        inputs = self.tokenizer.pad(features, padding='longest', return_tensors='np')
+        self._add_stats(batches=1, tokens=int(inputs['attention_mask'].sum()), padded_tokens=inputs['attention_mask'].size)
+        if self.backend == 'onnx':
+            logits = self.session.run(None, {name: inputs[name].astype(np.int64) for name in self.input_names})[0]
+        else:
+            with self._torch.inference_mode():
+                logits = self.model(**{
+                    name: self._torch.from_numpy(inputs[name]).to(self.device)
+                    for name in self.input_names
+                }).logits
+            logits = logits.float().cpu().numpy()
+        return logits[:, 0].astype(float).tolist()
+
+    def close(self):
+        self._queue.put(None)
+        self._worker.join()
+
+
+_rerankers = {}
+_rerankers_lock = threading.Lock()
+
+
+def get_reranker(model_name: str = 'BAAI/bge-reranker-base', **kwargs) -> CrossEncoderReranker:
+    """进程内共享的重排器，相同模型和参数只加载一次"""
+    key = (model_name, tuple(sorted(kwargs.items())))
+    with _rerankers_lock:
+        if key not in _rerankers:
+            _rerankers[key] = CrossEncoderReranker(model_name, **kwargs)
+        return _rerankers[key]
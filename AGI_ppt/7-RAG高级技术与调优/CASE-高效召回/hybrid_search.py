@@ -0,0 +1,152 @@
+"""
+hybrid_search - BM25 + 向量的混合检索
+
+两路各自只取 top-k' 个候选（BM25 用 argpartition，向量用 FAISS 的 top-k 搜索），按块在索引中的下标融合，
+不再把全库的向量结果排序后取回、也不再用块文本反查下标：
+    engine = HybridSearchEngine(bm25, faiss_index, mode='rrf')
+    ids, scores = engine.search(tokenized_query, query_vector, k=4)
+    retriever = HybridRetriever(chunks, vectorstore, alpha=0.5, mode='weighted')  # langchain 的 FAISS
+    docs = retriever.search(query, k=4)
+
+- weighted: alpha * 向量分数 + (1 - alpha) * BM25 分数。BM25 分数除以最高分；向量分数在 L2 距离下为
+  1 - 距离 / 候选中的最大距离，内积下除以最高分。只被一路召回的块，另一路记 0
+- rrf: alpha / (rrf_k + 向量排名) + (1 - alpha) / (rrf_k + BM25 排名)，与两路分数的尺度无关
+- 块的下标就是它在 FAISS 中的位置，内容相同的块各自得分、互不覆盖；dedupe=True 时结果中相同内容只保留得分最高的一个
+"""
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import faiss
+import jieba
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from sparse_bm25 import SparseBM25, top_k_indices
+
+
+class HybridSearchEngine:
+
+    def __init__(self, bm25: SparseBM25, index, mode: str = 'weighted', alpha: float = 0.5, rrf_k: int = 60,
+                 normalize_L2: bool = False):
+        """
+        参数:
+            bm25: 块的 BM25 索引，第 i 个文档对应 FAISS 中的第 i 个向量
+            index: FAISS 索引
+            mode: 'weighted' 或 'rrf'
+            alpha: 向量检索权重 (0-1), BM25权重为 1-alpha
+            rrf_k: RRF 的平滑常数
+            normalize_L2: 查询向量是否先做 L2 归一化（与建索引时一致）
+        """
+        if mode not in ('weighted', 'rrf'):
+            raise ValueError(f'不支持的融合方式: {mode}')
+        if bm25.corpus_size != index.ntotal:
+            raise ValueError(f'BM25 文档数 {bm25.corpus_size} 与向量数 {index.ntotal} 不一致')
+        self.bm25 = bm25
+        self.index = index
+        self.mode = mode
+        self.alpha = alpha
+        self.rrf_k = rrf_k
+        self.normalize_L2 = normalize_L2
+        self.inner_product = index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+    def _bm25_candidates(self, tokenized_query: Sequence[str], candidate_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        ids, scores = self.bm25.top_k(tokenized_query, candidate_k)
+        keep = scores > 0  # 不含任何查询词的块不算被 BM25 召回
+        ids, scores = ids[keep], scores[keep]
+        if self.mode == 'weighted' and len(scores):
+            scores = scores / scores[0]
+        return ids, scores
+
+    def _vector_candidates(self, query_vector, candidate_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        vector = np.array(query_vector, dtype=np.float32).reshape(1, -1)
+        if self.normalize_L2:
+            faiss.normalize_L2(vector)
+        distances, ids = self.index.search(vector, min(candidate_k, self.index.ntotal))
+        keep = ids[0] >= 0
+        ids, distances = ids[0][keep], distances[0][keep]
+        if self.mode == 'weighted' and len(distances):
+            if self.inner_product:
+                scores = distances / distances[0] if distances[0] > 0 else np.zeros(len(distances))
+            else:
+                max_distance = distances.max()
+                scores = 1 - distances / max_distance if max_distance > 0 else np.ones(len(distances))
+        else:
+            scores = distances
+        return ids, scores
+
+    def search(self, tokenized_query: Sequence[str], query_vector, k: int = 4, candidate_k: Optional[int] = None,
+               texts: Optional[Sequence[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        执行混合检索，返回得分最高的 k 个块的下标和融合分数
+
+        参数:
+            tokenized_query: 分词后的查询
+            query_vector: 查询向量
+            k: 返回结果数量
+            candidate_k: 每路召回的候选数，默认 max(10 * k, 50)
+            texts: 块文本，传入时结果中内容相同的块只保留得分最高的一个
+        """
+        candidate_k = candidate_k or max(10 * k, 50)
+        bm25_ids, bm25_scores = self._bm25_candidates(tokenized_query, candidate_k)
+        vector_ids, vector_scores = self._vector_candidates(query_vector, candidate_k)
+        if self.mode == 'rrf':
+            bm25_scores = 1 / (self.rrf_k + np.arange(1, len(bm25_ids) + 1))
+            vector_scores = 1 / (self.rrf_k + np.arange(1, len(vector_ids) + 1))
+
+        ids, inverse = np.unique(np.concatenate([vector_ids, bm25_ids]).astype(np.int64), return_inverse=True)
+        fused = np.zeros(len(ids))
+        np.add.at(fused, inverse, np.concatenate([self.alpha * vector_scores, (1 - self.alpha) * bm25_scores]))
+
+        order = top_k_indices(fused, len(fused) if texts is not None else k)
+        if texts is not None:
+            seen, unique = set(), []
+            for i in order:
+                if texts[ids[i]] not in seen:
+                    seen.add(texts[ids[i]])
+                    unique.append(i)
+                    if len(unique) == k:
+                        break
+            order = np.array(unique, dtype=np.int64)
+        return ids[order], fused[order]
+
+
+class HybridRetriever:
+    """混合检索器: BM25 + Vector"""
+
+    def __init__(self, chunks: List[str], vectorstore: FAISS, alpha: float = 0.5, mode: str = 'weighted',
+                 rrf_k: int = 60, dedupe: bool = True, tokenizer: Callable[[str], List[str]] = jieba.lcut):
+        """
+        初始化混合检索器
+
+        参数:
+            chunks: 文本块列表，顺序与建向量库时相同（FAISS.from_texts(chunks, ...)）
+            vectorstore: FAISS向量存储
+            alpha: 向量检索权重 (0-1), BM25权重为 1-alpha
+            mode: 'weighted'（加权求和）或 'rrf'（倒数排名融合）
+            rrf_k: RRF 的平滑常数
+            dedupe: 结果中内容相同的块只保留一个
+            tokenizer: 中文分词
+        """
+        self.chunks = chunks
+        self.vectorstore = vectorstore
+        self.tokenizer = tokenizer
+        self.dedupe = dedupe
+
+        # 构建BM25索引
+        bm25 = SparseBM25([tokenizer(chunk) for chunk in chunks])
+        self.engine = HybridSearchEngine(bm25, vectorstore.index, mode=mode, alpha=alpha, rrf_k=rrf_k,
+                                         normalize_L2=vectorstore._normalize_L2)
+
+    def search(self, query: str, k: int = 4, candidate_k: Optional[int] = None) -> List[Document]:
+        """
+        执行混合检索
+
+        参数:
+            query: 查询文本
+            k: 返回结果数量
+            candidate_k: 每路召回的候选数
+        """
+        ids, scores = self.engine.search(self.tokenizer(query), self.vectorstore._embed_query(query), k=k,
+                                         candidate_k=candidate_k, texts=self.chunks if self.dedupe else None)
+        return [Document(page_content=self.chunks[idx], metadata={"hybrid_score": float(score)})
+                for idx, score in zip(ids, scores)]
@@ -0,0 +1,129 @@
+"""
+sparse_bm25 - 基于 scipy CSR 稀疏矩阵的向量化 BM25 打分器
+
+与 rank_bm25.BM25Okapi 得分一致，可直接替换：
+    bm25 = SparseBM25(tokenized_corpus)
+    scores = bm25.get_scores(tokenized_query)          # 单个查询，返回所有文档得分
+    indices, scores = bm25.top_k(tokenized_query, k)   # argpartition 取 top-k
+    all_scores = bm25.get_batch_scores(queries)        # 一批查询，一次稀疏矩阵乘法
+"""
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """The indices of the k largest scores, sorted by score in descending order"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class SparseBM25:
+    """A vectorized BM25Okapi scorer
+
+    The idf and the length norms are folded into a CSR term-doc weight matrix when the index is built,
+    so scoring a query is a sparse mat-vec instead of a Python loop over the docs.
+    The scores are the same as `rank_bm25.BM25Okapi.get_scores`.
+    """
+
+    def __init__(self,
+                 corpus: Optional[Sequence[Sequence[str]]] = None,
+                 k1: float = 1.5,
+                 b: float = 0.75,
+                 epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+        self.vocab: Dict[str, int] = {}
+        self.corpus_size: int = 0
+        self.avgdl: float = 0.0
+        self.idf = np.zeros(0)
+        self._weights = sparse.csr_matrix((0, 0))  # term x doc
+
+        if corpus is not None:
+            rows, cols, data, doc_len = [], [], [], []
+            for doc_id, doc in enumerate(corpus):
+                doc_len.append(len(doc))
+                for word, freq in Counter(doc).items():
+                    rows.append(self.vocab.setdefault(word, len(self.vocab)))
+                    cols.append(doc_id)
+                    data.append(freq)
+            self._build(rows, cols, data, doc_len)
+
+    @classmethod
+    def from_term_freqs(cls, vocab: Dict[str, int], rows: List[int], cols: List[int], data: List[int],
+                        doc_len: List[int], **kwargs) -> 'SparseBM25':
+        """Build from term frequencies that have been counted elsewhere
+
+        Args:
+            vocab: The map from keyword to term id.
+            rows, cols, data: The (term id, doc id, term frequency) triples.
+            doc_len: The number of keywords in each doc.
+        """
+        bm25 = cls(**kwargs)
+        bm25.vocab = vocab
+        bm25._build(rows, cols, data, doc_len)
+        return bm25
+
+    def _build(self, rows: List[int], cols: List[int], data: List[int], doc_len: List[int]):
+        doc_len = np.asarray(doc_len, dtype=np.float64)
+        self.corpus_size = len(doc_len)
+        self.avgdl = float(doc_len.sum()) / self.corpus_size if self.corpus_size else 0.0
+
+        weights = sparse.csr_matrix((np.asarray(data, dtype=np.float64), (rows, cols)),
+                                    shape=(len(self.vocab), self.corpus_size))
+        df = np.diff(weights.indptr)
+        idf = np.log(self.corpus_size - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            # Same as BM25Okapi: negative idf is replaced by epsilon * average idf
+            idf[idf < 0] = self.epsilon * idf.mean()
+        self.idf = idf
+
+        if weights.nnz:
+            tf = weights.data
+            norm = self.k1 * (1 - self.b + self.b * doc_len[weights.indices] / self.avgdl)
+            term_ids = np.repeat(np.arange(len(self.vocab)), df)
+            weights.data = idf[term_ids] * tf * (self.k1 + 1) / (tf + norm)
+        self._weights = weights
+
+    def get_scores(self, query: Sequence[str]) -> np.ndarray:
+        """The BM25 scores of all docs for one tokenized query"""
+        term_ids = [self.vocab[word] for word in query if word in self.vocab]
+        if not term_ids:
+            return np.zeros(self.corpus_size)
+        term_ids, counts = np.unique(term_ids, return_counts=True)
+        return self._weights[term_ids].T.dot(counts.astype(np.float64))
+
+    def get_batch_scores(self, queries: Sequence[Sequence[str]]) -> np.ndarray:
+        """The BM25 scores for a batch of tokenized queries, with shape (len(queries), corpus_size)"""
+        rows, cols = [], []
+        for i, query in enumerate(queries):
+            for word in query:
+                if word in self.vocab:
+                    rows.append(i)
+                    cols.append(self.vocab[word])
+        query_mat = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(queries), len(self.vocab)))
+        return (query_mat @ self._weights).toarray()
+
+    def top_k(self, query: Sequence[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The ids and scores of the k best docs for one tokenized query"""
+        scores = self.get_scores(query)
+        indices = top_k_indices(scores, k)
+        return indices, scores[indices]
+
+    def batch_top_k(self, queries: Sequence[Sequence[str]], k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        all_scores = self.get_batch_scores(queries)
+        res = []
+        for scores in all_scores:
+            indices = top_k_indices(scores, k)
+            res.append((indices, scores[indices]))
+        return res
@@ -0,0 +1,218 @@
+"""
+benchmark_api_client - 共享 DashScope 客户端对单个问题延迟的影响
+
+在本地启动一个假的 DashScope HTTP 服务（dashscope.base_http_api_url 指向它），实现：
+  - text-generation: 重排请求按块数返回评分，回答请求返回 JSON 答案，每次请求有固定延迟
+  - text-embedding:  返回由文本哈希生成的向量
+每个新建的 TCP 连接额外等待 --connect-ms，模拟到 DashScope 的 TLS 握手。
+用合成的分块数据建 FAISS 索引，对同一批问题依次调用 QuestionsProcessor.process_single_question，对比：
+  1. before: 每次调用新建连接、重排串行、每个问题重新创建 HybridRetriever（改动前的行为）
+  2. after:  共享的 DashscopeClient（连接池复用连接，按并发上限并行重排），检索器只创建一次
+输出每个问题延迟的 p50 / p95，以及服务端新建的连接数。
+
+用法（在 RAG-lab 目录下）: python benchmark_api_client.py --questions 20 --chunks 2000 --llm-ms 80 --connect-ms 60
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import re
+import statistics
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import dashscope
+import faiss
+import numpy as np
+import requests
+
+from src.api_client import DashscopeClient
+from src.embedding_cache import get_default_cache
+from src.questions_processing import QuestionsProcessor
+from src.retrieval import HybridRetriever
+
+DIMS = 64
+
+
+def fake_embedding(text: str) -> list:
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return [digest[i % len(digest)] / 255 - 0.5 for i in range(DIMS)]
+
+
+class FakeDashscopeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, llm_latency: float, embedding_latency: float, connect_latency: float,
+                 max_concurrency: int = 0):
+        """max_concurrency > 0 时，超过该数目的同时进行的 generation 请求返回 429（模拟服务端限流）"""
+        super().__init__(('127.0.0.1', 0), FakeDashscopeHandler)
+        self.llm_latency = llm_latency
+        self.embedding_latency = embedding_latency
+        self.connect_latency = connect_latency
+        self.max_concurrency = max_concurrency
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+class FakeDashscopeHandler(BaseHTTPRequestHandler):
+    server: FakeDashscopeServer
+    protocol_version = 'HTTP/1.1'  # 支持 keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+        time.sleep(self.server.connect_latency)
+
+    def _reply(self, output: dict):
+        self._send(200, {'request_id': 'bench', 'output': output, 'usage': {'input_tokens': 1, 'output_tokens': 1,
+                                                                          'total_tokens': 2}})
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        req = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        with self.server.lock:
+            self.server.requests += 1
+        if self.path.endswith('/text-embedding'):
+            time.sleep(self.server.embedding_latency)
+            texts = req['input']['texts']
+            return self._reply({'embeddings': [{'text_index': i, 'embedding': fake_embedding(t)}
+                                               for i, t in enumerate(texts)]})
+
+        server = self.server
+        with server.lock:
+            throttled = 0 < server.max_concurrency <= server.in_flight
+            if throttled:
+                server.throttled += 1
+            else:
+                server.in_flight += 1
+                server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        if throttled:
+            return self._send(429, {'request_id': 'bench', 'code': 'Throttling', 'message': 'Requests rate limit exceeded'})
+        try:
+            time.sleep(server.llm_latency)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+        user = req['input']['messages'][-1]['content']
+        match = re.search(r'你需要提供恰好 (\d+) 个排名', user)
+        if match:
+            content = '\n'.join(f'块 {i + 1} 评分：相关性分数: {0.9 - 0.1 * i:.1f}' for i in range(int(match.group(1))))
+        else:
+            content = json.dumps({'final_answer': '假答案', 'step_by_step_analysis': '', 'reasoning_summary': '',
+                                  'relevant_pages': []}, ensure_ascii=False)
+        return self._reply({'choices': [{'finish_reason': 'stop', 'message': {'role': 'assistant',
+                                                                              'content': content}}]})
+
+
+class UnpooledClient(DashscopeClient):
+    """改动前的调用方式：每次调用新建连接，用完即关"""
+
+    def generation(self, **kwargs):
+        with self.limiters['generation'].slot(), requests.Session() as session:
+            return dashscope.Generation.call(api_key=self.api_key, session=session, **kwargs)
+
+    def text_embedding(self, **kwargs):
+        with self.limiters['embedding'].slot(), requests.Session() as session:
+            return dashscope.TextEmbedding.call(api_key=self.api_key, session=session, **kwargs)
+
+
+def build_index(workspace: Path, num_chunks: int):
+    chunks = [{
+        'text': f'第 {i} 段：公司在晶圆制造行业的市场份额、产能布局与研发投入情况说明 {i}',
+        'file_origin': f'report_{i // 200}.pdf',
+        'page_range': [i % 200 + 1]
+    } for i in range(num_chunks)]
+    embeddings = np.array([fake_embedding(c['text']) for c in chunks], dtype=np.float32)
+    faiss.normalize_L2(embeddings)
+    index = faiss.IndexFlatIP(DIMS)
+    index.add(embeddings)
+    faiss.write_index(index, str(workspace / 'all_reports.faiss'))
+    with open(workspace / 'all_metadata.json', 'w', encoding='utf-8') as f:
+        json.dump(chunks, f, ensure_ascii=False)
+
+
+def run(processor: QuestionsProcessor, questions: list, reuse_retriever: bool) -> list:
+    latencies = []
+    if not reuse_retriever:
+        # 改动前每个问题都新建检索器，重新加载索引
+        processor._get_retriever = lambda: HybridRetriever(processor.vector_index_path, processor.metadata_path,
+                                                           client=processor.client)
+    for question in questions:
+        t0 = time.perf_counter()
+        answer = processor.process_single_question(question, kind='summary')
+        latencies.append((time.perf_counter() - t0) * 1000)
+        assert answer['final_answer'] == '假答案', answer
+    return latencies
+
+
+def report(name: str, latencies: list, connections: int):
+    p95 = np.percentile(latencies, 95)
+    print(f'{name}: p50 {statistics.median(latencies):.0f} ms, p95 {p95:.0f} ms, 新建连接 {connections} 个')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--chunks', type=int, default=2000)
+    parser.add_argument('--llm-ms', type=float, default=80, help='每次 generation 请求的延迟')
+    parser.add_argument('--embedding-ms', type=float, default=20, help='每次 embedding 请求的延迟')
+    parser.add_argument('--connect-ms', type=float, default=60, help='每个新连接的握手延迟')
+    args = parser.parse_args()
+    os.environ.setdefault('DASHSCOPE_API_KEY', 'fake')  # 请求只发往本地的假服务
+
+    server = FakeDashscopeServer(args.llm_ms / 1000, args.embedding_ms / 1000, args.connect_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    dashscope.base_http_api_url = f'http://127.0.0.1:{server.server_address[1]}/api/v1'
+    questions = [f'第 {i} 个问题：中芯国际在晶圆制造行业中的地位如何？' for i in range(args.questions)]
+
+    try:
+        with tempfile.TemporaryDirectory() as workspace:
+            workspace = Path(workspace)
+            build_index(workspace, args.chunks)
+            results = []
+            for name, client, reuse_retriever in [
+                ('before', UnpooledClient(limits={'generation': {'max_concurrency': 1, 'qps': 0},
+                                                  'embedding': {'qps': 0}}), False),
+                ('after ', DashscopeClient(limits={'generation': {'qps': 0}, 'embedding': {'qps': 0}}), True),
+            ]:
+                processor = QuestionsProcessor(answering_model='qwen-turbo',
+                                               vector_index_path=workspace / 'all_reports.faiss',
+                                               metadata_path=workspace / 'all_metadata.json',
+                                               client=client)
+                server.connections = 0
+                get_default_cache().clear()  # 两轮使用同样的问题，避免后一轮命中查询向量缓存
+                with contextlib.redirect_stdout(io.StringIO()):  # 屏蔽检索、重排过程中的输出
+                    latencies = run(processor, questions, reuse_retriever)
+                results.append((name, latencies, server.connections))
+                client.close()
+    finally:
+        server.shutdown()
+
+    print(f'问题数: {args.questions}，块数: {args.chunks}')
+    for name, latencies, connections in results:
+        report(name, latencies, connections)
+
+
+if __name__ == '__main__':
+    main()
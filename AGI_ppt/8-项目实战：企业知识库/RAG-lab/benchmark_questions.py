@@ -0,0 +1,117 @@
+"""
+benchmark_questions - 批量问答的吞吐（问题/分钟）
+
+复用 benchmark_api_client.py 中的假 DashScope 服务与合成索引（不指定 --vector-dbs 时），对同一批问题对比：
+  1. per-question: 每个问题新建 HybridRetriever（重新读 FAISS、元数据并对全量语料 jieba 分词，改动前的行为）
+  2. shared:       进程内共享的检索器，逐个处理
+  3. batch:        process_questions(questions, max_workers) 并发处理，共享同一份索引
+之后重新生成索引文件，检查共享的检索器会自动重新加载。
+
+--vector-dbs 指向已有的 data/stock_data/databases/vector_dbs 时使用其中的 all_reports.faiss 与
+all_metadata.json。这些向量由 text-embedding-v1 生成，所以此时不启动假服务，直接调用 DashScope（需要 DASHSCOPE_API_KEY）。
+
+用法（在 RAG-lab 目录下）: python benchmark_questions.py --questions 40 --chunks 5000 --max-workers 8
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import dashscope
+
+from benchmark_api_client import FakeDashscopeServer, build_index
+from src.api_client import DashscopeClient
+from src.embedding_cache import get_default_cache
+from src.questions_processing import QuestionsProcessor
+from src.retrieval import HybridRetriever, get_hybrid_retriever
+
+
+def questions_per_minute(fn, num_questions: int) -> float:
+    get_default_cache().clear()  # 各轮使用同样的问题，避免命中前一轮的查询向量缓存
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # 屏蔽检索、重排过程中的输出
+        answers = fn()
+    elapsed = time.perf_counter() - t0
+    assert len(answers) == num_questions and all(a.get('final_answer') for a in answers), answers
+    return num_questions / elapsed * 60
+
+
+def run(vector_dbs: Path, questions: list, max_workers: int, client: DashscopeClient):
+    index_path, metadata_path = vector_dbs / 'all_reports.faiss', vector_dbs / 'all_metadata.json'
+    processor = QuestionsProcessor(answering_model='qwen-turbo',
+                                   vector_index_path=index_path,
+                                   metadata_path=metadata_path,
+                                   client=client)
+
+    def per_question():
+        processor._get_retriever = lambda: HybridRetriever(index_path, metadata_path, client=client)
+        try:
+            return [processor.process_single_question(q, kind='summary') for q in questions]
+        finally:
+            del processor._get_retriever
+
+    results = [('per-question', questions_per_minute(per_question, len(questions)))]
+    results.append(('shared', questions_per_minute(
+        lambda: [processor.process_single_question(q, kind='summary') for q in questions], len(questions))))
+    results.append((f'batch ({max_workers} 线程)', questions_per_minute(
+        lambda: processor.process_questions(questions, kind='summary', max_workers=max_workers), len(questions))))
+    return results
+
+
+def check_hot_reload(workspace: Path, num_chunks: int, client: DashscopeClient):
+    index_path, metadata_path = workspace / 'all_reports.faiss', workspace / 'all_metadata.json'
+    old = get_hybrid_retriever(index_path, metadata_path, client=client)
+    assert get_hybrid_retriever(index_path, metadata_path, client=client) is old
+    time.sleep(0.01)  # 保证修改时间不同
+    build_index(workspace, num_chunks + 1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        new = get_hybrid_retriever(index_path, metadata_path, client=client)
+    assert new is not old and len(new.bm25_retriever.documents) == num_chunks + 1
+    with open(metadata_path, encoding='utf-8') as f:
+        assert len(json.load(f)) == new.vector_retriever._index.ntotal
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--questions', type=int, default=40)
+    parser.add_argument('--chunks', type=int, default=5000)
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--vector-dbs', type=Path, default=None, help='已有的向量库目录，不指定时使用合成数据和假服务')
+    parser.add_argument('--llm-ms', type=float, default=80, help='每次 generation 请求的延迟')
+    parser.add_argument('--embedding-ms', type=float, default=20, help='每次 embedding 请求的延迟')
+    args = parser.parse_args()
+    questions = [f'第 {i} 个问题：中芯国际在晶圆制造行业中的地位如何？其服务范围和全球布局是怎样的？' for i in range(args.questions)]
+    if args.vector_dbs is None:
+        os.environ.setdefault('DASHSCOPE_API_KEY', 'fake')  # 请求只发往本地的假服务
+    client = DashscopeClient(limits={'generation': {'qps': 0}, 'embedding': {'qps': 0}})
+
+    if args.vector_dbs is not None:
+        results = run(args.vector_dbs, questions, args.max_workers, client)
+    else:
+        server = FakeDashscopeServer(args.llm_ms / 1000, args.embedding_ms / 1000, connect_latency=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        dashscope.base_http_api_url = f'http://127.0.0.1:{server.server_address[1]}/api/v1'
+        try:
+            with tempfile.TemporaryDirectory() as workspace:
+                workspace = Path(workspace)
+                build_index(workspace, args.chunks)
+                results = run(workspace, questions, args.max_workers, client)
+                check_hot_reload(workspace, args.chunks, client)
+        finally:
+            server.shutdown()
+
+    print(f'问题数: {args.questions}' + ('' if args.vector_dbs else f'，块数: {args.chunks}'))
+    baseline = results[0][1]
+    for name, rate in results:
+        print(f'{name}: {rate:.0f} 问题/分钟 ({rate / baseline:.1f}x)')
+    if args.vector_dbs is None:
+        print('索引文件更新后自动重新加载: OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+benchmark_reranking - LLMReranker.rerank_chunks 的重排延迟
+
+复用 benchmark_api_client.py 中的假 DashScope 服务：每次 generation 请求有固定延迟（RTT），
+同时进行的请求超过 --provider-limit 时返回 429。对 12 / 30 个候选块（每批 --batch-size 个）对比：
+  1. serial:   客户端并发上限为 1，逐批请求，不提前结束（改动前的行为），约 批数 x RTT
+  2. adaptive: 客户端并发上限 --concurrency，由 AIMD 并发窗口收敛到服务端的上限，约 ceil(批数 / 并发) x RTT
+每轮使用新的问题，不命中分数缓存。之后再检查：
+  - 分数缓存：同一问题再次重排不再请求 LLM
+  - 提前结束：已有 top_n 个高分块时跳过剩余批次，对比请求数
+
+用法（在 RAG-lab 目录下）: python benchmark_reranking.py --rtt-ms 200 --provider-limit 4 --concurrency 8 --rounds 5
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import os
+import statistics
+import threading
+import time
+
+import dashscope
+
+from benchmark_api_client import FakeDashscopeServer
+from src.api_client import DashscopeClient
+from src.reranking import LLMReranker, RerankScoreCache
+
+_question_ids = itertools.count()
+
+
+def make_chunks(n: int) -> list:
+    return [{'text': f'第 {i} 段：公司在晶圆制造行业的市场份额与产能布局', 'final_score': 1 - i / n} for i in range(n)]
+
+
+def new_question() -> str:
+    return f'第 {next(_question_ids)} 个问题：中芯国际在晶圆制造行业中的地位如何？'
+
+
+def rerank(reranker: LLMReranker, question: str, chunks: list, args, high_confidence_score=None):
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # 屏蔽重排过程中的输出
+        results = reranker.rerank_chunks(question, chunks, top_n=args.top_n, rerank_batch_size=args.batch_size,
+                                         high_confidence_score=high_confidence_score)
+    assert len(results) == min(args.top_n, len(chunks)), results
+    return (time.perf_counter() - t0) * 1000
+
+
+def requests_of(server: FakeDashscopeServer, fn) -> int:
+    before = server.requests
+    fn()
+    return server.requests - before
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rtt-ms', type=float, default=200, help='每次 generation 请求的延迟')
+    parser.add_argument('--provider-limit', type=int, default=4, help='服务端允许的最大并发请求数，超出返回 429')
+    parser.add_argument('--concurrency', type=int, default=8, help='客户端的并发上限')
+    parser.add_argument('--batch-size', type=int, default=3)
+    parser.add_argument('--top-n', type=int, default=6)
+    parser.add_argument('--rounds', type=int, default=5, help='每种候选数重复的次数')
+    args = parser.parse_args()
+    os.environ.setdefault('DASHSCOPE_API_KEY', 'fake')  # 请求只发往本地的假服务
+
+    server = FakeDashscopeServer(args.rtt_ms / 1000, 0, connect_latency=0, max_concurrency=args.provider_limit)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    dashscope.base_http_api_url = f'http://127.0.0.1:{server.server_address[1]}/api/v1'
+    serial = LLMReranker(DashscopeClient(limits={'generation': {'max_concurrency': 1, 'qps': 0}}),
+                         score_cache=RerankScoreCache())
+    adaptive_client = DashscopeClient(limits={'generation': {'max_concurrency': args.concurrency, 'qps': 0}},
+                                      initial_backoff=args.rtt_ms / 1000)
+    adaptive = LLMReranker(adaptive_client, score_cache=RerankScoreCache())
+
+    try:
+        print(f'RTT {args.rtt_ms:.0f} ms，服务端并发上限 {args.provider_limit}，每批 {args.batch_size} 块')
+        for n in (12, 30):
+            chunks = make_chunks(n)
+            t_serial = [rerank(serial, new_question(), chunks, args) for _ in range(args.rounds)]
+            throttled = server.throttled
+            t_adaptive = [rerank(adaptive, new_question(), chunks, args) for _ in range(args.rounds)]
+            throttled = server.throttled - throttled
+            print(f'{n} 个候选: serial {statistics.median(t_serial):.0f} ms, '
+                  f'adaptive {statistics.median(t_adaptive):.0f} ms '
+                  f'({statistics.median(t_serial) / statistics.median(t_adaptive):.1f}x), '
+                  f'429 {throttled} 次, 并发窗口 {adaptive_client.concurrency("generation")}')
+
+        chunks = make_chunks(30)
+        question = new_question()
+        rerank(adaptive, question, chunks, args)
+        num_requests = requests_of(server, lambda: print(f'缓存命中: {rerank(adaptive, question, chunks, args):.1f} ms, '
+                                                         f'命中 {adaptive.score_cache.hits} 次'))
+        assert num_requests == 0, num_requests
+
+        full = requests_of(server, lambda: rerank(adaptive, new_question(), chunks, args))
+        t_early = []
+        early = requests_of(server, lambda: t_early.append(rerank(adaptive, new_question(), chunks, args,
+                                                                  high_confidence_score=0.9)))
+        print(f'提前结束 (top_n={args.top_n}, 阈值 0.9): 请求 {full} -> {early} 次, {t_early[0]:.0f} ms')
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+api_client - DashScope 调用的共享客户端层
+
+整个流程（Pipeline → QuestionsProcessor → 检索、重排、回答生成，以及入库时的 embedding）共用一个客户端：
+    client = DashscopeClient(pool_size=16, limits={'generation': {'max_concurrency': 4, 'qps': 5}})
+    rsp = client.generation(model='qwen-turbo', messages=messages, result_format='message')
+    rsp = client.text_embedding(model='text-embedding-v1', input=texts)
+    client.stats()  # {'generation': {'calls': 12, 'throttled': 1, 'concurrency': 4, ...}, ...}
+
+- 连接池: 一个 requests.Session，keep-alive 的连接在调用之间复用，每个 host 最多保持 pool_size 个连接
+- 并发上限: 每类接口（generation / embedding）一个并发窗口，超出窗口的调用排队等待；
+  窗口按 AIMD 自适应：正常返回时逐步增大到 max_concurrency，遇到 429 或延迟明显变长时成倍减小
+- QPS 限制: 每类接口一个令牌桶，每秒补充 qps 个令牌、最多攒 burst 个，取不到令牌时等待（qps <= 0 不限速）
+- 限流重试: 返回 429 时按指数退避重试 max_retries 次
+- api_key 在每次调用时传给 SDK，不再修改 dashscope 模块级的全局变量
+get_default_client() 返回进程内共享的客户端，由环境变量 DASHSCOPE_POOL_SIZE、
+DASHSCOPE_GENERATION_CONCURRENCY / DASHSCOPE_GENERATION_QPS、DASHSCOPE_EMBEDDING_CONCURRENCY / DASHSCOPE_EMBEDDING_QPS 配置。
+"""
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import dashscope
+import requests
+from requests.adapters import HTTPAdapter
+
+# 每类接口默认的并发上限和每秒请求数
+DEFAULT_LIMITS = {
+    'generation': {'max_concurrency': 8, 'qps': 10},
+    'embedding': {'max_concurrency': 8, 'qps': 20},
+}
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多攒 burst 个；rate <= 0 表示不限速"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """取一个令牌，返回等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # 令牌不够时先预支，按欠下的令牌数计算等待时间，先到的调用先拿到
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class EndpointLimiter:
+    """
+    一类接口的并发上限 + QPS 限制。
+    并发窗口按 AIMD 调整：每次正常返回窗口加 1/窗口（约每轮加 1），直到 max_concurrency；
+    遇到 429 限流时窗口减半，延迟超过近期平均延迟的 latency_tolerance 倍时窗口乘以 0.8（最小为 1）。
+    """
+
+    def __init__(self, max_concurrency: int, qps: float, burst: Optional[int] = None,
+                 latency_tolerance: Optional[float] = 3.0):
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)  # 当前的并发窗口
+        self.latency_tolerance = latency_tolerance
+        self._bucket = TokenBucket(qps, burst)
+        self._cond = threading.Condition()
+        self._last_decrease = 0.0
+        self.avg_latency = None  # 延迟的指数滑动平均
+        self.calls = 0
+        self.throttled = 0
+        self.wait_time = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @contextmanager
+    def slot(self):
+        t0 = time.monotonic()
+        with self._cond:
+            while self.max_concurrency > 0 and self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            self._bucket.acquire()
+            with self._cond:
+                self.calls += 1
+                self.wait_time += time.monotonic() - t0
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify()
+
+    def on_success(self, latency: float):
+        with self._cond:
+            if self.avg_latency is None:
+                self.avg_latency = latency
+            if self.latency_tolerance and latency > self.latency_tolerance * self.avg_latency:
+                self._decrease(0.8)
+            elif self.max_concurrency > 0:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.avg_latency = 0.9 * self.avg_latency + 0.1 * latency
+            self._cond.notify_all()
+
+    def on_throttled(self):
+        with self._cond:
+            self.throttled += 1
+            self._decrease(0.5)
+
+    def _decrease(self, factor: float):
+        # 同一轮并发请求各自触发的信号只减一次：两次减小的间隔不小于平均延迟
+        now = time.monotonic()
+        if now - self._last_decrease >= (self.avg_latency or 1.0):
+            self.limit = max(1.0, self.limit * factor)
+            self._last_decrease = now
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'calls': self.calls,
+                'throttled': self.throttled,
+                'wait_time': self.wait_time,
+                'max_in_flight': self.max_in_flight,
+                'concurrency': int(self.limit),
+            }
+
+
+class DashscopeClient:
+
+    def __init__(self, api_key: Optional[str] = None, pool_size: int = 16, limits: Optional[Dict[str, dict]] = None,
+                 max_retries: int = 3, initial_backoff: float = 1.0):
+        """
+        :param api_key: 默认读取环境变量 DASHSCOPE_API_KEY
+        :param pool_size: 每个 host 保持的 keep-alive 连接数，应不小于各类接口的并发上限之和
+        :param limits: 覆盖 DEFAULT_LIMITS 中的配置，如 {'generation': {'max_concurrency': 4, 'qps': 5}}
+        :param max_retries: 被限流（429）时的最大重试次数，退避时间从 initial_backoff 秒开始指数增长
+        """
+        self.api_key = api_key or os.getenv('DASHSCOPE_API_KEY')
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        limits = limits or {}
+        self.limiters = {
+            endpoint: EndpointLimiter(**{
+                **default,
+                **limits.get(endpoint, {})
+            })
+            for endpoint, default in DEFAULT_LIMITS.items()
+        }
+
+    def generation(self, **kwargs):
+        """dashscope.Generation.call，参数与返回值与 SDK 相同"""
+        return self._call('generation', dashscope.Generation.call, kwargs)
+
+    def text_embedding(self, **kwargs):
+        """dashscope.TextEmbedding.call，参数与返回值与 SDK 相同"""
+        return self._call('embedding', dashscope.TextEmbedding.call, kwargs)
+
+    def _call(self, endpoint: str, fn, kwargs: dict):
+        limiter = self.limiters[endpoint]
+        backoff = self.initial_backoff
+        for attempt in range(self.max_retries + 1):
+            with limiter.slot():
+                t0 = time.monotonic()
+                rsp = fn(api_key=self.api_key, session=self.session, **kwargs)
+                latency = time.monotonic() - t0
+            if getattr(rsp, 'status_code', None) != 429:
+                limiter.on_success(latency)
+                return rsp
+            limiter.on_throttled()
+            if attempt < self.max_retries:
+                time.sleep(backoff * (1 + random.random()))
+                backoff *= 2
+        return rsp
+
+    def max_concurrency(self, endpoint: str) -> int:
+        return self.limiters[endpoint].max_concurrency
+
+    def concurrency(self, endpoint: str) -> int:
+        """AIMD 调整后当前的并发窗口"""
+        return int(self.limiters[endpoint].limit)
+
+    def stats(self) -> dict:
+        return {endpoint: limiter.stats() for endpoint, limiter in self.limiters.items()}
+
+    def close(self):
+        self.session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client() -> DashscopeClient:
+    """进程内共享的客户端，未显式传入 client 的处理器、检索器和重排器都使用它"""
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                limits = {}
+                for endpoint in DEFAULT_LIMITS:
+                    prefix = f'DASHSCOPE_{endpoint.upper()}'
+                    limits[endpoint] = {}
+                    if os.getenv(f'{prefix}_CONCURRENCY'):
+                        limits[endpoint]['max_concurrency'] = int(os.getenv(f'{prefix}_CONCURRENCY'))
+                    if os.getenv(f'{prefix}_QPS'):
+                        limits[endpoint]['qps'] = float(os.getenv(f'{prefix}_QPS'))
+                _default_client = DashscopeClient(pool_size=int(os.getenv('DASHSCOPE_POOL_SIZE', 16)), limits=limits)
+    return _default_client
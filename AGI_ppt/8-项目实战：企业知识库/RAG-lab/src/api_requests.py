@@ -4,17 +4,17 @@ api_requests - api处理器
 Author: lsy
 Date: 2026/1/8
 """
-import dashscope
 import src.prompts as prompts
-import os
 import json
+from typing import Optional
+from src.api_client import DashscopeClient, get_default_client
 
 class APIProcessor:
     # "openai" "dashscope" "gemini"
-    def __init__(self,provider:str="dashscope"):
+    def __init__(self,provider:str="dashscope",client:Optional[DashscopeClient]=None):
         self.provider = provider.lower()
         if self.provider=="dashscope":
-            self.processor = BaseDashscopeProcessor()
+            self.processor = BaseDashscopeProcessor(client)
 
 
     def get_answer_from_rag_context(self,question,rag_context,kind,model) -> dict:
@@ -43,9 +43,9 @@ class APIProcessor:
 
 # DashScope基础处理器，支持Qwen大模型对话
 class BaseDashscopeProcessor:
-    def __init__(self):
-        # 从环境变量读取API-KEY
-        dashscope.api_key = os.getenv("DASHSCOPE_API_KEY")
+    def __init__(self,client:Optional[DashscopeClient]=None):
+        # 共享的客户端（连接池 + 并发/QPS 限制），API-KEY 由客户端从环境变量读取
+        self.client = client or get_default_client()
         self.default_model = 'qwen-turbo-latest'
 
     def send_message(
@@ -78,7 +78,7 @@ class BaseDashscopeProcessor:
         # print('messages=', messages)
         # print('='*30)
         # 调用 dashscope Generation.call
-        response = dashscope.Generation.call(
+        response = self.client.generation(
             model=model,
             messages=messages,
             temperature=temperature,
@@ -4,34 +4,40 @@ ingestion - 提取分好块的.json文件入FAISS向量数据库
 Author: lsy
 Date: 2026/1/7
 """
-import os
 import json
 import numpy as np # 科学计算和数据分析
 import faiss
+from concurrent.futures import ThreadPoolExecutor
 
-import dashscope
 from dashscope import TextEmbedding
-from typing import Dict,List
+from typing import Dict,List,Optional
 from tqdm import tqdm
 from pathlib import Path
+from src.api_client import DashscopeClient, get_default_client
 
 
 class VectorDBIngestor:
-    def __init__(self):
-        dashscope.api_key = os.getenv("DASHSCOPE_API_KEY")
+    def __init__(self, client: Optional[DashscopeClient] = None):
+        self.client = client or get_default_client()
 
     def _get_embeddings(self, text_list, model:str = "text-embedding-v1") -> List[float]:
         # 获取文本或文本块的嵌入向量
         MAX_BATCH_SIZE = 25
-        embeddings = []
-        for i in range(0, len(text_list), MAX_BATCH_SIZE):
-            batch = text_list[i:i+MAX_BATCH_SIZE]
-            resp = TextEmbedding.call(
+        batches = [text_list[i:i+MAX_BATCH_SIZE] for i in range(0, len(text_list), MAX_BATCH_SIZE)]
+
+        def embed_batch(batch):
+            resp = self.client.text_embedding(
                 model=TextEmbedding.Models.text_embedding_v1,
                 input=batch,
             )
-            batch_embeddings = [item['embedding'] for item in resp.output['embeddings']]
-            embeddings.extend(batch_embeddings)
+            return [item['embedding'] for item in resp.output['embeddings']]
+
+        # 多个批次并发请求，并发数与 QPS 由客户端限制；map 按批次顺序返回，向量与文本一一对应
+        embeddings = []
+        max_workers = max(1, min(len(batches), self.client.max_concurrency('embedding')))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for batch_embeddings in executor.map(embed_batch, batches):
+                embeddings.extend(batch_embeddings)
         return embeddings
 
     def _create_vector_db(self,embeddings:List[float]):
@@ -12,10 +12,13 @@ from src.text_splitter import TextSplitter
 from pathlib import Path
 from src.ingestion import VectorDBIngestor
 from src.questions_processing import QuestionsProcessor
+from src.api_client import DashscopeClient, get_default_client
 
 class Pipeline:
-    def __init__(self):
-        pass
+    def __init__(self, client: DashscopeClient = None):
+        # 整个流程共用一个 DashScope 客户端，连接在各步骤、各问题之间复用
+        self.client = client or get_default_client()
+        self._questions_processor = None
 
     def chunk_reports(self):
         """将pdf解析后的报告进行分块处理，存储页码以及后面向量化"""
@@ -34,10 +37,23 @@ class Pipeline:
         output_dir = Path('../data/stock_data/databases/vector_dbs')
 
         # ingestor 提取器
-        vdb_ingestor = VectorDBIngestor()
+        vdb_ingestor = VectorDBIngestor(client=self.client)
         vdb_ingestor.process_reports(input_dir=input_dir, output_dir=output_dir)
         print(f'向量数据库已经创建到{output_dir}中')
 
+    def get_questions_processor(self) -> QuestionsProcessor:
+        """问题处理器在 Pipeline 的生命周期内只创建一次"""
+        if self._questions_processor is None:
+            self._questions_processor = QuestionsProcessor(
+                llm_ranking=False,
+                api_provider="dashscope",
+                answering_model="qwen-turbo",
+                vector_index_path=Path("../data/stock_data/databases/vector_dbs/all_reports.faiss"),
+                metadata_path=Path("../data/stock_data/databases/vector_dbs/all_metadata.json"),
+                client=self.client,
+            )
+        return self._questions_processor
+
     def answer_single_question(self,question:str,kind:str="summary"):
         """
         单条问题即时推理
@@ -45,17 +61,19 @@ class Pipeline:
         事实，原因，对比，总结，闲聊，其他（无关的）
         """
         t0=time.time()
-        processor = QuestionsProcessor(
-            llm_ranking=False,
-            api_provider="dashscope",
-            answering_model="qwen-turbo",
-            vector_index_path=Path("../data/stock_data/databases/vector_dbs/all_reports.faiss"),
-            metadata_path=Path("../data/stock_data/databases/vector_dbs/all_metadata.json")
-        )
+        processor = self.get_questions_processor()
         answer = processor.process_single_question(question,kind=kind)
         t1=time.time()
         print('大模型的回答：',answer)
 
+    def answer_questions(self,questions:list,kind:str="summary",max_workers:int=4) -> list:
+        """批量并发推理，共享已加载的索引"""
+        t0=time.time()
+        answers = self.get_questions_processor().process_questions(questions,kind=kind,max_workers=max_workers)
+        t1=time.time()
+        print(f'共 {len(questions)} 个问题，耗时 {t1-t0:.1f} 秒')
+        return answers
+
 if __name__ == '__main__':
     root_path=here()/"data"/"stock_data"
     # 初始化主流程，使用推荐的配置
@@ -4,11 +4,14 @@ questions_processing - 问题处理器
 Author: lsy
 Date: 2026/1/7
 """
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import List,Optional
 
+from src.api_client import DashscopeClient, get_default_client
 from src.api_requests import APIProcessor
 from src.retrieval import VectorRetriever
-from src.retrieval import HybridRetriever
+from src.retrieval import HybridRetriever, get_hybrid_retriever
 
 class QuestionsProcessor:
     def __init__(
@@ -18,13 +21,16 @@ class QuestionsProcessor:
         answering_model:str="qwen-turbo-lastest",
         vector_index_path:Path=None,
         metadata_path:Path=None,
+        client:Optional[DashscopeClient]=None,
     ):
         self.llm_ranking = llm_ranking
         self.api_provider = api_provider
         self.answering_model = answering_model
         self.vector_index_path = vector_index_path
         self.metadata_path = metadata_path
-        self.api_processor = APIProcessor(provider=self.api_provider)
+        # 检索、重排与回答生成共用一个客户端（连接池 + 并发/QPS 限制）
+        self.client = client or get_default_client()
+        self.api_processor = APIProcessor(provider=self.api_provider,client=self.client)
 
     # def __format_retrieval_results(self, retrieval_results) -> str:
     #     """将检索结果转化为RAG上下文字符串，优化大模型理解"""
@@ -94,11 +100,15 @@ class QuestionsProcessor:
         rag_text = "\n".join(context_parts)
         return rag_text
 
+    def _get_retriever(self) -> HybridRetriever:
+        """进程内共享的检索器，索引只加载一次，索引文件更新后自动重新加载"""
+        return get_hybrid_retriever(self.vector_index_path, self.metadata_path, client=self.client)
+
     def process_single_question(self,question:str,kind:str) -> dict:
         """单条问题推理，返回结构化答案"""
         # retrieval=Hybridretrieval()
         # retrieval=VectorRetriever(vector_index_path=self.vector_index_path,metadata_path=self.metadata_path)
-        retrieval=HybridRetriever(vector_index_path=self.vector_index_path,metadata_path=self.metadata_path)
+        retrieval=self._get_retriever()
         relevant_chunks = retrieval.hybrid_retriever_chunks(question=question,llm_reranking_sample_size=12)
 
         rag_context = self.__format_retrieval_results(relevant_chunks)
@@ -109,3 +119,22 @@ class QuestionsProcessor:
             model=self.answering_model
         )
         return answer_dict
+
+    def process_questions(self,questions:List[str],kind:str="summary",max_workers:int=4) -> List[dict]:
+        """
+        并发处理一批问题，按输入顺序返回答案。
+        所有问题共用同一份检索器（索引只加载一次），模型调用的并发与 QPS 由共享客户端限制。
+        单个问题失败时返回带 error 字段的答案，不影响其他问题。
+        """
+        self._get_retriever() # 先加载索引，避免各线程同时等待
+
+        def process(question):
+            try:
+                return self.process_single_question(question,kind=kind)
+            except Exception as e:
+                print(f"问题处理失败: {question[:50]}... {e}")
+                return {"final_answer": None, "error": str(e), "step_by_step_analysis": "",
+                        "reasoning_summary": "", "relevant_pages": []}
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            return list(executor.map(process, questions))
@@ -4,18 +4,65 @@ reranking - 重排
 Author: lsy
 Date: 2026/1/15
 """
-import os
+import hashlib
 import re
+import threading
 import src.prompts as prompts
-from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+from src.api_client import DashscopeClient, get_default_client
+from src.embedding_cache import normalize_query
+
+
+class RerankScoreCache:
+    """(问题哈希, 块哈希) -> 相关性分数 的 LRU 缓存，同一问题再次重排时已评过分的块不再请求 LLM"""
+
+    def __init__(self, max_size: int = 50000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._scores = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(question: str, text: str):
+        return (hashlib.sha256(normalize_query(question).encode('utf-8')).hexdigest(),
+                hashlib.sha256(text.encode('utf-8')).hexdigest())
+
+    def get(self, question: str, text: str) -> Optional[float]:
+        key = self.make_key(question, text)
+        with self._lock:
+            score = self._scores.get(key)
+            if score is None:
+                self.misses += 1
+                return None
+            self._scores.move_to_end(key)
+            self.hits += 1
+            return score
+
+    def put(self, question: str, text: str, score: float):
+        key = self.make_key(question, text)
+        with self._lock:
+            self._scores[key] = score
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.max_size:
+                self._scores.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+            self.hits = self.misses = 0
+
+
+_default_score_cache = RerankScoreCache()
+
 
 class LLMReranker:
-    def __init__(self):
+    def __init__(self, client: Optional[DashscopeClient] = None, score_cache: Optional[RerankScoreCache] = None):
         self.system_prompt_rerank_multiple_blocks = prompts.RerankingPrompt.system_prompt_rerank_multiple_blocks
-
-        import dashscope
-        dashscope.api_key=os.getenv("DASHSCOPE_API_KEY")
-        self.llm = dashscope
+        self.client = client or get_default_client()
+        self.score_cache = score_cache or _default_score_cache
 
     def _parse_rankings(self, content: str, total_blocks: int):
         """
@@ -94,7 +141,7 @@ class LLMReranker:
         ]
 
         # 调用 LLM
-        rsp = self.llm.Generation.call(
+        rsp = self.client.generation(
             model="qwen-turbo",
             messages=messages,
             temperature=0,
@@ -110,15 +157,18 @@ class LLMReranker:
         else:
             raise RuntimeError(f"DashScope返回格式异常: {rsp}")
 
-    def rerank_chunks(self, question, retrieved_chunks, top_n, rerank_batch_size):
+    def rerank_chunks(self, question, retrieved_chunks, top_n, rerank_batch_size, high_confidence_score=0.9):
         """
         使用多线程并行方式对多个文档进行重排。
+        已缓存分数的块直接复用，其余块按混合检索分数从高到低分批，并行请求 LLM，并发数由客户端按限流情况自适应调整。
+        已得到 top_n 个分数不低于 high_confidence_score 的块时，不再发出剩余批次的请求。
 
         Args:
             question (str): 查询语句
             retrieved_chunks (list): 待重排的文档列表，每个元素是 {'text': str, 'final_score': float}
             top_n (int): 重排后返回的块个数
             rerank_batch_size (int): 每批处理的块数量
+            high_confidence_score (float): 提前结束的分数阈值，None 表示总是对全部块评分
 
         Returns:
             list: 重排后的块列表，按相关性分数从高到低排序
@@ -126,14 +176,39 @@ class LLMReranker:
         if not retrieved_chunks:
             return []
 
-        # 按批次分组
-        chunk_batches = [retrieved_chunks[i:i+rerank_batch_size]
-                        for i in range(0, len(retrieved_chunks), rerank_batch_size)]
-
-        print(f"共 {len(retrieved_chunks)} 个块，分为 {len(chunk_batches)} 批进行重排...")
+        all_results = []
+        uncached_chunks = []
+        for chunk in retrieved_chunks:
+            score = self.score_cache.get(question, chunk['text'])
+            if score is None:
+                uncached_chunks.append(chunk)
+            else:
+                all_results.append({
+                    'text': chunk['text'],
+                    'relevance_score': score,
+                    'original_score': chunk.get('final_score', 0)
+                })
+
+        def enough_confident(results):
+            if high_confidence_score is None:
+                return False
+            return sum(r['relevance_score'] >= high_confidence_score for r in results) >= top_n
+
+        # 按混合检索分数排序后分批，最可能相关的块先评分
+        uncached_chunks.sort(key=lambda c: c.get('final_score', 0), reverse=True)
+        chunk_batches = [uncached_chunks[i:i+rerank_batch_size]
+                        for i in range(0, len(uncached_chunks), rerank_batch_size)]
+
+        print(f"共 {len(retrieved_chunks)} 个块，{len(all_results)} 个命中缓存，其余分为 {len(chunk_batches)} 批进行重排...")
+
+        stop = threading.Event()
+        if enough_confident(all_results):
+            stop.set()
 
         # 处理每一批
         def process_chunk(batch):
+            if stop.is_set():
+                return []
             texts = [chunk['text'] for chunk in batch]
             # 调用 LLM 获取评分
             rankings = self.get_rank_for_multiple_blocks(question, texts)
@@ -143,6 +218,7 @@ class LLMReranker:
             for rank_item in rankings:
                 block_id = rank_item['block_id'] - 1  # block_id 是从 1 开始的，list 索引从 0 开始
                 if 0 <= block_id < len(batch):
+                    self.score_cache.put(question, batch[block_id]['text'], rank_item['relevance_score'])
                     results.append({
                         'text': batch[block_id]['text'],
                         'relevance_score': rank_item['relevance_score'],
@@ -152,14 +228,21 @@ class LLMReranker:
 
             return results
 
-        # 使用多线程处理（max_workers=1 串行调用，避免 QPS 超限）
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            batch_results = list(executor.map(process_chunk, chunk_batches))
-
-        # 扁平化所有批次的结果
-        all_results = []
-        for batch in batch_results:
-            all_results.extend(batch)
+        # 使用多线程并行处理，实际同时发出的请求数与 QPS 由客户端的 AIMD 并发窗口和令牌桶控制
+        if chunk_batches and not stop.is_set():
+            max_workers = min(len(chunk_batches), self.client.max_concurrency('generation') or len(chunk_batches))
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            try:
+                futures = [executor.submit(process_chunk, batch) for batch in chunk_batches]
+                for future in as_completed(futures):
+                    all_results.extend(future.result())
+                    if enough_confident(all_results):
+                        stop.set()
+                        print("已找到足够的高相关性块，跳过剩余批次")
+                        break
+            finally:
+                # 提前结束时不等待已发出的请求，它们返回后仍会写入分数缓存
+                executor.shutdown(wait=False, cancel_futures=True)
 
         # 按 relevance_score 从高到低排序
         if all_results:
@@ -169,4 +252,3 @@ class LLMReranker:
 
         # 返回 top_n 个结果
         return all_results[:top_n]
-        # print(all_results)
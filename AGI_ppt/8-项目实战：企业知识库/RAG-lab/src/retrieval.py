@@ -5,16 +5,18 @@ Author: lsy
 Date: 2026/1/7
 """
 import os
-from typing import List,Dict
+import threading
+from typing import List,Dict,Optional,Tuple
 from pathlib import Path
 import json
 import faiss
-import dashscope
 import numpy as np
 import glob
-from rank_bm25 import BM25Okapi
 import jieba
 from src.reranking import LLMReranker
+from src.embedding_cache import EmbeddingCache, get_default_cache
+from src.api_client import DashscopeClient, get_default_client
+from src.sparse_bm25 import SparseBM25, top_k_indices
 
 class BM25Retriever:
     def __init__(self, metadata_path: Path):
@@ -38,8 +40,8 @@ class BM25Retriever:
         # 2. 分词 - 使用jieba将中文文本切成词语列表（构建索引的关键）
         self.corpus_tokens = [list(jieba.cut(doc['text'])) for doc in self.documents]
 
-        # 3. 初始化 BM25 模型
-        self.bm25 = BM25Okapi(self.corpus_tokens)
+        # 3. 初始化 BM25 模型（CSR 稀疏矩阵，idf 和长度归一化在建索引时预先算好）
+        self.bm25 = SparseBM25(self.corpus_tokens)
 
     @staticmethod
     def normalize_scores(scores):
@@ -57,9 +59,9 @@ class BM25Retriever:
     def retrieve(self, question:str,top_n:int=20):
         """检索相关文档"""
         question_tokens = list(jieba.cut(question)) # 问题分词
-        raw_scores = self.bm25.get_scores(question_tokens) # 获取文档得分（返回的是文档在列表中的索引）
+        raw_scores = self.bm25.get_scores(question_tokens) # 获取文档得分（一次稀疏矩阵乘法）
         normalized_scores = self.normalize_scores(raw_scores) # 归一化
-        top_n_indices = normalized_scores.argsort()[-top_n:][::-1] # 倒序取前k个
+        top_n_indices = top_k_indices(normalized_scores, top_n) # argpartition 取前k个，不对全量排序
         # 组装结果
         results = []
         for index in top_n_indices:
@@ -70,15 +72,19 @@ class BM25Retriever:
         return results
 
 class VectorRetriever:
-    def __init__(self,vector_index_path:Path, metadata_path:Path,embedding_provider:str="dashscope"):
+    def __init__(self,vector_index_path:Path, metadata_path:Path,embedding_provider:str="dashscope",
+                 embedding_cache:Optional[EmbeddingCache]=None,client:Optional[DashscopeClient]=None):
         """
         :param vector_index_path: FAISS向量索引文件路径
         :param metadata_path: 文档元数据文件路径
+        :param embedding_cache: 查询向量缓存，默认使用进程内共享的缓存
+        :param client: DashScope 客户端，默认使用进程内共享的客户端
         """
         self.vector_index_path=vector_index_path
         self.metadata_path=metadata_path
         self.embedding_provider=embedding_provider
-        self._set_up_llm() # 设置大模型提供商
+        self.embedding_cache = embedding_cache or get_default_cache()
+        self.client = client or get_default_client()
 
         # 定义实例变量但不赋值，用于后续缓存
         self._index = None
@@ -112,12 +118,12 @@ class VectorRetriever:
         with open(self.metadata_path, 'rb') as f:
             self._metadata_list = json.load(f)
 
-    def _set_up_llm(self):
-        if self.embedding_provider=="dashscope":
-            dashscope.api_key=os.getenv('DASHSCOPE_API_KEY')
-
     def _get_embedding(self,text:str):
-        resp = dashscope.TextEmbedding.call(
+        # 重复的问题直接复用缓存的向量（已归一化）
+        return self.embedding_cache.get_or_compute(text, self._compute_embedding, namespace='text-embedding-v1')
+
+    def _compute_embedding(self,text:str):
+        resp = self.client.text_embedding(
             model='text-embedding-v1',
             input=[text],
         )
@@ -158,10 +164,10 @@ class VectorRetriever:
         return retrieval_results
 
 class HybridRetriever:
-    def __init__(self,vector_index_path:Path, metadata_path:Path):
-        self.vector_retriever = VectorRetriever(vector_index_path,metadata_path)
+    def __init__(self,vector_index_path:Path, metadata_path:Path, client:Optional[DashscopeClient]=None):
+        self.vector_retriever = VectorRetriever(vector_index_path,metadata_path,client=client)
         self.bm25_retriever = BM25Retriever(metadata_path)
-        self.reranker=LLMReranker()
+        self.reranker=LLMReranker(client=client)
 
     @staticmethod
     def _merge_hybrid_results(vector_results, bm25_results, x=0.6):
@@ -240,3 +246,47 @@ class HybridRetriever:
         return reranked_results
 
 
+
+
+# 进程内共享的混合检索器：(索引路径, 元数据路径, 客户端) -> {'signature', 'retriever', 'lock'}
+_hybrid_retrievers = {}
+_hybrid_retrievers_lock = threading.Lock()
+
+
+def _file_signature(*paths:Path) -> Tuple:
+    """文件的 (修改时间, 大小)，任一文件被重新生成时签名改变"""
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def get_hybrid_retriever(vector_index_path:Path, metadata_path:Path,
+                         client:Optional[DashscopeClient]=None) -> HybridRetriever:
+    """
+    返回进程内共享的混合检索器：同一份索引只加载一次（FAISS 索引、元数据、BM25 分词），所有问题、所有线程共用。
+    每次获取时检查索引和元数据文件的修改时间与大小，文件被重新生成后自动重新加载；
+    重新加载期间其他线程继续使用旧的检索器，加载完成后再切换。
+    """
+    key = (str(Path(vector_index_path).resolve()), str(Path(metadata_path).resolve()), client)
+    with _hybrid_retrievers_lock:
+        entry = _hybrid_retrievers.setdefault(key, {'signature': None, 'retriever': None, 'lock': threading.Lock()})
+
+    signature = _file_signature(vector_index_path, metadata_path)
+    if entry['signature'] == signature:
+        return entry['retriever']
+    if entry['retriever'] is not None:
+        if not entry['lock'].acquire(blocking=False):
+            return entry['retriever']  # 其他线程正在重新加载，先用旧的
+    else:
+        entry['lock'].acquire()  # 第一次加载，等待加载完成
+    try:
+        if entry['signature'] != signature:
+            if entry['retriever'] is not None:
+                print(f'[HybridRetriever] 检测到索引文件变化，重新加载 {vector_index_path}')
+            entry['retriever'] = HybridRetriever(vector_index_path, metadata_path, client=client)
+            entry['signature'] = signature
+        return entry['retriever']
+    finally:
+        entry['lock'].release()